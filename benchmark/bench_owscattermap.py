@@ -0,0 +1,212 @@
+"""
+Benchmark the Scatter Map rendering pipeline.
+
+Times the stages of the scatter map hot path separately on synthetic
+point clouds:
+
+* ``get_root``: binning of the root node
+* ``sharpen``: refining the root (one level, in the whole view)
+* ``resample``: level of detail resampling (per LOD)
+* ``patch``: `Patch_create` including the evaluation of all pictures
+  (per LOD)
+* ``paint``: `DensityPatch.paint` onto an image (per LOD, cold and with
+  the patch cache populated)
+
+and reports the peak (traced) memory of each stage and the resident set
+size of the process. The peak memory is traced in a separate run of each
+stage so the tracing overhead does not inflate the timings. The paint
+stages run without the background prefetch of adjacent levels.
+
+Run with::
+
+    QT_QPA_PLATFORM=offscreen python benchmark/bench_owscattermap.py \\
+        --sizes 1e5 1e6 1e7
+
+Use ``--profile FILE`` to also store the cProfile statistics of the run
+(e.g. for ``snakeviz`` or ``python -m pstats FILE``).
+"""
+import os
+import sys
+import time
+import argparse
+import cProfile
+import resource
+import tracemalloc
+
+import numpy as np
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from AnyQt.QtCore import Qt, QRectF
+from AnyQt.QtGui import QImage, QPainter
+from AnyQt.QtWidgets import QApplication, QStyleOptionGraphicsItem
+
+from Orange.data import Table, Domain, ContinuousVariable, DiscreteVariable
+
+from orangecontrib.prototypes.widgets.owscattermap import (
+    OWScatterMap, DensityPatch, lod_patch, grid_bin, candidate_cells,
+    bin_node_cells
+)
+
+
+def synthetic_cloud(n, classes=3, seed=0):
+    """
+    Return a table of `n` points in `classes` overlapping gaussian
+    clusters (and a uniform background).
+    """
+    rs = np.random.RandomState(seed)
+    centers = rs.uniform(-5, 5, size=(classes, 2))
+    y = rs.randint(classes, size=n)
+    spread = rs.uniform(0.5, 2, classes)
+    X = centers[y] + rs.standard_normal((n, 2)) * spread[y, None]
+    background = rs.rand(n) < 0.05
+    X[background] = rs.uniform(-10, 10, size=(background.sum(), 2))
+    values = [str(i) for i in range(classes)]
+    domain = Domain([ContinuousVariable("x"), ContinuousVariable("y")],
+                    DiscreteVariable("c", values=values))
+    return Table.from_numpy(domain, X, y.astype(float))
+
+
+def measure(results, row, func, setup=None):
+    """
+    Time `func()` and trace its peak memory in a separate run.
+
+    `setup` (if given) is called before each run to restore the state
+    `func` expects. Return the result of the timed run.
+    """
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - start
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results.append(row + (elapsed, peak))
+    return value
+
+
+class NoPrefetchPatch(DensityPatch):
+    """A `DensityPatch` painting only the visible level of detail."""
+    def _prefetch(self, p, p_min, p_max):
+        pass
+
+
+def paint(item, image, zoom):
+    """Paint `item` into `image` zoomed in by `zoom` (around the center)."""
+    rect = item.boundingRect()
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    scale = min(image.width() / rect.width(),
+                image.height() / rect.height()) * zoom
+    painter.translate(image.width() / 2, image.height() / 2)
+    painter.scale(scale, scale)
+    painter.translate(-rect.center())
+    option = QStyleOptionGraphicsItem()
+    option.exposedRect = painter.worldTransform().inverted()[0].mapRect(
+        QRectF(image.rect()))
+    item.paint(painter, option, None)
+    painter.end()
+
+
+def bench_size(widget, n, results, zooms, image_size):
+    data = synthetic_cloud(n)
+    xvar, yvar = data.domain.attributes
+    zvar = data.domain.class_var
+
+    root = measure(results, ("get_root", n, ""),
+                   lambda: widget.get_root(data, xvar, yvar, zvar))
+
+    def bin_func(xbins, ybins):
+        return grid_bin(data, xvar, yvar, xbins, ybins, zvar)
+
+    def sharpen():
+        node = root.node(0, 0)
+        rows, cols, _ = candidate_cells(node, QRectF(*root.brect))
+        refined = bin_node_cells(node, (rows, cols), widget.n_bins, bin_func)
+        return root.expand(0, [(0, ) + refined])
+
+    flat = measure(results, ("sharpen", n, ""), sharpen)
+
+    nbins = flat.nbins
+    p_min = - int(np.log2(nbins ** (flat.depth() - 1)))
+    p_max = int(np.log2(nbins))
+    for p in range(p_min, p_max + 1):
+        measure(results, ("resample", n, p),
+                lambda: flat.resample(2 ** p))
+        measure(results, ("patch", n, p),
+                lambda: lod_patch(flat, p).picture())
+
+    item = NoPrefetchPatch(flat, cell_size=10, palette=widget.colors)
+    image = QImage(image_size, image_size, QImage.Format_ARGB32_Premultiplied)
+    for zoom in zooms:
+        # (the item picks the LOD for the zoom level)
+        lod = "x{:g}".format(zoom)
+        measure(results, ("paint (cold)", n, lod),
+                lambda: paint(item, image, zoom),
+                setup=lambda: item.set_root(flat))
+        measure(results, ("paint (cached)", n, lod),
+                lambda: paint(item, image, zoom),
+                setup=lambda: paint(item, image, zoom))
+
+    assert flat.max() > 0
+    del data
+
+
+def report(results, out=sys.stdout):
+    header = ("stage", "points", "lod", "time [ms]", "peak [MB]")
+    print("{:<16}{:>12}{:>8}{:>12}{:>12}".format(*header), file=out)
+    for stage, size, lod, elapsed, peak in results:
+        print("{:<16}{:>12}{:>8}{:>12.2f}{:>12.2f}".format(
+            stage, size, lod, elapsed * 1000, peak / 2 ** 20), file=out)
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        maxrss /= 1024
+    print("max RSS: {:.1f} MB".format(maxrss / 1024), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=float,
+                        default=[1e5, 1e6],
+                        help="number of points of the synthetic clouds "
+                             "(default: %(default)s)")
+    parser.add_argument("--zooms", nargs="+", type=float,
+                        default=[1, 4, 16, 64],
+                        help="zoom factors for painting "
+                             "(default: %(default)s)")
+    parser.add_argument("--image-size", type=int, default=800,
+                        help="size of the painted image (default: "
+                             "%(default)s)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="store cProfile statistics to FILE")
+    args = parser.parse_args(argv)
+
+    app = QApplication([])
+    widget = OWScatterMap()
+    results = []
+
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        profile.enable()
+    for n in args.sizes:
+        bench_size(widget, int(n), results, args.zooms, args.image_size)
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.profile)
+
+    report(results)
+    widget.onDeleteWidget()
+    del widget, app
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
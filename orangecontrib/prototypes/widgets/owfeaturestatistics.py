@@ -5,37 +5,44 @@ TODO:
     or quartile coefficient of dispersion (Q3 - Q1) / (Q3 + Q1)
   - Standard deviation for nominal: try out Variation ratio (1 - n_mode/N)
 """
+import os
 import datetime
+import itertools
 import locale
+import logging
+import concurrent.futures
 from enum import IntEnum
-from typing import Any, Optional, Tuple, List  # pylint: disable=unused-import
+from functools import partial, reduce
+from operator import attrgetter
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, List, Dict  # pylint: disable=unused-import
 
 import numpy as np
-import scipy.stats as ss
+import scipy.sparse as sp
 from AnyQt.QtCore import Qt, QSize, QRectF, QVariant, QModelIndex, pyqtSlot, \
-    QRegExp, QItemSelection, QItemSelectionRange, QItemSelectionModel
-from AnyQt.QtGui import QPainter, QColor
+    QRegExp, QItemSelection, QItemSelectionRange, QItemSelectionModel, QThread
+from AnyQt.QtGui import QPainter, QColor, QPixmap
 from AnyQt.QtWidgets import QStyleOptionViewItem
-from AnyQt.QtWidgets import QStyledItemDelegate, QGraphicsScene, QTableView, \
+from AnyQt.QtWidgets import QStyledItemDelegate, QTableView, \
     QHeaderView, QStyle
 
-import Orange.statistics.util as ut
 from Orange.canvas.report import plural
 from Orange.data import Table, StringVariable, DiscreteVariable, \
     ContinuousVariable, TimeVariable, Domain, Variable
 from Orange.widgets import widget, gui
 from Orange.widgets.settings import ContextSetting, DomainContextHandler
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher, \
+    methodinvoke
 from Orange.widgets.utils.itemmodels import DomainModel, AbstractSortTableModel
 from Orange.widgets.utils.signals import Input, Output
-from orangecontrib.prototypes.widgets.utils.histogram import Histogram
+from orangecontrib.prototypes.widgets.utils import blocks
+from orangecontrib.prototypes.widgets.utils.blocks import ColumnBlocks, \
+    is_memmap
+from orangecontrib.prototypes.widgets.utils.histogram import Histograms, \
+    HistogramBins, HistogramItem, histogram_bins, compute_histograms, \
+    histogram_colors, paint_histogram
 
-
-def _categorical_entropy(x):
-    """Compute the entropy of a dense/sparse matrix, column-wise. Assuming
-    categorical values."""
-    p = [ut.bincount(row)[0] for row in x.T]
-    p = [pk / np.sum(pk) for pk in p]
-    return np.fromiter((ss.entropy(pk) for pk in p), dtype=np.float64)
+log = logging.getLogger(__name__)
 
 
 def format_time_diff(start, end, round_up_after=2):
@@ -88,6 +95,43 @@ def format_time_diff(start, end, round_up_after=2):
         return '%d seconds' % seconds
 
 
+def _next_block(todo, visible, statistics, block_size):
+    """Choose the next block of statistics to compute.
+
+    Parameters
+    ----------
+    todo : np.ndarray
+        A (n_statistics, n_variables) boolean array of the statistics to
+        compute.
+    visible : np.ndarray
+        The indices of the visible variables, computed first.
+    statistics : Sequence[int]
+        The statistics needed to sort, computed (for larger blocks of
+        variables) after the visible variables.
+    block_size : int
+
+    Returns
+    -------
+    Tuple[List[int], np.ndarray]
+        The rows of the statistics (those still to compute for any of the
+        variables) and the (sorted) indices of variables.
+    """
+    def block(indices):
+        return np.flatnonzero(todo[:, indices].any(axis=1)).tolist(), indices
+
+    pending = todo.any(axis=0)
+    visible = visible[visible < len(pending)]
+    visible = visible[pending[visible]]
+    if len(visible):
+        return block(np.sort(visible[:block_size]))
+    statistics = [row for row in statistics if todo[row].any()]
+    if statistics:
+        # A single statistic is cheaper, so take more variables at once
+        indices = np.flatnonzero(todo[statistics].any(axis=0))
+        return statistics, indices[:block_size * 16]
+    return block(np.flatnonzero(pending)[:block_size])
+
+
 class FeatureStatisticsTableModel(AbstractSortTableModel):
     CLASS_VAR, META, ATTRIBUTE = range(3)
     COLOR_FOR_ROLE = {
@@ -97,9 +141,14 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
     }
 
     HIDDEN_VAR_TYPES = (StringVariable,)
+    #: The number of columns of dense matrices processed as a single job
+    COLUMN_BLOCK_SIZE = 256
+    #: The number of variables whose histograms are computed at once
+    HISTOGRAM_BLOCK_SIZE = 1024
 
     class Columns(IntEnum):
-        ICON, NAME, DISTRIBUTION, CENTER, DISPERSION, MIN, MAX, MISSING = range(8)
+        ICON, NAME, DISTRIBUTION, CENTER, DISPERSION, MIN, MAX, MISSING, \
+            MEDIAN, IQR = range(10)
 
         @property
         def name(self):
@@ -111,6 +160,8 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
                     self.MIN: 'Min.',
                     self.MAX: 'Max.',
                     self.MISSING: 'Missing',
+                    self.MEDIAN: 'Median',
+                    self.IQR: 'IQR',
                     }[self.value]
 
         @property
@@ -121,6 +172,26 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         def from_index(cls, index):
             return cls(index)
 
+    #: The columns of the statistics (rows of `compute_statistics`)
+    STATISTICS = (Columns.CENTER, Columns.DISPERSION, Columns.MIN,
+                  Columns.MAX, Columns.MISSING, Columns.MEDIAN, Columns.IQR)
+    #: The statistics (rows of `compute_statistics`) needed to sort by a column
+    SORT_STATISTICS = {
+        Columns.CENTER: (0,),
+        # (time variables are sorted by their range)
+        Columns.DISPERSION: (1, 2, 3),
+        Columns.MIN: (2,),
+        Columns.MAX: (3,),
+        Columns.MISSING: (4,),
+        Columns.MEDIAN: (5,),
+        Columns.IQR: (6,),
+    }
+    #: The order in which the variable types are grouped when sorting
+    SORT_TYPES = (DiscreteVariable, ContinuousVariable, TimeVariable,
+                  StringVariable)
+    #: The values of the type meta of the statistics table (for `SORT_TYPES`)
+    TYPE_NAMES = ('categorical', 'numeric', 'time', 'text')
+
     def __init__(self, data=None, parent=None):
         """
 
@@ -138,13 +209,41 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         self.n_attributes = self.n_instances = 0
 
         self.__attributes = self.__class_vars = self.__metas = None
-        self.__distributions_cache = {}
+        # The bins of the histograms (for each matrix) and the histograms for
+        # the current target variable of the blocks of variables
+        self.__histogram_bins = {}  # type: Dict[int, List[HistogramBins]]
+        self.__histograms = {}  # type: Dict[int, Histograms]
+        # Which statistics (rows of `compute_statistics`) of which variables
+        # are known
+        self._computed = np.zeros((len(self.STATISTICS), 0), dtype=bool)
+        # The (mergeable) summary of the variables, unless computed lazily
+        self._summary = None  # type: Optional[blocks.Summary]
+        # The sort keys of the columns and their ranks for each sort order
+        # (both in the source order), computed once per data set
+        self.__sort_keys = {}  # type: Dict[int, np.ndarray]
+        self.__sort_ranks = {}  # type: Dict[Tuple[int, Qt.SortOrder], Tuple]
+        # The statistics as a table, built on demand
+        self.__statistics_table = None  # type: Optional[Table]
         # Clear model initially to set default values
         self.clear()
 
         self.set_data(data)
 
-    def set_data(self, data):
+    def set_data(self, data, summary=None, lazy=False):
+        """Set the data.
+
+        Parameters
+        ----------
+        data : Optional[Table]
+        summary : Optional[blocks.Summary]
+            The summary of `data` as returned by `compute_summary`; computed
+            (on the calling thread) if not given. The median and IQR are
+            only known if the summary includes the quantile sketches.
+        lazy : bool
+            If True (and `summary` is not given), the statistics are not
+            computed, but must be set later with `set_statistics`.
+
+        """
         if data is None:
             self.clear()
             return
@@ -154,17 +253,93 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         self.domain = domain = data.domain
         self.target_var = None
 
-        self.__attributes = self.__filter_attributes(domain.attributes, self.table.X)
-        self.__class_vars = self.__filter_attributes(domain.class_vars, self.table._Y)
-        self.__metas = self.__filter_attributes(domain.metas, self.table.metas)
+        self.__attributes, self.__class_vars, self.__metas = \
+            self.__filter_matrices(data)
 
         self.n_attributes = len(self.variables)
         self.n_instances = len(data)
 
-        self.__distributions_cache = {}
-        self.__compute_statistics()
+        self.__histogram_bins, self.__histograms = {}, {}
+        self.__sort_keys, self.__sort_ranks = {}, {}
+        self.__statistics_table = None
+        self._type_codes = self.__type_codes(self.variables)
+        # (dense ranks, so variables with the same name compare equal)
+        _, self._name_ranks = np.unique(
+            [var.name.lower() for var in self.variables], return_inverse=True)
+        if summary is None and lazy:
+            self._summary = None
+            statistics = np.full((len(self.STATISTICS), self.n_attributes),
+                                 np.nan)
+            self._computed = np.zeros(statistics.shape, dtype=bool)
+        else:
+            if summary is None:
+                _, summary = self.compute_summary(data)
+            self._summary = summary
+            statistics = self.summary_statistics(self.variables, summary)
+            self._computed = np.ones(statistics.shape, dtype=bool)
+            if summary is not None and summary.sketch is None:
+                # The median and IQR of the numeric variables are computed
+                # later (see `compute_statistics`)
+                _, cont_idx, time_idx, _ = self._attr_indices(self.variables)
+                self._computed[np.ix_(self.__QUANTILE_ROWS,
+                                      list(cont_idx) + list(time_idx))] = False
+        # (the rows are views, so `set_statistics` can fill them in)
+        self._statistics = statistics
+        (self._center, self._dispersion, self._min, self._max,
+         self._missing, self._median, self._iqr) = statistics
         self.endResetModel()
 
+    def extends(self, data):
+        """Return True if `data` is the current table with more rows
+        appended (the same domain and the ids of the current rows) and the
+        summary of the current table is known."""
+        return self._summary is not None and data is not None \
+            and self.table is not None and data.domain == self.domain \
+            and len(data) > self.n_instances \
+            and np.array_equal(data.ids[:self.n_instances], self.table.ids)
+
+    def append_data(self, data):
+        """Set `data`, which `extends` the current table; only the appended
+        rows are summarized and merged into the current summary."""
+        assert self.extends(data)
+        _, summary = self.compute_summary(data[self.n_instances:])
+        self.set_data(data, blocks.merge_summaries(self._summary, summary))
+
+    def set_statistics(self, rows, indices, values):
+        """Set (some of) the statistics of some variables.
+
+        Parameters
+        ----------
+        rows : List[int]
+            The rows of `values` (as returned by `compute_statistics`) to set.
+        indices : np.ndarray
+            The indices of the variables.
+        values : np.ndarray
+            A (n_statistics, len(indices)) array of statistics.
+
+        """
+        rows = np.asarray(rows, dtype=int)
+        self._statistics[np.ix_(rows, indices)] = values[rows]
+        self._computed[np.ix_(rows, indices)] = True
+        self.__statistics_table = None
+        for column, needed in self.SORT_STATISTICS.items():
+            if np.isin(needed, rows).any():
+                self.__sort_keys.pop(column, None)
+                self.__sort_ranks.pop((column, Qt.AscendingOrder), None)
+                self.__sort_ranks.pop((column, Qt.DescendingOrder), None)
+        # (the rows are sorted, so just refresh all the statistics)
+        self.dataChanged.emit(
+            self.index(0, self.Columns.CENTER),
+            self.index(self.rowCount() - 1, self.columnCount() - 1))
+
+    def is_computed(self, column=None):
+        """Return True if the statistics needed to sort by `column` (or all
+        the statistics if None) are known for all variables."""
+        if column is None:
+            return bool(self._computed.all())
+        rows = list(self.SORT_STATISTICS.get(column, ()))
+        return bool(self._computed[rows].all())
+
     def clear(self):
         self.beginResetModel()
         self.table = self.domain = self.target_var = None
@@ -172,7 +347,13 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         self.__attributes = (np.array([]), np.array([]))
         self.__class_vars = (np.array([]), np.array([]))
         self.__metas = (np.array([]), np.array([]))
-        self.__distributions_cache.clear()
+        self.__histogram_bins, self.__histograms = {}, {}
+        self.__sort_keys, self.__sort_ranks = {}, {}
+        self.__statistics_table = None
+        self._type_codes = np.array([], dtype=np.int8)
+        self._name_ranks = np.array([], dtype=int)
+        self._computed = np.zeros((len(self.STATISTICS), 0), dtype=bool)
+        self._summary = None
         self.endResetModel()
 
     @property
@@ -186,60 +367,384 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
     def _attr_indices(attrs):
         # type: (List) -> Tuple[List[int], List[int], List[int], List[int]]
         """Get the indices of different attribute types eg. discrete."""
-        disc_var_idx = [i for i, attr in enumerate(attrs) if isinstance(attr, DiscreteVariable)]
-        cont_var_idx = [i for i, attr in enumerate(attrs)
-                        if isinstance(attr, ContinuousVariable)
-                        and not isinstance(attr, TimeVariable)]
-        time_var_idx = [i for i, attr in enumerate(attrs) if isinstance(attr, TimeVariable)]
-        string_var_idx = [i for i, attr in enumerate(attrs) if isinstance(attr, StringVariable)]
+        disc_var_idx, cont_var_idx, time_var_idx, string_var_idx = \
+            [], [], [], []
+        # (a single pass, since there may be millions of variables)
+        for i, attr in enumerate(attrs):
+            if isinstance(attr, DiscreteVariable):
+                disc_var_idx.append(i)
+            elif isinstance(attr, TimeVariable):
+                time_var_idx.append(i)
+            elif isinstance(attr, ContinuousVariable):
+                cont_var_idx.append(i)
+            elif isinstance(attr, StringVariable):
+                string_var_idx.append(i)
         return disc_var_idx, cont_var_idx, time_var_idx, string_var_idx
 
-    def __filter_attributes(self, attributes, matrix):
+    @classmethod
+    def __type_codes(cls, variables):
+        """Return the indices of the variables' types in `SORT_TYPES`."""
+        codes = np.empty(len(variables), dtype=np.int8)
+        for code, idx in enumerate(cls._attr_indices(variables)):
+            codes[idx] = code
+        return codes
+
+    @classmethod
+    def __filter_matrices(cls, data):
+        domain = data.domain
+        return (cls.__filter_attributes(domain.attributes, data.X),
+                cls.__filter_attributes(domain.class_vars, data._Y),
+                cls.__filter_attributes(domain.metas, data.metas))
+
+    @classmethod
+    def __filter_attributes(cls, attributes, matrix):
         """Filter out variables which shouldn't be visualized."""
-        attributes, matrix = np.asarray(attributes), matrix
+        # (the dtype avoids probing each variable for the array interface)
+        attributes = np.array(attributes, dtype=object)
         mask = [idx for idx, attr in enumerate(attributes)
-                if not isinstance(attr, self.HIDDEN_VAR_TYPES)]
+                if not isinstance(attr, cls.HIDDEN_VAR_TYPES)]
+        if is_memmap(matrix):
+            # Selecting the columns would load the whole matrix; read it in
+            # blocks of rows when computing the statistics instead
+            return attributes[mask], ColumnBlocks(matrix, mask)
+        if len(mask) == len(attributes):
+            # (do not copy the matrix)
+            return attributes, matrix
         return attributes[mask], matrix[:, mask]
 
-    def __compute_statistics(self):
+    @staticmethod
+    def __select(matrices, indices):
+        """Select the variables with (sorted) `indices` over all the
+        (variables, matrix) pairs."""
+        result, start = [], 0
+        for variables, x in matrices:
+            stop = start + len(variables)
+            local = indices[(indices >= start) & (indices < stop)] - start
+            if len(local) == len(variables):
+                result.append((variables, x))
+            elif len(local):
+                result.append((variables[local], x[:, local]))
+            start = stop
+        return result
+
+    @classmethod
+    def statistics_matrices(cls, data):
+        """Return the (variables, matrix) pairs of `data` prepared for
+        (repeated calls of) `compute_statistics`.
+
+        Dense matrices are wrapped in `ColumnBlocks` and sparse matrices are
+        converted to CSC, so selecting their columns is cheap.
+        """
         # Since data matrices can of mixed sparsity, we need to compute
         # attributes separately for each of them.
-        matrices = [self.__attributes, self.__class_vars, self.__metas]
+        matrices = cls.__filter_matrices(data)
         # Filter out any matrices with size 0
         matrices = list(filter(lambda tup: tup[1].size, matrices))
+        return [(variables, x.tocsc() if sp.issparse(x) else
+                 x if isinstance(x, ColumnBlocks) else ColumnBlocks(x))
+                for variables, x in matrices]
+
+    @classmethod
+    def __prepare(cls, data, indices=None):
+        """The (variables, matrix) pairs of `data` (see `statistics_matrices`)
+        with the variables with the given (sorted) `indices`."""
+        if isinstance(data, Table):
+            data = cls.statistics_matrices(data)
+        if indices is None:
+            return data
+        return cls.__select(data, np.asarray(indices, dtype=int))
 
-        self._variable_types = np.array([type(var) for var in self.variables])
-        self._variable_names = np.array([var.name.lower() for var in self.variables])
-        self._min = self.__compute_stat(
-            matrices,
-            discrete_f=lambda x: ut.nanmin(x, axis=0),
-            continuous_f=lambda x: ut.nanmin(x, axis=0),
-            time_f=lambda x: ut.nanmin(x, axis=0),
-        )
-        self._dispersion = self.__compute_stat(
-            matrices,
-            discrete_f=_categorical_entropy,
-            continuous_f=lambda x: np.sqrt(ut.nanvar(x, axis=0)) / ut.nanmean(x, axis=0),
-        )
-        self._missing = self.__compute_stat(
-            matrices,
-            discrete_f=lambda x: ut.countnans(x, axis=0),
-            continuous_f=lambda x: ut.countnans(x, axis=0),
-            string_f=lambda x: (x == StringVariable.Unknown).sum(axis=0),
-            time_f=lambda x: ut.countnans(x, axis=0),
-        )
-        self._max = self.__compute_stat(
-            matrices,
-            discrete_f=lambda x: ut.nanmax(x, axis=0),
-            continuous_f=lambda x: ut.nanmax(x, axis=0),
-            time_f=lambda x: ut.nanmax(x, axis=0),
-        )
-        self._center = self.__compute_stat(
-            matrices,
-            discrete_f=lambda x: ss.mode(x)[0],
-            continuous_f=lambda x: ut.nanmean(x, axis=0),
-            time_f=lambda x: ut.nanmean(x, axis=0),
-        )
+    @classmethod
+    def __column_blocks(cls, x):
+        """Slices of the columns of `x` processed as separate jobs."""
+        size, n_columns = cls.COLUMN_BLOCK_SIZE, x.shape[1]
+        return [slice(start, min(start + size, n_columns))
+                for start in range(0, n_columns, size)]
+
+    @staticmethod
+    def __run(jobs, executor=None, callback=None):
+        """Run the `jobs` (on the `executor`) and return their results."""
+        if executor is None:
+            results = []
+            for i, job in enumerate(jobs):
+                if callback is not None:
+                    callback(i, len(jobs))
+                results.append(job())
+            return results
+
+        futures = [executor.submit(job) for job in jobs]
+        try:
+            for i, _ in enumerate(concurrent.futures.as_completed(futures)):
+                if callback is not None:
+                    callback(i + 1, len(jobs))
+        finally:
+            for f in futures:
+                f.cancel()
+        return [f.result() for f in futures]
+
+    @classmethod
+    def compute_summary(cls, data, executor=None, callback=None,
+                        indices=None, sketch=False):
+        """Summarize the (visible) variables of `data` (see
+        `blocks.summarize`).
+
+        Matrices are split into blocks of columns which are processed
+        independently, so they can be distributed over a thread pool (numpy
+        releases the GIL in the reductions). Memory mapped matrices are
+        split into blocks of rows instead, whose summaries are merged, so
+        the `callback` is called (and can interrupt the computation) between
+        the blocks. The summary of more rows can be merged into the result with
+        `blocks.merge_summaries`.
+
+        Parameters
+        ----------
+        data : Union[Table, List[Tuple[np.ndarray, Matrix]]]
+            A table or its matrices as returned by `statistics_matrices`.
+        executor : Optional[concurrent.futures.Executor]
+            The executor for the column blocks; if None, the blocks are
+            processed on the calling thread.
+        callback : Optional[Callable[[int, int], None]]
+            Called with the number of processed and all blocks; it can
+            raise an exception (e.g. `concurrent.futures.CancelledError`)
+            to interrupt the computation.
+        indices : Optional[np.ndarray]
+            The (sorted) indices of the variables; all if None.
+        sketch : bool
+            Also sketch the quantiles of the numeric variables (for their
+            median and IQR), which costs more than the rest of the summary.
+
+        Returns
+        -------
+        Tuple[np.ndarray, Optional[blocks.Summary]]
+            The variables and their summary (None if there are none), whose
+            value counts are those of the discrete variables, in order.
+
+        """
+        jobs, variables, n_parts = [], [], []
+        for variables_, x in cls.__prepare(data, indices):
+            variables.append(variables_)
+            if is_memmap(getattr(x, "x", None)):
+                row_jobs = [partial(cls.__summarize, variables_, x[rows, :],
+                                    sketch)
+                            for rows in blocks.row_blocks(
+                                x.shape[0], x.x.shape[1] * x.x.dtype.itemsize,
+                                x.block_bytes)]
+                jobs.extend(row_jobs)
+                n_parts.append(len(row_jobs))
+            else:
+                column_jobs = [partial(cls.__summarize, variables_[columns],
+                                       x[:, columns], sketch)
+                               for columns in cls.__column_blocks(x)]
+                jobs.extend(column_jobs)
+                n_parts.extend([1] * len(column_jobs))
+        if not jobs:
+            return np.array([], dtype=object), None
+        summaries = iter(cls.__run(jobs, executor, callback))
+        # (merge the summaries of the blocks of rows of the same columns)
+        summaries = [reduce(blocks.merge_summaries,
+                            itertools.islice(summaries, n))
+                     for n in n_parts]
+        return np.hstack(variables), blocks.concatenate_summaries(summaries)
+
+    @classmethod
+    def compute_statistics(cls, data, executor=None, callback=None,
+                           indices=None, statistics=None):
+        """Compute the statistics of the (visible) variables of `data`.
+
+        Parameters
+        ----------
+        data : Union[Table, List[Tuple[np.ndarray, Matrix]]]
+        executor : Optional[concurrent.futures.Executor]
+        callback : Optional[Callable[[int, int], None]]
+        indices : Optional[np.ndarray]
+            See `compute_summary`.
+        statistics : Optional[List[int]]
+            The rows of the statistics to compute; the other rows are NaN.
+            All statistics are computed if None.
+
+        Returns
+        -------
+        np.ndarray
+            A (7, n_variables) array of the center, dispersion, minimum,
+            maximum, the number of missing values, the (approximate) median
+            and interquartile range of the variables (see `STATISTICS`).
+
+        """
+        if statistics is None:
+            return cls.summary_statistics(*cls.compute_summary(
+                data, executor, callback, indices, sketch=True))
+
+        sketch = bool(set(statistics) & set(cls.__QUANTILE_ROWS))
+
+        # The statistics of each matrix, or None for those computed by jobs
+        jobs, parts = [], []
+        for variables, x in cls.__prepare(data, indices):
+            if is_memmap(getattr(x, "x", None)):
+                # (memory mapped matrices are read once for all statistics,
+                # in blocks of rows)
+                stats = cls.summary_statistics(*cls.compute_summary(
+                    [(variables, x)], executor, callback, sketch=sketch))
+                stats[np.setdiff1d(np.arange(len(stats)), statistics)] = \
+                    np.nan
+                parts.append(stats)
+            elif sp.issparse(x):
+                # (summarizing sparse columns is cheap anyway)
+                block_jobs = [partial(cls.__block_statistics,
+                                      variables[columns], x[:, columns],
+                                      sketch)
+                              for columns in cls.__column_blocks(x)]
+                jobs.extend(block_jobs)
+                parts.extend([None] * len(block_jobs))
+            else:
+                # (a single statistic of dense columns is cheaper to
+                # compute on its own)
+                jobs.append(partial(cls.__compute_single_stats,
+                                    [(variables, x)], statistics))
+                parts.append(None)
+        if not parts:
+            return np.empty((len(cls.STATISTICS), 0))
+        results = iter(cls.__run(jobs, executor, callback))
+        return np.hstack([next(results) if stats is None else stats
+                          for stats in parts])
+
+    @classmethod
+    def __summarize(cls, variables, x, sketch=False):
+        """Summarize a block of columns of a dense (or memory mapped) matrix
+        with a single pass over its (blocks of) rows, or of a sparse matrix
+        from its column data.
+
+        Parameters
+        ----------
+        variables : np.ndarray
+        x : Union[ColumnBlocks, sp.csc_matrix]
+        sketch : bool
+            Also sketch the quantiles of the numeric variables.
+
+        Returns
+        -------
+        blocks.Summary
+        """
+        # (string variables are hidden, see `HIDDEN_VAR_TYPES`)
+        disc_idx, cont_idx, time_idx, _ = cls._attr_indices(variables)
+        return blocks.summarize(x, discrete=disc_idx, sketch=sketch,
+                                sketch_columns=list(cont_idx) + list(time_idx))
+
+    @classmethod
+    def __block_statistics(cls, variables, x, sketch=False):
+        return cls.summary_statistics(
+            variables, cls.__summarize(variables, x, sketch))
+
+    @classmethod
+    def summary_statistics(cls, variables, summary):
+        """Return the statistics of `variables` from their `summary`.
+
+        Parameters
+        ----------
+        variables : np.ndarray
+        summary : Optional[blocks.Summary]
+            The summary as returned by `compute_summary`.
+
+        Returns
+        -------
+        np.ndarray
+            A (7, len(variables)) array of the statistics (see
+            `compute_statistics`) of each variable.
+        """
+        disc_idx, cont_idx, time_idx, _ = cls._attr_indices(variables)
+        center, dispersion, min_, max_, missing, median, iqr = stats = \
+            np.full((len(cls.STATISTICS), len(variables)), np.nan)
+        if summary is None:
+            return stats
+
+        disc_idx = np.array(disc_idx, dtype=int)
+        cont_idx = np.array(cont_idx, dtype=int)
+        num_idx = np.hstack((cont_idx, np.array(time_idx, dtype=int)))
+        known = np.hstack((disc_idx, num_idx))
+        min_[known], max_[known] = summary.min[known], summary.max[known]
+        missing[known] = summary.nans[known]
+
+        center[disc_idx] = blocks.counts_mode(summary.counts)
+        dispersion[disc_idx] = blocks.counts_entropy(summary.counts)
+
+        count = summary.count[num_idx]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, summary.mean[num_idx], np.nan)
+            std = np.sqrt(summary.m2[num_idx] / count)
+        center[num_idx] = mean
+        n_cont = len(cont_idx)
+        dispersion[cont_idx] = std[:n_cont] / mean[:n_cont]
+
+        if summary.sketch is not None:
+            sketch = blocks.QuantileSketch(summary.sketch.count[num_idx],
+                                           summary.sketch.points[num_idx])
+            q1, median[num_idx], q3 = \
+                blocks.sketch_quantiles(sketch, [0.25, 0.5, 0.75])
+            iqr[num_idx] = q3 - q1
+        return stats
+
+    #: The functions (for `__compute_stat`) of each row of the statistics
+    __STAT_FUNCTIONS = (
+        dict(discrete_f=blocks.mode,
+             continuous_f=blocks.nanmean,
+             time_f=blocks.nanmean),
+        dict(discrete_f=blocks.categorical_entropy,
+             continuous_f=lambda x: np.sqrt(blocks.nanvar(x)) / blocks.nanmean(x)),
+        dict(discrete_f=blocks.nanmin,
+             continuous_f=blocks.nanmin,
+             time_f=blocks.nanmin),
+        dict(discrete_f=blocks.nanmax,
+             continuous_f=blocks.nanmax,
+             time_f=blocks.nanmax),
+        dict(discrete_f=blocks.countnans,
+             continuous_f=blocks.countnans,
+             string_f=lambda x: (x == StringVariable.Unknown).sum(axis=0),
+             time_f=blocks.countnans),
+    )
+    #: The rows of the median and the IQR, both read from a single quantile
+    #: sketch of each column (see `__compute_quartiles`)
+    __QUANTILE_ROWS = (5, 6)
+
+    @classmethod
+    def __compute_single_stats(cls, matrices, statistics=None):
+        """Compute the (given rows of the) statistics of dense matrices one
+        at a time (when not all the statistics are needed)."""
+        n_variables = sum(len(variables) for variables, _ in matrices)
+        stats = np.full((len(cls.STATISTICS), n_variables), np.nan)
+        rows = range(len(stats)) if statistics is None else statistics
+        for row in rows:
+            if row not in cls.__QUANTILE_ROWS:
+                stats[row] = cls.__compute_stat(
+                    matrices, **cls.__STAT_FUNCTIONS[row])
+        quantile_rows = [row for row in cls.__QUANTILE_ROWS if row in rows]
+        if quantile_rows:
+            q1, median, q3 = cls.__compute_quartiles(matrices)
+            median_row, iqr_row = cls.__QUANTILE_ROWS
+            if median_row in quantile_rows:
+                stats[median_row] = median
+            if iqr_row in quantile_rows:
+                stats[iqr_row] = q3 - q1
+        return stats
+
+    @classmethod
+    def __compute_quartiles(cls, matrices):
+        """Return a (3, n_variables) array of the approximate quartiles of
+        the numeric variables (NaN for others) from their quantile sketches.
+        """
+        results = []
+        for variables, x in matrices:
+            result = np.full((3, len(variables)), np.nan)
+            _, cont_idx, time_idx, _ = cls._attr_indices(variables)
+            num_idx = list(cont_idx) + list(time_idx)
+            x_ = x[:, num_idx]
+            if x_.size:
+                if not np.issubdtype(x_.dtype, np.number):
+                    x_ = x_.astype(np.float64)
+                result[:, num_idx] = blocks.sketch_quantiles(
+                    blocks.quantile_sketch(x_), [0.25, 0.5, 0.75])
+            results.append(result)
+        if not results:
+            return np.empty((3, 0))
+        return np.hstack(results)
 
     def get_statistics_matrix(self, variables=None, return_labels=False):
         """Get the numeric computed statistics in a single matrix. Optionally,
@@ -270,22 +775,50 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         else:
             indices = ...
 
-        matrix = np.vstack((
-            self._center[indices], self._dispersion[indices],
-            self._min[indices], self._max[indices], self._missing[indices],
-        )).T
+        matrix = self._statistics[:, indices].T
 
         # Return string labels for the returned matrix columns e.g. 'Mean',
         # 'Dispersion' if requested
         if return_labels:
-            labels = [self.Columns.CENTER.name, self.Columns.DISPERSION.name,
-                      self.Columns.MIN.name, self.Columns.MAX.name,
-                      self.Columns.MISSING.name]
+            labels = [column.name for column in self.STATISTICS]
             return labels, matrix
 
         return matrix
 
-    def __compute_stat(self, matrices, discrete_f=None, continuous_f=None,
+    def get_statistics_table(self):
+        """Return the statistics of all the variables as a table, with the
+        names and the types of the variables as metas.
+
+        The table is built from the statistics matrix and cached until the
+        data (or its statistics) change.
+
+        Returns
+        -------
+        Optional[Table]
+
+        """
+        if self.table is None:
+            return None
+        if self.__statistics_table is None:
+            labels, matrix = self.get_statistics_matrix(return_labels=True)
+            domain = Domain(
+                attributes=[ContinuousVariable(name) for name in labels],
+                metas=[StringVariable('Feature'),
+                       DiscreteVariable('Type', values=self.TYPE_NAMES)]
+            )
+            metas = np.empty((self.n_attributes, 2), dtype=object)
+            metas[:, 0] = np.frompyfunc(attrgetter('name'), 1, 1)(
+                self.variables)
+            metas[:, 1] = self._type_codes
+            # (a copy, since lazily computed statistics are set in place)
+            table = Table.from_numpy(domain, np.array(matrix, order='C'),
+                                     metas=metas)
+            table.name = '%s (Feature Statistics)' % self.table.name
+            self.__statistics_table = table
+        return self.__statistics_table
+
+    @classmethod
+    def __compute_stat(cls, matrices, discrete_f=None, continuous_f=None,
                        time_f=None, string_f=None, default_val=np.nan):
         """Apply functions to appropriate variable types. The default value is
         returned if there is no function defined for specific variable types.
@@ -310,7 +843,7 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
             # While the following caching and checks are messy, the indexing
             # turns out to be a bottleneck for large datasets, so a single
             # indexing operation improves performance
-            disc_idx, cont_idx, time_idx, str_idx = self._attr_indices(variables)
+            disc_idx, cont_idx, time_idx, str_idx = cls._attr_indices(variables)
             if discrete_f:
                 x_ = x[:, disc_idx]
                 if x_.size:
@@ -337,64 +870,91 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         sort based on a single value e.g. the name, return a 1d array.
         Sometimes we may want to sort by multiple criteria, comparing
         continuous variances with discrete entropies makes no sense, so we want
-        to group those variable types together.
-        """
-        # Prepare indices for variable types so we can group them together
-        order = [DiscreteVariable, ContinuousVariable, TimeVariable, StringVariable]
-        mapping = {var: idx for idx, var in enumerate(order)}
-        vmapping = np.vectorize(mapping.__getitem__)
-        var_types_indices = vmapping(self._variable_types)
-
-        # Store the variable name sorted indices so we can pass a default
-        # order when sorting by multiple keys
-        var_name_indices = np.argsort(self._variable_names)
-
-        # Prepare vartype indices so ready when needed
-        disc_idx, cont_idx, time_idx, str_idx = self._attr_indices(self.variables)
+        to group those variable types together: these columns are sorted by
+        (type, NaN, value).
 
+        The keys are computed once per data set (and set of statistics).
+        """
+        keys = self.__sort_keys.get(column)
+        if keys is None:
+            keys = self.__sort_keys[column] = self.__column_sort_keys(column)
+            keys.setflags(write=False)
+        return keys
+
+    def __column_sort_keys(self, column):
+        types = self._type_codes
         # Sort by: (type)
         if column == self.Columns.ICON:
-            return var_types_indices
+            return types.astype(float)
         # Sort by: (name)
         elif column == self.Columns.NAME:
-            # We use `_variable_names` here and not the indices because the
-            # last (or single) row is actually sorted and we don't want to sort
-            # the indices
-            return self._variable_names
+            return self._name_ranks.astype(float)
         # Sort by: (None)
         elif column == self.Columns.DISTRIBUTION:
-            return np.ones_like(var_types_indices)
-        # Sort by: (type, center)
-        elif column == self.Columns.CENTER:
-            # Sorting discrete or string values by mean makes no sense
-            vals = np.array(self._center)
-            vals[disc_idx] = var_name_indices[disc_idx]
-            vals[str_idx] = var_name_indices[str_idx]
-            return np.vstack((var_types_indices, np.zeros_like(vals), vals)).T
+            return np.ones(len(types))
+        # Sort by: (missing)
+        elif column == self.Columns.MISSING:
+            return np.array(self._missing)
         # Sort by: (type, dispersion)
         elif column == self.Columns.DISPERSION:
             # Sort time variables by their dispersion, which is not stored in
             # the dispersion array
             vals = np.array(self._dispersion)
-            vals[time_idx] = self._max[time_idx] - self._min[time_idx]
-            return np.vstack((var_types_indices, np.zeros_like(vals), vals)).T
-        # Sort by: (type, min)
-        elif column == self.Columns.MIN:
-            # Sorting discrete or string values by min makes no sense
-            vals = np.array(self._min)
-            vals[disc_idx] = var_name_indices[disc_idx]
-            vals[str_idx] = var_name_indices[str_idx]
-            return np.vstack((var_types_indices, np.zeros_like(vals), vals)).T
-        # Sort by: (type, max)
-        elif column == self.Columns.MAX:
-            # Sorting discrete or string values by min makes no sense
-            vals = np.array(self._max)
-            vals[disc_idx] = var_name_indices[disc_idx]
-            vals[str_idx] = var_name_indices[str_idx]
-            return np.vstack((var_types_indices, np.zeros_like(vals), vals)).T
-        # Sort by: (missing)
-        elif column == self.Columns.MISSING:
-            return self._missing
+            time = types == self.SORT_TYPES.index(TimeVariable)
+            vals[time] = self._max[time] - self._min[time]
+        # Sort by: (type, iqr)
+        elif column == self.Columns.IQR:
+            vals = np.array(self._iqr)
+        # Sort by: (type, center), (type, min), (type, max), (type, median)
+        else:
+            vals = np.array({self.Columns.CENTER: self._center,
+                             self.Columns.MIN: self._min,
+                             self.Columns.MAX: self._max,
+                             self.Columns.MEDIAN: self._median}[column])
+            # Sorting discrete or string values by these makes no sense, so
+            # sort them by name
+            by_name = np.isin(types, [
+                self.SORT_TYPES.index(DiscreteVariable),
+                self.SORT_TYPES.index(StringVariable)])
+            vals[by_name] = self._name_ranks[by_name]
+        return np.column_stack((types, np.isnan(vals), vals))
+
+    def __column_sort_ranks(self, column, order):
+        """Return the (cached) dense ranks of the rows for sorting by `column`
+        in `order`, whether the rows are then reversed, and the sorting
+        permutation if there are no ties (and thus it doesn't depend on the
+        current order)."""
+        ranks = self.__sort_ranks.get((column, order))
+        if ranks is not None:
+            return ranks
+
+        keys = self.sortColumnData(column)
+        descending = order == Qt.DescendingOrder
+        reverse = False
+        if keys.ndim == 1:
+            # Descending single keys are the reversed ascending ones, with
+            # NaNs put first so that they still end up last
+            nans = np.isnan(keys)
+            keys = np.column_stack((~nans if descending else nans, keys))
+            reverse = descending
+        elif descending:
+            keys = keys.copy()
+            keys[:, -1] = -keys[:, -1]
+        # (NaNs are already told apart by their indicator)
+        keys = np.nan_to_num(keys)
+
+        indices = np.lexsort(keys.T[::-1])
+        sorted_keys = keys[indices]
+        distinct = np.ones(len(keys), dtype=bool)
+        distinct[1:] = (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1)
+        rank = np.empty(len(keys), dtype=int)
+        rank[indices] = np.cumsum(distinct) - 1
+        permutation = None
+        if distinct.all():
+            permutation = indices[::-1] if reverse else indices
+        ranks = self.__sort_ranks[(column, order)] = \
+            rank, reverse, permutation
+        return ranks
 
     def _sortColumnData(self, column):
         """Allow sorting with 2d arrays."""
@@ -404,39 +964,29 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         assert data.ndim <= 2, 'Data should be at most 2-dimensional'
         return data
 
-    def _argsortData(self, data, order):
-        if data.ndim == 1:
-            indices = np.argsort(data, kind='mergesort')
-            if order == Qt.DescendingOrder:
-                indices = indices[::-1]
-            # Always sort NaNs last
-            if np.issubdtype(data.dtype, np.number):
-                indices = np.roll(indices, -np.isnan(data).sum())
-        else:
-            assert np.issubdtype(data.dtype, np.number), \
-                'We do not deal with non numeric values in sorting by ' \
-                'multiple values'
-            if order == Qt.DescendingOrder:
-                data[:, -1] = -data[:, -1]
-
-            # In order to make sure NaNs always appear at the end, insert a
-            # indicator whether NaN or not. Note that the data array must
-            # contain an empty column of zeros at index -2 since inserting an
-            # extra column after the fact can result in a MemoryError for data
-            # with a large amount of variables
-            assert np.all(data[:, -2] == 0), \
-                'Add an empty column of zeros at index -2 to accomodate NaNs'
-            np.isnan(data[:, -1], out=data[:, -2])
-
-            indices = np.lexsort(np.flip(data.T, axis=0))
-
-        return indices
+    def _sort(self, column, order):
+        if column < 0:
+            return None
+        rank, reverse, permutation = self.__column_sort_ranks(column, order)
+        if permutation is not None:
+            return permutation
+        # The sort is stable, so ties keep their current order
+        indices = np.argsort(rank[self.mapToSourceRows(Ellipsis)],
+                             kind='mergesort')
+        if reverse:
+            indices = indices[::-1]
+        return self.mapToSourceRows(indices)
 
     def headerData(self, section, orientation, role):
         # type: (int, Qt.Orientation, Qt.ItemDataRole) -> Any
         if orientation == Qt.Horizontal:
             if role == Qt.DisplayRole:
                 return self.Columns.from_index(section).name
+            elif role == Qt.ToolTipRole:
+                # (estimated from quantile sketches, see `blocks.summarize`)
+                return {self.Columns.MEDIAN: 'Approximate median',
+                        self.Columns.IQR: 'Approximate interquartile range',
+                        }.get(section)
 
     def data(self, index, role):
         # type: (QModelIndex, Qt.ItemDataRole) -> Any
@@ -474,18 +1024,7 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
         elif column == self.Columns.DISTRIBUTION:
             if role == Qt.DisplayRole:
                 if isinstance(attribute, (DiscreteVariable, ContinuousVariable)):
-                    if row not in self.__distributions_cache:
-                        scene = QGraphicsScene(parent=self)
-                        histogram = Histogram(
-                            data=self.table,
-                            variable=attribute,
-                            color_attribute=self.target_var,
-                            border=(0, 0, 2, 0),
-                            border_color='#ccc',
-                        )
-                        scene.addItem(histogram)
-                        self.__distributions_cache[row] = scene
-                    return self.__distributions_cache[row]
+                    return self.__histogram_item(row)
         elif column == self.Columns.CENTER:
             if role == Qt.DisplayRole:
                 if isinstance(attribute, DiscreteVariable):
@@ -526,6 +1065,20 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
                     self._missing[row],
                     100 * self._missing[row] / self.n_instances
                 )
+        elif column == self.Columns.MEDIAN:
+            if role == Qt.DisplayRole:
+                if isinstance(attribute, TimeVariable):
+                    if not np.isnan(self._median[row]):
+                        output = attribute.str_val(self._median[row])
+                elif isinstance(attribute, ContinuousVariable):
+                    output = self._median[row]
+        elif column == self.Columns.IQR:
+            if role == Qt.DisplayRole:
+                if isinstance(attribute, TimeVariable):
+                    if not np.isnan(self._iqr[row]):
+                        output = format_time_diff(0, self._iqr[row])
+                elif isinstance(attribute, ContinuousVariable):
+                    output = self._iqr[row]
 
         # Consistently format the text inside the table cells
         # The easiest way to check for NaN is to compare with itself
@@ -547,11 +1100,50 @@ class FeatureStatisticsTableModel(AbstractSortTableModel):
     def columnCount(self, parent=QModelIndex()):
         return 0 if parent.isValid() else len(self.Columns)
 
+    def __get_histograms(self, block):
+        """Compute the histograms of a block of `HISTOGRAM_BLOCK_SIZE`
+        variables at once (for the current target variable)."""
+        if block in self.__histograms:
+            return self.__histograms[block]
+
+        matrices = [self.__attributes, self.__class_vars, self.__metas]
+        matrices = list(filter(lambda tup: tup[1].size, matrices))
+        size = self.HISTOGRAM_BLOCK_SIZE
+        matrices = self.__select(matrices, np.arange(
+            block * size, min((block + 1) * size, self.n_attributes)))
+        if block not in self.__histogram_bins:
+            self.__histogram_bins[block] = [histogram_bins(x, variables)
+                                            for variables, x in matrices]
+        y = None
+        if self.target_var is not None:
+            y = self.table.get_column_view(self.target_var)[0]
+            if sp.issparse(y):
+                y = y.toarray().ravel()
+            y = y.astype(np.float64)
+        self.__histograms[block] = Histograms.concatenate([
+            compute_histograms(x, bins, y, self.target_var)
+            for (_, x), bins in zip(matrices, self.__histogram_bins[block])
+        ])
+        return self.__histograms[block]
+
+    def __histogram_item(self, row):
+        # type: (int) -> Optional[HistogramItem]
+        """The bars of the histogram of the variable in `row` (if any)."""
+        block, row = divmod(row, self.HISTOGRAM_BLOCK_SIZE)
+        _, distributions, means = self.__get_histograms(block)[row]
+        # Nothing to show if all the values (or all the target values) are
+        # missing
+        if not distributions.sum() or \
+                means is not None and np.all(np.isnan(means)):
+            return None
+        colors = histogram_colors(len(distributions), self.target_var, means)
+        return HistogramItem(distributions, colors)
+
     def set_target_var(self, variable):
         self.target_var = variable
-        self.__distributions_cache.clear()
+        self.__histograms = {}
         start_idx = self.index(0, self.Columns.DISTRIBUTION)
-        end_idx = self.index(self.rowCount(), self.Columns.DISTRIBUTION)
+        end_idx = self.index(self.rowCount() - 1, self.Columns.DISTRIBUTION)
         self.dataChanged.emit(start_idx, end_idx)
 
 
@@ -602,11 +1194,32 @@ class FeatureStatisticsTableView(QTableView):
         # hheader.sectionResized.connect(self.keep_row_centered)
 
         self.setItemDelegate(NoFocusRectDelegate(parent=self))
+        delegate = DistributionDelegate(parent=self)
+        # The histograms change with the data and the target variable
+        model.modelReset.connect(delegate.clear)
+        model.dataChanged.connect(self.__on_data_changed)
         self.setItemDelegateForColumn(
-            FeatureStatisticsTableModel.Columns.DISTRIBUTION,
-            DistributionDelegate(parent=self),
+            FeatureStatisticsTableModel.Columns.DISTRIBUTION, delegate,
         )
 
+    def __on_data_changed(self, top_left, bottom_right):
+        # Statistics computed in the background do not change the histograms
+        column = self.model().Columns.DISTRIBUTION
+        if top_left.column() <= column <= bottom_right.column():
+            self.itemDelegateForColumn(column).clear()
+
+    def visible_rows(self):
+        """Return the (source) rows in the viewport."""
+        model = self.model()
+        first = self.rowAt(0)
+        if first < 0:
+            return np.array([], dtype=int)
+        last = self.rowAt(self.viewport().height())
+        if last < 0:
+            last = model.rowCount() - 1
+        return np.asarray(model.mapToSourceRows(np.arange(first, last + 1)),
+                          dtype=int)
+
     def bind_histogram_aspect_ratio(self, logical_index, _, new_size):
         """Force the horizontal and vertical header to maintain the defined
         aspect ratio specified for the histogram."""
@@ -644,22 +1257,71 @@ class NoFocusRectDelegate(QStyledItemDelegate):
 
 
 class DistributionDelegate(QStyledItemDelegate):
+    """Paints the histograms from their counts and caches the pixmaps.
+
+    The pixmaps are kept for the (source) rows and cell sizes in a bounded
+    LRU cache, which must be cleared (`clear`) when the histograms change.
+    """
+    #: The (approximate) memory limit for the cached pixmaps in bytes
+    CACHE_BYTES = 32 * 2 ** 20
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__cache = OrderedDict()  # type: Dict[tuple, Optional[QPixmap]]
+        self.__cache_bytes = 0
+
+    def clear(self):
+        """Clear the cached pixmaps."""
+        self.__cache.clear()
+        self.__cache_bytes = 0
+
     def paint(self, painter, option, index):
         # type: (QPainter, QStyleOptionViewItem, QModelIndex) -> None
-        scene = index.data(Qt.DisplayRole)  # type: Optional[QGraphicsScene]
-        if scene is None:
-            return super().paint(painter, option, index)
+        ratio = painter.device().devicePixelRatioF()
+        key = (index.model().mapToSourceRows(index.row()),
+               option.rect.width(), option.rect.height(), ratio)
+        if key in self.__cache:
+            self.__cache.move_to_end(key)
+            pixmap = self.__cache[key]
+        else:
+            item = index.data(Qt.DisplayRole)  # type: Optional[HistogramItem]
+            pixmap = None
+            if item is not None:
+                pixmap = self.__render(item, option.rect.size(), ratio)
+            self.__insert(key, pixmap)
 
-        painter.setRenderHint(QPainter.Antialiasing)
+        if pixmap is None:
+            return super().paint(painter, option, index)
 
         if option.state & QStyle.State_Selected:
             background_color = option.palette.highlight()
         else:
             background_color = index.data(Qt.BackgroundRole)
         if background_color is not None:
-            scene.setBackgroundBrush(background_color)
+            painter.fillRect(option.rect, background_color)
+        painter.drawPixmap(option.rect.topLeft(), pixmap)
 
-        scene.render(painter, target=QRectF(option.rect), mode=Qt.IgnoreAspectRatio)
+    @staticmethod
+    def __render(item, size, ratio):
+        # type: (HistogramItem, QSize, float) -> QPixmap
+        pixmap = QPixmap(size * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        paint_histogram(painter, QRectF(0, 0, size.width(), size.height()),
+                        item.distributions, item.colors)
+        painter.end()
+        return pixmap
+
+    def __insert(self, key, pixmap):
+        self.__cache[key] = pixmap
+        if pixmap is not None:
+            self.__cache_bytes += pixmap.width() * pixmap.height() * 4
+        while self.__cache_bytes > self.CACHE_BYTES and len(self.__cache) > 1:
+            _, evicted = self.__cache.popitem(last=False)
+            if evicted is not None:
+                self.__cache_bytes -= evicted.width() * evicted.height() * 4
 
 
 class OWFeatureStatistics(widget.OWWidget):
@@ -674,6 +1336,9 @@ class OWFeatureStatistics(widget.OWWidget):
         reduced_data = Output('Reduced Data', Table, default=True)
         statistics = Output('Statistics', Table)
 
+    class Error(widget.OWWidget.Error):
+        statistics_error = widget.Msg('Error computing the statistics.\n{}')
+
     want_main_area = True
     buttons_area_orientation = Qt.Vertical
 
@@ -686,11 +1351,24 @@ class OWFeatureStatistics(widget.OWWidget):
     sorting = ContextSetting((0, Qt.DescendingOrder))
     selected_rows = ContextSetting([])
 
+    #: Statistics of tables with at least this many values are computed in
+    #: a background thread
+    ASYNC_MIN_SIZE = 2 ** 20
+    #: Statistics of tables with at least this many variables are computed
+    #: lazily, in blocks of variables prioritized by the view
+    LAZY_MIN_VARIABLES = 10000
+
     def __init__(self):
         super().__init__()
 
         self.data = None  # type: Optional[Table]
 
+        self._executor = ThreadExecutor(self)
+        # The pool for the column blocks of the statistics
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=os.cpu_count())
+        self._task = None  # type: Optional[OWFeatureStatistics.Task]
+
         # Information panel
         info_box = gui.vBox(self.controlArea, 'Info')
         info_box.setMinimumWidth(200)
@@ -732,6 +1410,9 @@ class OWFeatureStatistics(widget.OWWidget):
         self.table_view = FeatureStatisticsTableView(self.model, parent=self)
         self.table_view.selectionModel().selectionChanged.connect(self.on_select)
         self.table_view.horizontalHeader().sectionClicked.connect(self.on_header_click)
+        self.table_view.verticalScrollBar().valueChanged.connect(
+            self.__update_priority)
+        self.model.layoutChanged.connect(self.__update_priority)
 
         self.mainArea.layout().addWidget(self.table_view)
 
@@ -751,6 +1432,8 @@ class OWFeatureStatistics(widget.OWWidget):
 
     @Inputs.data
     def set_data(self, data):
+        self.cancel()
+        self.Error.statistics_error.clear()
         self.closeContext()
         self.selected_rows = []
         self.model.resetSorting()
@@ -764,8 +1447,192 @@ class OWFeatureStatistics(widget.OWWidget):
         else:
             self.color_var_model.set_domain(None)
             self.color_var = None
-        self.model.set_data(data)
 
+        n_variables = 0 if data is None else \
+            len(data.domain.variables + data.domain.metas)
+        size = 0 if data is None else len(data) * n_variables
+        appended = 0 if data is None else \
+            (len(data) - self.model.n_instances) * n_variables
+        if self.model.extends(data) and appended < self.ASYNC_MIN_SIZE:
+            # Only the appended rows are summarized
+            self.model.append_data(data)
+            self.__data_ready()
+            self.__complete_statistics()
+        elif size and n_variables >= self.LAZY_MIN_VARIABLES:
+            # Show the variables at once and fill in their statistics
+            self.model.set_data(data, lazy=True)
+            self.__data_ready()
+            self.start_lazy_statistics(data)
+        elif size >= self.ASYNC_MIN_SIZE:
+            self.model.set_data(None)
+            self.set_info()
+            self.commit()
+            self.start_statistics(data)
+        else:
+            self.model.set_data(data)
+            self.__data_ready()
+            self.__complete_statistics()
+
+    def __complete_statistics(self):
+        """Compute the statistics not included in the model's summary (the
+        median and IQR) in blocks of variables, the visible first."""
+        if not self.model.is_computed():
+            self.start_lazy_statistics(self.data)
+
+    def start_statistics(self, data):
+        """Start computing the statistics of `data` in a background thread."""
+        self.cancel()
+        self.Error.statistics_error.clear()
+        self._task = task = self.Task()
+        progress = methodinvoke(self, "setProgressValue", (int, int))
+
+        def callback(i, n):
+            if task.cancelled:
+                raise concurrent.futures.CancelledError()
+            progress(i, n)
+
+        def run():
+            _, summary = FeatureStatisticsTableModel.compute_summary(
+                data, self._pool, callback)
+            return summary
+
+        self.progressBarInit()
+        task.future = self._executor.submit(run)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_statistics_done)
+
+    def start_lazy_statistics(self, data):
+        """Start computing the statistics of `data` in blocks of variables.
+
+        The blocks are chosen by the task's priorities: first the visible
+        rows, then the statistics needed by the sort column and finally the
+        remaining variables in order. The model is updated after each block.
+        Only the statistics not yet known by the model are computed.
+        """
+        self.cancel()
+        self.Error.statistics_error.clear()
+        self._task = task = self.Task()
+        task.visible = self.table_view.visible_rows()
+        task.statistics = self.model.SORT_STATISTICS.get(self.sorting[0], ())
+        todo = ~self.model._computed
+        n_statistics = len(FeatureStatisticsTableModel.STATISTICS)
+        block_size = FeatureStatisticsTableModel.COLUMN_BLOCK_SIZE
+        progress = methodinvoke(self, "setProgressValue", (int, int))
+        update = methodinvoke(
+            self, "on_statistics_block", (object, object, object, object))
+
+        def check(*_):
+            if task.cancelled:
+                raise concurrent.futures.CancelledError()
+
+        def run():
+            matrices = FeatureStatisticsTableModel.statistics_matrices(data)
+            while todo.any():
+                check()
+                rows, indices = _next_block(
+                    todo, task.visible, task.statistics, block_size)
+                values = FeatureStatisticsTableModel.compute_statistics(
+                    matrices, self._pool, check, indices=indices,
+                    statistics=None if len(rows) == n_statistics else rows)
+                todo[np.ix_(rows, indices)] = False
+                update(task, rows, indices, values)
+                progress(todo.size - np.count_nonzero(todo), todo.size)
+
+        self.progressBarInit()
+        task.future = self._executor.submit(run)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_lazy_statistics_done)
+
+    @pyqtSlot(object, object, object, object)
+    def on_statistics_block(self, task, rows, indices, values):
+        assert self.thread() is QThread.currentThread()
+        if task is not self._task:
+            return
+        sort_column = self.model.sortColumn()
+        was_sortable = self.model.is_computed(sort_column)
+        self.model.set_statistics(rows, indices, values)
+        # Sort again once the sort column is complete
+        if not was_sortable and self.model.is_computed(sort_column):
+            self.__restore_sorting()
+
+    @pyqtSlot(concurrent.futures.Future)
+    def on_lazy_statistics_done(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        if self._task is None or future is not self._task.future:
+            return
+
+        self._task = None
+        self.progressBarFinished()
+
+        try:
+            future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            log.exception("Error computing the statistics")
+            self.Error.statistics_error(err)
+            return
+        # The statistics of the selected rows may have been sent incomplete
+        self.commit()
+
+    def __update_priority(self, *_):
+        """Prioritize the statistics of the visible rows in the lazy task."""
+        if self._task is not None:
+            self._task.visible = self.table_view.visible_rows()
+
+    def cancel(self):
+        """Cancel the current background task (if any)."""
+        if self._task is not None:
+            self._task.cancel()
+            # (a running task stops at its next check of `cancelled`; its
+            # result is dropped)
+            self._task.watcher.done.disconnect()
+            self._task = None
+            self.progressBarFinished()
+
+    @pyqtSlot(int, int)
+    def setProgressValue(self, n, N):
+        assert self.thread() is QThread.currentThread()
+        self.progressBarSet(n / max(N, 1) * 100)
+
+    class Task:
+        future = ...  # type: concurrent.futures.Future
+        watcher = ...  # type: FutureWatcher
+        cancelled = False  # type: bool
+        # The (source) rows in the viewport and the statistics needed by the
+        # sort column, which are computed first by the lazy task
+        visible = np.array([], dtype=int)  # type: np.ndarray
+        statistics = ()  # type: Tuple[int, ...]
+
+        def cancel(self):
+            # The running computation polls the flag (between its blocks)
+            # and stops
+            self.cancelled = True
+            # Cancel the future. Note this succeeds only if the execution has
+            # not yet started (see `concurrent.futures.Future.cancel`)
+            self.future.cancel()
+
+    @pyqtSlot(concurrent.futures.Future)
+    def on_statistics_done(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        if self._task is None or future is not self._task.future:
+            return
+
+        self._task = None
+        self.progressBarFinished()
+
+        try:
+            summary = future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            log.exception("Error computing the statistics")
+            self.Error.statistics_error(err)
+            return
+        self.model.set_data(self.data, summary)
+        self.__data_ready()
+        self.__complete_statistics()
+
+    def __data_ready(self):
+        """Restore the context and the view once the model has the data."""
         self.openContext(self.data)
         self.__restore_selection()
         self.__restore_sorting()
@@ -799,6 +1666,9 @@ class OWFeatureStatistics(widget.OWWidget):
         sort_order = self.model.sortOrder()
         sort_column = self.model.sortColumn()
         self.sorting = sort_column, sort_order
+        if self._task is not None:
+            self._task.statistics = \
+                self.model.SORT_STATISTICS.get(sort_column, ())
 
     @pyqtSlot(int)
     def __color_var_changed(self, *_):
@@ -874,19 +1744,18 @@ class OWFeatureStatistics(widget.OWWidget):
         self.Outputs.reduced_data.send(self.data[:, variables])
 
         # Send the statistics of the selected variables to ouput
-        labels, data = self.model.get_statistics_matrix(variables, return_labels=True)
-        var_names = np.atleast_2d([var.name for var in variables]).T
-        domain = Domain(
-            attributes=[ContinuousVariable(name) for name in labels],
-            metas=[StringVariable('Feature')]
-        )
-        statistics = Table(domain, data, metas=var_names)
-        statistics.name = '%s (Feature Statistics)' % self.data.name
-        self.Outputs.statistics.send(statistics)
+        statistics = self.model.get_statistics_table()
+        self.Outputs.statistics.send(statistics[self.selected_rows])
 
     def send_report(self):
         pass
 
+    def onDeleteWidget(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
+        self._pool.shutdown(wait=False)
+        super().onDeleteWidget()
+
 
 if __name__ == '__main__':
     from AnyQt.QtWidgets import QApplication
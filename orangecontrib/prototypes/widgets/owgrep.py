@@ -1,5 +1,6 @@
 import os
 import re
+import locale
 
 from tempfile import NamedTemporaryFile
 
@@ -25,6 +26,86 @@ class NameContextHandler(ContextHandler):
         return (name == context.name) + \
                (os.path.splitext(name)[1] == os.path.splitext(context.name)[1])
 
+def _line_end(text, pos):
+    """Return the offset of the end (the newline) of the line at `pos`."""
+    end = text.find("\n", pos)
+    return len(text) if end == -1 else end
+
+
+def read_chunks(f, encoding, chunk_size=2 ** 22):
+    """
+    Yield the text of the binary file `f` in chunks of whole lines.
+
+    Each chunk but the last is (at least) `chunk_size` bytes long and ends
+    with a newline, so no character is split between chunks. Windows line
+    ends (CR LF) are replaced by newlines.
+    """
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return
+        data += f.readline()
+        yield data.decode(encoding, errors="replace").replace("\r\n", "\n")
+
+
+def grep_blocks(chunks, pattern, skip_lines=0, block_length=1):
+    """
+    Yield the blocks of lines selected by the pattern.
+
+    The compiled `pattern` (with `re.MULTILINE`) is searched for in entire
+    chunks of the text rather than line by line. For each line with a match,
+    `skip_lines` lines (including the matching line) are skipped and the
+    next `block_length` lines form a block. Lines within blocks are not
+    searched. Blocks may continue into the next chunks; blocks at the end
+    of the text may be shorter.
+
+    Args:
+        chunks (Iterable[str]): consecutive chunks of whole lines of the text
+            (see `read_chunks`)
+        pattern (re.Pattern): a compiled regular expression
+        skip_lines (int): the number of skipped lines
+        block_length (int): the number of lines in a block
+
+    Yields:
+        str: the lines of a block (without the last newline)
+    """
+    # The lines still to skip and to add to the current block
+    skip = remaining = 0
+    block = []
+    for chunk in chunks:
+        size = len(chunk)
+        # `pos` is always at the start of a line
+        pos = 0
+        while pos < size:
+            if not remaining:
+                match = pattern.search(chunk, pos)
+                if match is None:
+                    break
+                start = max(chunk.rfind("\n", pos, match.start()) + 1, pos)
+                if start >= size:
+                    break
+                end = _line_end(chunk, start)
+                # A match across lines counts only if the line matches by
+                # itself
+                if match.end() > end + 1 \
+                        and pattern.search(chunk[start:end + 1]) is None:
+                    pos = end + 1
+                    continue
+                pos, skip, remaining = start, skip_lines, block_length
+            end = _line_end(chunk, pos)
+            if skip:
+                skip -= 1
+            else:
+                block.append(chunk[pos:end])
+                remaining -= 1
+                if not remaining:
+                    yield "\n".join(block)
+                    block = []
+            pos = end + 1
+    if block:
+        yield "\n".join(block)
+
+
 # The data flows through the widget as follows:
 # - open_file set current_file (+ in_view) and calls grep_lines;
 # - grep_lines greps into selected_lines and calls set_out_view and commit
@@ -58,6 +139,9 @@ class OWGrep(OWWidget, RecentPathsWComboMixin):
 
     auto_send = Setting(True)
 
+    #: The number of characters of the file shown in the input view
+    PREVIEW_SIZE = 2 ** 20
+
     out_css = """
     <style>
         div {
@@ -86,6 +170,7 @@ class OWGrep(OWWidget, RecentPathsWComboMixin):
         unreadable = Msg("Data is not readable.\n{}")
         file_not_found = Msg("File not found")
         block_too_short = Msg("Block with headers must more than 1 line.")
+        invalid_pattern = Msg("Invalid regular expression.\n{}")
 
     def __init__(self):
         super().__init__()
@@ -192,9 +277,9 @@ class OWGrep(OWWidget, RecentPathsWComboMixin):
         """
         Open the file returned by `last_path`.
 
-        Sets `current_file`, shows its contents in `in_view` and calls
-        `grep_lines`. This happens even if `current_file` is empty, in which
-        case everything is cleared.
+        Sets `current_file`, shows (the beginning of) its contents in
+        `in_view` and calls `grep_lines`. This happens even if `current_file`
+        is empty, in which case everything is cleared.
         """
         self.Error.file_not_found.clear()
         self.current_file = self.last_path()
@@ -205,7 +290,9 @@ class OWGrep(OWWidget, RecentPathsWComboMixin):
                 self.current_file = None
             else:
                 with open(self.current_file) as f:
-                    text = f.read()
+                    text = f.read(self.PREVIEW_SIZE)
+                    if f.read(1):
+                        text += "\n..."
         self.in_view.setHtml(self.out_css + "<div>{}</div>".format(text))
         self.grep_lines()
 
@@ -215,35 +302,37 @@ class OWGrep(OWWidget, RecentPathsWComboMixin):
         If there is no current file, `selected_lines` is set to `[]`.
         Finally, it calls `set_out_view` and `commit`.
 
+        The file is read and searched in large chunks (see `grep_blocks`)
+        rather than line by line.
+
         Depends on `current_file` and all settings except `has_header_row`.
         """
         def prepare_re():
             pattern = self.pattern
             if not self.regular_expression:
                 pattern = re.escape(pattern)
-            flags = re.IGNORECASE if not self.case_sensitive else 0
+            flags = re.MULTILINE
+            if not self.case_sensitive:
+                flags |= re.IGNORECASE
             return re.compile(pattern, flags)
 
         self.Warning.no_lines.clear()
+        self.Error.invalid_pattern.clear()
         self.selected_lines = []
         if self.pattern and self.current_file:
-            pattern = prepare_re()
-            with open(self.current_file) as f:
-                file_lines = iter(f)
-                try:
-                    line = next(file_lines)
-                    while True:
-                        if pattern.search(line):
-                            for _ in range(self.skip_lines):
-                                line = next(file_lines)
-                            for _ in range(self.block_length):
-                                self.selected_lines.append(line.strip())
-                                line = next(file_lines)
-                        else:
-                            line = next(file_lines)
-                except StopIteration:
-                    pass
-            self.Warning.no_lines(shown=not self.selected_lines)
+            try:
+                pattern = prepare_re()
+            except re.error as err:
+                self.Error.invalid_pattern(err)
+            else:
+                encoding = locale.getpreferredencoding(False)
+                with open(self.current_file, "rb") as f:
+                    for block in grep_blocks(
+                            read_chunks(f, encoding), pattern,
+                            self.skip_lines, self.block_length):
+                        self.selected_lines += [
+                            line.strip() for line in block.split("\n")]
+                self.Warning.no_lines(shown=not self.selected_lines)
         self.set_out_view()
         self.commit()
 
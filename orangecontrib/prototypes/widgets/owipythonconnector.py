@@ -1,4 +1,5 @@
 import os
+import concurrent.futures
 from glob import glob
 
 import numpy as np
@@ -10,10 +11,11 @@ from pandas.api.types import (
 )
 
 from AnyQt.QtWidgets import QApplication
-from AnyQt.QtCore import QFileSystemWatcher
+from AnyQt.QtCore import QFileSystemWatcher, QTimer, QThread, Slot
 
 from Orange.data import Table
 from Orange.widgets import widget, settings, gui
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher
 
 from orangecontrib.prototypes.ipython_connector import IPythonStore
 from orangecontrib.prototypes.pandas_util import table_from_frame
@@ -22,6 +24,15 @@ from orangecontrib.prototypes.pandas_util import table_from_frame
 STORE = IPythonStore()
 
 
+def _file_state(path):
+    """Return (size, mtime) of `path` or None if it doesn't (yet) exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
 def _table_from_numpy(x):
     def _to2d(x):
         if x.ndim <= 1:
@@ -51,6 +62,27 @@ VALID_DATA_TYPES = {
 }
 
 
+def _type_name(x):
+    module = type(x).__module__
+    return (module + '.' if module and module != str.__module__ else '') + type(x).__qualname__
+
+
+def _list_items():
+    """Return the combo items of the stored objects (unpickling them all)."""
+    key_type = ((_type_name(v), k) for k, v in STORE.items())
+    return ['{}  ({})'.format(key, type)
+            for type, key in sorted(key_type)]
+
+
+def _load(key):
+    """Unpickle the stored object `key` and convert it into a Table."""
+    obj = STORE.get(key)
+    data = next((func(obj)
+                 for type, func in VALID_DATA_TYPES.items()
+                 if isinstance(obj, type)), None)
+    return obj, data
+
+
 class OWIPythonConnector(widget.OWWidget):
     name = 'IPython Connector'
     description = 'Import objects stored with IPython/Jupyter %store magic command.'
@@ -67,10 +99,32 @@ class OWIPythonConnector(widget.OWWidget):
     selected = settings.Setting('')
     auto_commit = settings.Setting(True)
 
+    # Milliseconds of quiet (and unchanged file size/mtime) required after
+    # the last change notification before the stored object is reloaded
+    RELOAD_DELAY = 500
+
+    class Error(widget.OWWidget.Error):
+        load_error = widget.Msg("Cannot load '{}'.\n{}")
+        list_error = widget.Msg("Cannot list the stored objects.\n{}")
+
     def __init__(self):
         self.output_obj = None
         self.output_data = None
 
+        # Loading the selected object and listing the stored objects (both
+        # unpickle them) run in the background
+        self._task = None  # type: Optional[self.Task]
+        self._list_task = None  # type: Optional[self.Task]
+        self._executor = ThreadExecutor(self)
+
+        # Bursts of fileChanged signals (emitted while a large pickle is
+        # being written) are coalesced into a single reload
+        self._pending_path = None
+        self._pending_state = None
+        self._reload_timer = QTimer(self, singleShot=True,
+                                    interval=self.RELOAD_DELAY,
+                                    timeout=self._on_reload_timeout)
+
         self.combo = gui.comboBox(
             self.controlArea, self, 'selected', box='Stored Jupyter Object',
             sendSelectedValue=True, callback=self.output)
@@ -93,16 +147,31 @@ class OWIPythonConnector(widget.OWWidget):
         return glob(os.path.join(STORE.root, '*'))
 
     def update_combo(self):
-        selected = self.selected
-
-        def type_name(x):
-            module = type(x).__module__
-            return (module + '.' if module and module != str.__module__ else '') + type(x).__qualname__
-
-        key_type = ((type_name(v), k) for k, v in STORE.items())
-        items = ['{}  ({})'.format(key, type)
-                 for type, key in sorted(key_type)]
+        """List the stored objects (in a background thread) into the combo."""
+        if self._list_task is not None:
+            self._list_task.cancel()
+            self._list_task.watcher.done.disconnect(self.on_listed)
+        self._list_task = task = self.Task()
+        task.future = self._executor.submit(_list_items)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_listed)
+
+    @Slot(concurrent.futures.Future)
+    def on_listed(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        if self._list_task is None or future is not self._list_task.future:
+            return
+
+        self._list_task = None
+        self.Error.list_error.clear()
+        try:
+            items = future.result()
+        except Exception as ex:  # pylint: disable=broad-except
+            self.Error.list_error(ex)
+            items = []
 
+        selected = self.selected
         self.combo.blockSignals(True)
 
         self.combo.clear()
@@ -128,23 +197,106 @@ class OWIPythonConnector(widget.OWWidget):
     def on_file_changed(self, path):
         key = os.path.basename(path)
         selected = self.selected and self.selected.split()[0]
-        if selected == key:
-            self.output()
+        if selected != key:
+            return
+        # Some editors/writers replace the file, which drops it from the watcher
+        if path not in self.watcher.files() and os.path.exists(path):
+            self.watcher.addPath(path)
+        self._pending_path = path
+        self._pending_state = _file_state(path)
+        self._reload_timer.start()
+
+    def _on_reload_timeout(self):
+        path = self._pending_path
+        if path is None:
+            return
+        state = _file_state(path)
+        if state is None or state != self._pending_state:
+            # File is still being written; wait for it to settle
+            self._pending_state = state
+            self._reload_timer.start()
+            return
+        self._pending_path = self._pending_state = None
+        self.output()
 
     def output(self):
+        self._reload_timer.stop()
+        self._pending_path = self._pending_state = None
+        self.cancel()
+        self.Error.load_error.clear()
+
         key = self.selected and self.selected.split()[0]
-        output_obj = STORE.get(key)
-        output_data = next((func(output_obj)
-                            for type, func in VALID_DATA_TYPES.items()
-                            if isinstance(output_obj, type)), None)
-        self.output_obj = output_obj
-        self.output_data = output_data
+        if not key:
+            self.output_obj = self.output_data = None
+            self.commit()
+            return
+
+        self._task = task = self.Task()
+        task.key = key
+        self.progressBarInit()
+        task.future = self._executor.submit(_load, key)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_loaded)
+
+    def cancel(self):
+        """Cancel the current loading task (if any)."""
+        if self._task is not None:
+            self._task.cancel()
+            # (a load that already started finishes in the background, but
+            # its result is dropped)
+            self._task.watcher.done.disconnect(self.on_loaded)
+            self._task = None
+            self.progressBarFinished()
+
+    class Task:
+        future = ...  # type: concurrent.futures.Future
+        watcher = ...  # type: FutureWatcher
+        key = ''  # type: str
+        cancelled = False  # type: bool
+
+        def cancel(self):
+            self.cancelled = True
+            # Unpickling can't be interrupted; this only succeeds if the
+            # job has not started yet
+            self.future.cancel()
+
+    @Slot(concurrent.futures.Future)
+    def on_loaded(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        # Results of superseded tasks are dropped
+        if self._task is None or future is not self._task.future:
+            return
+
+        key = self._task.key
+        self._task = None
+        self.progressBarFinished()
+
+        try:
+            self.output_obj, self.output_data = future.result()
+        except Exception as ex:  # pylint: disable=broad-except
+            # Foreign or partially written pickles
+            self.Error.load_error(key, ex)
+            self.output_obj = self.output_data = None
         self.commit()
 
     def commit(self):
         self.Outputs.object.send(self.output_obj)
         self.Outputs.data.send(self.output_data)
 
+    def onDeleteWidget(self):
+        paths = self.watcher.files() + self.watcher.directories()
+        if paths:
+            self.watcher.removePaths(paths)
+        self._reload_timer.stop()
+        self.cancel()
+        if self._list_task is not None:
+            self._list_task.cancel()
+            self._list_task.watcher.done.disconnect(self.on_listed)
+            self._list_task = None
+        self._executor.shutdown(wait=False)
+        super().onDeleteWidget()
+
 
 if __name__ == "__main__":
     a = QApplication([])
@@ -1,33 +1,45 @@
+import os
 import sys
 import time
 import itertools
-import heapq
+import hashlib
 import operator
+import pickle
+import logging
+import concurrent.futures
 
 from functools import reduce
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 import numpy as np
 
 from AnyQt.QtWidgets import QListView, QFrame, QGraphicsItem
 from AnyQt.QtGui import (
     QColor, QPen, QPainter, QPainterPath, QPicture, QFont, QFontInfo,
-    QPalette
+    QPalette, QImage
 )
-from AnyQt.QtCore import Qt, QRectF, QPointF
+from AnyQt.QtCore import Qt, QRectF, QThread, QTimer, Slot
 
 import pyqtgraph as pg
 
 import Orange.data
 from Orange.data.sql.table import SqlTable
-from Orange.statistics import contingency
-from Orange.preprocess.discretize import EqualWidth, Discretizer
+from Orange.preprocess.discretize import EqualWidth
 
 from Orange.widgets import widget, gui, settings
 from Orange.widgets.utils import itemmodels, colorpalette
+from Orange.widgets.utils.concurrent import (
+    ThreadExecutor, FutureWatcher, methodinvoke
+)
 from Orange.widgets.widget import Msg
 from Orange.widgets.io import FileFormat
 from Orange.canvas import report
+from Orange.misc.environ import cache_dir
+
+from orangecontrib.prototypes.widgets.utils import blocks
+
+
+log = logging.getLogger(__name__)
 
 
 def is_not_none(obj):
@@ -75,23 +87,207 @@ class Tree(Tree):
                            for ch in filter(is_not_none, self.children.flat)))
 
 
-def max_contingency(node):
-    """Return the maximum contingency value from node."""
-    if node.is_leaf:
-        return node.contingencies.max()
-    else:
-        valid = np.nonzero(node.children)
-        children = node.children[valid]
-        mask = np.ones_like(node.children, dtype=bool)
-        mask[valid] = False
-        ctng = node.contingencies[mask]
+FlatTree = namedtuple(
+    "FlatTree",
+    ["xbins",          # per level (nnodes, nbins + 1) arrays of x bin edges
+     "ybins",          # per level (nnodes, nbins + 1) arrays of y bin edges
+     "contingencies",  # per level (nnodes, nbins, nbins[, k]) contingencies
+     "children",       # per level (nnodes, nbins, nbins) int arrays of
+                       # indices into the next level's nodes (-1 if none)
+     ]
+)
+
+
+class FlatTree(FlatTree):
+    """
+    An array-backed `Tree`.
+
+    The nodes of each level of the tree are stored in contiguous arrays,
+    so operations on the whole tree are a few vectorized passes (one per
+    level) instead of a recursive traversal of the node objects.
+
+    A node is identified by its `(level, index)`; the root is `(0, 0)`.
+    """
+    @property
+    def brect(self):
+        """The bounding rect `(x, y, width, height)` of the root node."""
+        xbins, ybins = self.xbins[0][0], self.ybins[0][0]
+        return (xbins[0], ybins[0],
+                xbins[-1] - xbins[0], ybins[-1] - ybins[0])
+
+    @property
+    def nbins(self):
+        """Number of bins of the root node."""
+        return self.xbins[0].shape[1] - 1
+
+    @property
+    def is_empty(self):
+        return not np.any(self.contingencies[0])
+
+    def depth(self):
+        """Return the tree depth."""
+        return len(self.contingencies)
+
+    @classmethod
+    def from_tree(cls, root):
+        """Return a `FlatTree` from a `Tree` root node."""
+        xbins, ybins, contingencies, children = [], [], [], []
+        nodes = [root]
+        while nodes:
+            shape = nodes[0].contingencies.shape[:2]
+            index = np.full((len(nodes), ) + shape, -1, dtype=int)
+            next_nodes = []
+            for k, node in enumerate(nodes):
+                if node.is_leaf:
+                    continue
+                for (i, j), ch in np.ndenumerate(node.children):
+                    if ch is not None:
+                        index[k, i, j] = len(next_nodes)
+                        next_nodes.append(ch)
+            xbins.append(np.array([node.xbins for node in nodes]))
+            ybins.append(np.array([node.ybins for node in nodes]))
+            contingencies.append(
+                np.array([node.contingencies for node in nodes]))
+            children.append(index)
+            nodes = next_nodes
+        return cls(xbins, ybins, contingencies, children)
+
+    def node(self, level, index):
+        """
+        Return the node `index` of `level` as a leaf `Tree` (its sub nodes
+        are `self.children[level][index]`).
+        """
+        return Tree(self.xbins[level][index], self.ybins[level][index],
+                    self.contingencies[level][index], None)
+
+    def expand(self, level, refined):
+        """
+        Return the tree with new leaf sub nodes of the nodes of `level`.
+
+        `refined` is a sequence of `(index, rows, cols, leaves)` tuples; the
+        `leaves` (leaf `Tree`s) become the sub nodes of the `(rows, cols)`
+        cells of the node `index` (which must not have sub nodes yet). The
+        existing nodes keep their indices.
+        """
+        refined = [item for item in refined if len(item[3])]
+        if not refined:
+            return self
+        leaves = [leaf for item in refined for leaf in item[3]]
+        xbins, ybins, contingencies, children = map(list, self)
+        new = (np.array([leaf.xbins for leaf in leaves]),
+               np.array([leaf.ybins for leaf in leaves]),
+               np.array([leaf.contingencies for leaf in leaves]),
+               np.full((len(leaves), ) + leaves[0].contingencies.shape[:2],
+                       -1, dtype=int))
+        if level + 1 == len(contingencies):
+            start = 0
+            for arrays, array in zip((xbins, ybins, contingencies, children),
+                                     new):
+                arrays.append(array)
+        else:
+            start = len(contingencies[level + 1])
+            for arrays, array in zip((xbins, ybins, contingencies, children),
+                                     new):
+                arrays[level + 1] = np.concatenate((arrays[level + 1], array))
+        index = children[level].copy()
+        for k, rows, cols, leaves in refined:
+            index[k, rows, cols] = np.arange(start, start + len(leaves))
+            start += len(leaves)
+        children[level] = index
+        return FlatTree(xbins, ybins, contingencies, children)
+
+    def to_tree(self):
+        """Return the root `Tree` node."""
+        nodes = []
+        for xbins, ybins, ctng, index in zip(*map(reversed, self)):
+            level = []
+            for k in range(len(ctng)):
+                if np.any(index[k] >= 0):
+                    children = np.full(index[k].shape, None, dtype=object)
+                    for (i, j), c in np.ndenumerate(index[k]):
+                        if c >= 0:
+                            children[i, j] = nodes[c]
+                else:
+                    children = None
+                level.append(Tree(xbins[k], ybins[k], ctng[k], children))
+            nodes = level
+        return nodes[0]
+
+    def take(self, indices, axis=2):
+        """
+        Take elements from the node's contingencies (along the node's
+        `axis`, i.e. 2 for z values)
+        """
+        return self._replace(
+            contingencies=[np.take(c, indices, axis + 1)
+                           for c in self.contingencies])
+
+    def max(self):
+        """Return the maximum contingency value of the displayed cells."""
         v = 0.0
-        if len(children):
-            v = max(max_contingency(ch) for ch in children)
-        if len(ctng):
-            v = max(ctng.max(), v)
+        for ctng, index in zip(self.contingencies, self.children):
+            ctng = ctng[index < 0]
+            if ctng.size:
+                v = max(v, ctng.max())
         return v
 
+    def value_range(self):
+        """
+        Return the (min, max) mean over all non empty cells of a tree
+        of aggregate moments (see `moments_stats`).
+        """
+        means = [mean[count > 0] for count, mean, _ in
+                 map(moments_stats, self.contingencies)]
+        means = np.concatenate(means)
+        if not means.size:
+            return 0.0, 0.0
+        return float(means.min()), float(means.max())
+
+    def count(self):
+        """Return the number of non empty displayed cells."""
+        count = 0
+        for ctng, index in zip(self.contingencies, self.children):
+            mask = ctng.any(axis=3) if ctng.ndim == 4 else ctng > 0
+            count += np.count_nonzero(mask & (index < 0))
+        return count
+
+    def resample(self, samplewidth):
+        """
+        Resample/aggregate the tree, joining `samplewidth` bins.
+
+        `samplewidth` is the number of bins which should be joined and MUST
+        be a power of 2. If larger than 1, `samplewidth` neighboring cells
+        of the root are summed; if smaller than 1 (i.e. undersampled) the
+        sub nodes are kept down to the level whose cells are joined by
+        `samplewidth * nbins ** level` (the cells of the last kept level
+        are displayed).
+        """
+        nbins = self.nbins
+        assert 0 < samplewidth <= nbins
+        assert int(np.log2(samplewidth)) == np.log2(samplewidth)
+
+        # The first level at which the cells are at least `samplewidth`
+        # wide (or the deepest level)
+        depth = self.depth()
+        level = next((level for level in range(depth)
+                      if samplewidth * nbins ** level >= 1), depth - 1)
+        width = int(max(samplewidth * nbins ** level, 1))
+        xbins = self.xbins[:level + 1]
+        ybins = self.ybins[:level + 1]
+        contingencies = self.contingencies[:level + 1]
+        children = self.children[:level] + \
+            [np.full_like(self.children[level], -1)]
+        if width > 1:
+            ctng = contingencies[level]
+            n, N, M = ctng.shape[:3]
+            ctng = ctng.reshape((n, N // width, width, M // width, width) +
+                                ctng.shape[3:]).sum(axis=(2, 4))
+            xbins = xbins[:level] + [xbins[level][:, ::width]]
+            ybins = ybins[:level] + [ybins[level][:, ::width]]
+            contingencies = contingencies[:level] + [ctng]
+            children[level] = children[level][:, ::width, ::width]
+        return FlatTree(xbins, ybins, contingencies, children)
+
 
 def blockshaped(arr, rows, cols):
     """
@@ -155,24 +351,39 @@ class DensityPatch(pg.GraphicsObject):
     """
     A 2-dimentional (rectangular) bin-plot graphics item.
 
-    Displays a contingency from a `Tree` instance, automatically
+    Displays a contingency from a `FlatTree` instance, automatically
     re-sampling to adjust for level of detail.
     """
     #: Density patch shapes
     Rect, RoundRect, Circle = Rect, RoundRect, Circle
     #: Density patch color scale (linear, square root and logarithmic).
     Linear, Sqrt, Log = 1, 2, 3
+    #: Maximum number of cells drawn as vector shapes (Circle/RoundRect) in
+    #: raster mode; denser levels are rendered as images
+    MaxVectorCells = 4096
+
+    #: Default memory budget (in bytes) of the level of detail cache
+    CacheBudget = 64 * 2 ** 20
 
     def __init__(self, root=None, cell_size=10, cell_shape=Rect,
-                 color_scale=Sqrt, palette=None):
+                 color_scale=Sqrt, palette=None, raster=True,
+                 cache_budget=CacheBudget, aggregate=False, executor=None):
         super().__init__()
         self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
         self._root = root
-        self._cache = {}
+        self._cache = PatchCache(cache_budget)
+        self._prefetching = {}
+        # Prefetch in the owner's executor if given (shared with its tasks)
+        if executor is None:
+            executor = ThreadExecutor(self)
+        self._executor = executor
         self._cell_size = cell_size
         self._cell_shape = cell_shape
         self._color_scale = color_scale
         self._palette = palette
+        self._raster = raster
+        # The contingencies are aggregate moments of a continuous variable
+        self._aggregate = aggregate
 
     def boundingRect(self):
         return self.rect()
@@ -185,9 +396,10 @@ class DensityPatch(pg.GraphicsObject):
 
     def set_root(self, root):
         """
-        Set root `Tree` node.
+        Set the root `FlatTree`.
         """
         self.prepareGeometryChange()
+        self.cancel_prefetch()
         self._root = root
         self._cache.clear()
         self.update()
@@ -223,6 +435,31 @@ class DensityPatch(pg.GraphicsObject):
     def color_scale(self):
         return self._color_scale
 
+    def set_cache_budget(self, budget):
+        """
+        Set the memory budget (in bytes) of the level of detail cache.
+        """
+        self._cache.budget = budget
+        self._cache.trim()
+
+    def cache_budget(self):
+        return self._cache.budget
+
+    def set_raster(self, raster):
+        """
+        Set the raster mode.
+
+        In raster mode the cells of each node are painted as a single
+        (scaled) image instead of one shape per cell.
+        """
+        if self._raster != raster:
+            self._raster = raster
+            self._cache.clear()
+            self.update()
+
+    def raster(self):
+        return self._raster
+
     def paint(self, painter, option, widget):
         root = self._root
         if root is None:
@@ -242,40 +479,89 @@ class DensityPatch(pg.GraphicsObject):
 
         p = int(np.floor(np.log2(scale)))
 
-        p = min(max(p, - int(np.log2(nbins ** (root.depth() - 1)))),
-                int(np.log2(root.nbins)))
-
-        if (p, cell_shape, cell_size) not in self._cache:
-            rs_root = resample(root, 2 ** p)
-            rs_max = max_contingency(rs_root)
-
-            def log_scale(ctng):
-                log_max = np.log(rs_max + 1)
-                log_ctng = np.log(ctng + 1)
-                return log_ctng / log_max
+        p_min = - int(np.log2(nbins ** (root.depth() - 1)))
+        p_max = int(np.log2(root.nbins))
+        p = min(max(p, p_min), p_max)
 
-            def sqrt_scale(ctng):
-                sqrt_max = np.sqrt(rs_max)
-                sqrt_ctng = np.sqrt(ctng)
-                return sqrt_ctng / (sqrt_max or 1)
-
-            def lin_scale(ctng):
-                return ctng / (rs_max or 1)
-
-            scale = {self.Linear: lin_scale, self.Sqrt: sqrt_scale,
-                     self.Log: log_scale}
-            patch = Patch_create(rs_root, palette=self._palette,
-                                 scale=scale[self._color_scale],
-                                 shape=cell_shape)
-            self._cache[p, cell_shape, cell_size] = patch
-        else:
-            patch = self._cache[p, cell_shape, cell_size]
+        key = (p, cell_shape, cell_size, self._color_scale)
+        patch = self._cache.get(key)
+        if patch is None:
+            patch = self._create_patch(p)
+            self._cache.put(key, patch)
 
         painter.setRenderHint(QPainter.Antialiasing)
         painter.setPen(Qt.NoPen)
 
-        for picture in picture_intersect(patch, option.exposedRect):
+        # Pictures are created lazily while painting; account for new ones
+        grown = []
+        for picture in picture_intersect(patch, option.exposedRect, grown):
             picture.play(painter)
+        if grown:
+            self._cache.grow(key, sum(grown))
+        self._prefetch(p, p_min, p_max)
+
+    def _create_patch(self, p):
+        return lod_patch(self._root, p, self._cell_shape, self._color_scale,
+                         self._palette, self._raster, self.MaxVectorCells,
+                         self._aggregate)
+
+    def _prefetch(self, p, p_min, p_max):
+        """
+        Create the patches for the levels adjacent to `p` in background.
+
+        Levels are only prefetched while (by the size of the patch at `p`)
+        they fit into the cache budget along with the cached patches, so
+        they do not evict the patch being painted.
+        """
+        shown = (p, self._cell_shape, self._cell_size, self._color_scale)
+        estimate = self._cache.nbytes(shown)
+        for p1 in (p - 1, p + 1):
+            key = (p1, self._cell_shape, self._cell_size, self._color_scale)
+            if not p_min <= p1 <= p_max or key in self._cache or \
+                    key in self._prefetching:
+                continue
+            pending = estimate * (len(self._prefetching) + 1)
+            if self._cache.nbytes() + pending > self._cache.budget:
+                break
+
+            def create(root=self._root, args=(p1, self._cell_shape,
+                                               self._color_scale,
+                                               self._palette, self._raster,
+                                               self.MaxVectorCells,
+                                               self._aggregate)):
+                patch = lod_patch(root, *args)
+                patch.picture()  # evaluate all pictures
+                return patch
+
+            future = self._executor.submit(create)
+            watcher = FutureWatcher(future, parent=self)
+            watcher.done.connect(self._on_prefetched)
+            self._prefetching[key] = (self._root, watcher)
+
+    def cancel_prefetch(self):
+        """
+        Cancel the pending prefetches and drop the results of running ones.
+        """
+        for _, watcher in self._prefetching.values():
+            watcher.future().cancel()
+            watcher.done.disconnect(self._on_prefetched)
+            watcher.deleteLater()
+        self._prefetching.clear()
+
+    @Slot(concurrent.futures.Future)
+    def _on_prefetched(self, future):
+        for key, (root, watcher) in list(self._prefetching.items()):
+            if watcher.future() is future:
+                del self._prefetching[key]
+                watcher.deleteLater()
+                # discard patches of a replaced root or a failed task
+                if root is self._root and key not in self._cache and \
+                        future.exception() is None:
+                    patch = future.result()
+                    nbytes = Patch_nbytes(patch)
+                    # (and those that would evict the painted patches)
+                    if self._cache.nbytes() + nbytes <= self._cache.budget:
+                        self._cache.put(key, patch, nbytes)
 
 #: A visual patch of a Tree 'rendered' as a QPicture
 Patch = namedtuple(
@@ -309,44 +595,181 @@ def once(f):
         if cached is None:
             cached = Some(f())
         return cached.val
+
+    def evaluated():
+        return cached is not None
+
+    f_once.evaluated = evaluated
     return f_once
 
 
-def picture_intersect(patch, region):
+def Patch_nbytes(patch):
+    """
+    Return the size (in bytes) of all pictures evaluated so far in `patch`.
+    """
+    nbytes = 0
+    if getattr(patch.picture, "evaluated", lambda: True)():
+        nbytes += patch.picture().size()
+    if getattr(patch.children, "evaluated", lambda: True)():
+        nbytes += sum(map(Patch_nbytes, patch.children()))
+    return nbytes
+
+
+class PatchCache:
+    """
+    A least recently used cache of `Patch`es, bounded by the total
+    size of their pictures.
+
+    The most recently used patch is never evicted (even if it alone
+    exceeds the budget).
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self._patches = OrderedDict()
+        self._sizes = {}
+
+    def __contains__(self, key):
+        return key in self._patches
+
+    def __len__(self):
+        return len(self._patches)
+
+    def get(self, key, default=None):
+        if key not in self._patches:
+            return default
+        self._patches.move_to_end(key)
+        return self._patches[key]
+
+    def put(self, key, patch, nbytes=None):
+        """Put a `patch` of `nbytes` (computed if None) into the cache."""
+        self._patches[key] = patch
+        self._patches.move_to_end(key)
+        self._sizes[key] = Patch_nbytes(patch) if nbytes is None else nbytes
+        self.trim()
+
+    def grow(self, key, nbytes):
+        """Account for `nbytes` of pictures newly evaluated in a patch."""
+        if key in self._patches:
+            self._sizes[key] += nbytes
+            self.trim()
+
+    def nbytes(self, key=None):
+        """Return the size of all the patches (or of the one at `key`)."""
+        if key is not None:
+            return self._sizes.get(key, 0)
+        return sum(self._sizes.values())
+
+    def trim(self):
+        while len(self._patches) > 1 and self.nbytes() > self.budget:
+            key, _ = self._patches.popitem(last=False)
+            del self._sizes[key]
+
+    def clear(self):
+        self._patches.clear()
+        self._sizes.clear()
+
+
+def picture_intersect(patch, region, grown=None):
     """
     Return a list of all QPictures in `patch` that intersect region.
+
+    If `grown` is a list, the size of the pictures evaluated by this
+    call (including the sub pictures they are composed of) is appended
+    to it.
+
     :type patch: Patch
     :type region: QRectF
+    :type grown: Optional[List[int]]
     :rval: List[Patch]
 
     """
     if not region.intersects(patch.rect):
         return []
     elif region.contains(patch.rect) or patch.is_leaf:
+        if grown is not None and \
+                not getattr(patch.picture, "evaluated", lambda: True)():
+            nbytes = Patch_nbytes(patch)
+            picture = patch.picture()
+            grown.append(Patch_nbytes(patch) - nbytes)
+            return [picture]
         return [patch.picture()]
     else:
         accum = reduce(
             operator.iadd,
-            (picture_intersect(child, region) for child in patch.children()),
+            (picture_intersect(child, region, grown)
+             for child in patch.children()),
             []
         )
         return accum
 
 
-def Patch_create(node, palette=None, scale=None, shape=Rect):
+def lod_patch(root, p, shape=Rect, color_scale=DensityPatch.Sqrt,
+              palette=None, raster=True, max_vector_cells=None,
+              aggregate=False):
     """
-    Return a `Patch` for visualizing `node`.
+    Return a `Patch` of `root` resampled to the level of detail `p`
+    (i.e. joining `2 ** p` bins, see `FlatTree.resample`).
+
+    If `aggregate` is True the root's contingencies are aggregate moments
+    (see `moments_stats`) and the cells are colored by their mean.
+
+    :type root: FlatTree
+    """
+    rs_root = root.resample(2 ** p)
+    if aggregate:
+        # Color over the whole tree's range so all levels match
+        value_range = root.value_range()
+        rs_max = rs_root.take([0]).max()
+    else:
+        value_range = None
+        rs_max = rs_root.max()
+
+    def log_scale(ctng):
+        log_max = np.log(rs_max + 1)
+        log_ctng = np.log(ctng + 1)
+        return log_ctng / log_max
+
+    def sqrt_scale(ctng):
+        sqrt_max = np.sqrt(rs_max)
+        sqrt_ctng = np.sqrt(ctng)
+        return sqrt_ctng / (sqrt_max or 1)
+
+    def lin_scale(ctng):
+        return ctng / (rs_max or 1)
+
+    scale = {DensityPatch.Linear: lin_scale, DensityPatch.Sqrt: sqrt_scale,
+             DensityPatch.Log: log_scale}
+    raster = raster and (
+        shape == Rect or
+        max_vector_cells is not None and rs_root.count() > max_vector_cells)
+    return Patch_create(rs_root, palette=palette, scale=scale[color_scale],
+                        shape=shape, raster=raster, value_range=value_range)
+
+
+def Patch_create(tree, level=0, index=0, palette=None, scale=None,
+                 shape=Rect, raster=False, value_range=None):
+    """
+    Return a `Patch` for visualizing the node `(level, index)` of `tree`.
 
     .. note::
         The patch (picture and children fields) are evaluated lazily.
 
-    :type node: Tree
+    :type tree: FlatTree
     :type palette: colorpalette.PaletteGenerator
     :type scale: nparray -> ndarray
     :type shape: int
+    :param bool raster:
+        Paint the cells as a single image (as rectangles regardless of
+        `shape`)
+    :param value_range:
+        The (min, max) range of the colored means if the node's
+        contingencies are aggregate moments (see `create_image`)
     :rtype: Patch
 
     """
+    node = tree.node(level, index)
+    # indices of the sub nodes in the next level (-1 if none)
+    children = tree.children[level][index]
     if node.is_empty:
         return Patch(node, once(lambda: QPicture()), once(lambda: ()))
     else:
@@ -360,18 +783,23 @@ def Patch_create(node, palette=None, scale=None, shape=Rect):
             pic = QPicture()
             painter = QPainter(pic)
             ctng = node.contingencies
-            colors = create_image(ctng, palette, scale=scale)
+            colors = create_image(ctng, palette, scale=scale,
+                                  value_range=value_range)
             x, y, w, h = node.brect
             N, M = ctng.shape[:2]
 
             # Nonzero contingency mask
             any_mask = Node_mask(node)
 
-            if node.is_leaf:
-                skip = itertools.repeat(False)
-            else:
-                # Skip all None children they were already painted.
-                skip = (ch is not None for ch in node.children.flat)
+            if raster:
+                mask = any_mask & (children < 0)
+                painter.drawImage(QRectF(x, y, w, h),
+                                  image_from_colors(colors, mask))
+                painter.end()
+                return pic
+
+            # Skip the cells with sub nodes; they were already painted.
+            skip = (children >= 0).flat
 
             painter.save()
             painter.translate(x, y)
@@ -395,12 +823,9 @@ def Patch_create(node, palette=None, scale=None, shape=Rect):
         @once
         def child_patches():
             # Return a tuple of all non empty child patches for this node.
-            if node.is_leaf:
-                children = []
-            else:
-                children = filter(is_not_none, node.children.flat)
-            return tuple(Patch_create(child, palette, scale, shape)
-                         for child in children) + \
+            return tuple(Patch_create(tree, level + 1, child, palette, scale,
+                                      shape, raster, value_range)
+                         for child in children[children >= 0]) + \
                    (Patch(node, picture_this_level, once(lambda: ())),)
 
         @once
@@ -417,47 +842,6 @@ def Patch_create(node, palette=None, scale=None, shape=Rect):
         return Patch(node, picture_children, child_patches)
 
 
-def resample(node, samplewidth):
-    """
-    Resample/aggregate the node's contingency, joining `samplewidth` bins.
-
-    `samplewidth` is the number of bins which should be joined and MUST
-    be a power of 2.
-
-    If `samplewidth` == 1 then return the node as is. If larger then
-    1 then sum `samplewidth` neighboring contingency cells returning a
-    new node with shape ``(nbins//samplewidth, nbins//samplewidth)``.
-    If smaller then 1 (i.e. undersampled) recurse into node's
-    subcontingencies with a samplewidth * nbins
-
-    """
-    assert 0 < samplewidth <= node.nbins
-    assert int(np.log2(samplewidth)) == np.log2(samplewidth)
-
-    if samplewidth == 1:
-        return node._replace(children=None)
-    elif samplewidth > 1:
-        samplewidth = int(samplewidth)
-        ctng = blockshaped(node.contingencies, samplewidth, samplewidth)
-        ctng = ctng.sum(axis=(2, 3))
-        assert ctng.shape[0] == node.nbins // samplewidth
-        return Tree(node.xbins[::samplewidth],
-                    node.ybins[::samplewidth],
-                    ctng,
-                    None)
-    elif node.is_leaf:
-        return Tree(*node)
-    else:
-        nbins = node.nbins
-        children = [resample(ch, samplewidth * nbins)
-                    if ch is not None else None
-                    for ch in node.children.flat]
-
-        children_ar = np.full(nbins ** 2, None, dtype=object)
-        children_ar[:] = children
-        return node._replace(children=children_ar.reshape((-1, nbins)))
-
-
 class OWScatterMap(widget.OWWidget):
     name = "Scatter Map"
     description = "Draw a two dimensional rectangular bin density plot."
@@ -478,14 +862,24 @@ class OWScatterMap(widget.OWWidget):
     color_scale = settings.Setting(1)
     sample_level = settings.Setting(0)
 
-    sample_percentages = []
-    sample_percentages_captions = []
+    # Histograms on SqlTables are computed in the database, so (besides
+    # the time samples) the map can always be made exact
+    sample_percentages = [100]
+    sample_percentages_captions = ['Exact (in database)']
     sample_times = [0.5, 3, 5, 20, 40, 80]
     sample_times_captions = ['1 s', '5 s', '10 s', '30 s', '1 min', '2 min']
 
     use_cache = settings.Setting(True)
+    #: Keep refining the map with larger samples (down to exact counts);
+    #: off by default, as it queries the database up to the full table
+    progressive = settings.Setting(False)
+    #: Precompute all zoom levels (down to `pyramid_depth`) in background
+    precompute = settings.Setting(False)
 
     n_bins = 2 ** 4
+    pyramid_depth = 3
+    #: Maximum number of cells refined by one Sharpen (highest chi2 first)
+    max_sharpen_cells = 1024
 
     mouse_mode = 0
 
@@ -497,6 +891,7 @@ class OWScatterMap(widget.OWWidget):
     def __init__(self):
         super().__init__()
 
+        self.original_data = None
         self.dataset = None
         self.z_values = []
 
@@ -505,6 +900,12 @@ class OWScatterMap(widget.OWWidget):
         self._item = None
         self._cache = {}
 
+        self._task = None  # type: Optional[self.Task]
+        self._executor = ThreadExecutor(self)
+        # Restart a running sharpen for the new view after panning/zooming
+        self._resharpen_timer = QTimer(self, singleShot=True, interval=300,
+                                       timeout=self._on_resharpen)
+
         self.colors = colorpalette.ColorPaletteGenerator(10)
 
         box = gui.vBox(self.controlArea, "Axes")
@@ -545,8 +946,20 @@ class OWScatterMap(widget.OWWidget):
         self.sample_combo = gui.comboBox(
             self.sampling_box, self, 'sample_level', items=sampling_options,
             callback=self.update_sample)
+        gui.checkBox(self.sampling_box, self, "progressive",
+                     "Progressive refinement",
+                     callback=self._on_progressive_changed,
+                     tooltip="Render a small sample first, then keep "
+                             "updating the map with larger samples in "
+                             "background.")
         gui.button(self.sampling_box, self, "Sharpen", self.sharpen)
 
+        box = gui.vBox(self.controlArea, "Zoom")
+        gui.checkBox(box, self, "precompute", "Precompute zoom levels",
+                     callback=self._on_precompute_changed,
+                     tooltip="Compute all zoom levels in background and "
+                             "store them on disk for later use.")
+
         gui.rubber(self.controlArea)
 
         self.plot = pg.PlotWidget(background="w")
@@ -590,6 +1003,7 @@ class OWScatterMap(widget.OWWidget):
             self.sample_combo.setEnabled(True)
             self.update_sample()
         else:
+            self.original_data = None
             self.dataset = dataset
             self.sample_combo.setCurrentIndex(-1)
             self.sample_combo.setEnabled(False)
@@ -599,23 +1013,23 @@ class OWScatterMap(widget.OWWidget):
         self.closeContext()
         self.clear()
 
-        if self.sample_level < len(self.sample_times):
-            sample_type = 'time'
-            level = self.sample_times[self.sample_level]
-        else:
-            sample_type = 'percentage'
-            level = self.sample_level - len(self.sample_times)
-            level = self.sample_percentages[level]
-
-        if sample_type == 'time':
-            self.dataset = self.original_data.sample_time(level, no_cache=True)
-        else:
-            if 0 < level < 100:
-                self.dataset = self.original_data.sample_percentage(
-                    level, no_cache=True)
-            if level >= 100:
-                self.dataset = self.original_data
+        self.dataset = self.sample(self.original_data, self.sample_level)
         self.set_sampled_data(self.dataset)
+        if self.progressive:
+            self.start_progressive()
+
+    @classmethod
+    def sample(cls, data, sample_level):
+        """Return a sample of the SqlTable `data` at `sample_level`."""
+        if sample_level < len(cls.sample_times):
+            level = cls.sample_times[sample_level]
+            return data.sample_time(level, no_cache=True)
+
+        level = sample_level - len(cls.sample_times)
+        level = cls.sample_percentages[level]
+        if level >= 100:
+            return data
+        return data.sample_percentage(level, no_cache=True)
 
     def set_sampled_data(self, dataset):
         if dataset is None:
@@ -627,12 +1041,14 @@ class OWScatterMap(widget.OWWidget):
 
         self.x_var_model[:] = cvars
         self.y_var_model[:] = cvars
-        self.z_var_model[:] = dvars
+        # Continuous variables color the cells by their mean value
+        self.z_var_model[:] = dvars + cvars
 
         nvars = len(cvars)
         self.x_var_index = min(max(0, self.x_var_index), nvars - 1)
         self.y_var_index = min(max(0, self.y_var_index), nvars - 1)
-        self.z_var_index = min(max(0, self.z_var_index), len(dvars) - 1)
+        self.z_var_index = min(max(0, self.z_var_index),
+                               len(self.z_var_model) - 1)
 
         if domain.has_discrete_class:
             self.z_var_index = dvars.index(domain.class_var)
@@ -640,20 +1056,13 @@ class OWScatterMap(widget.OWWidget):
             self.z_var_index = len(dvars) - 1
 
         self.openContext(dataset)
-
-        if 0 <= self.z_var_index < len(self.z_var_model):
-            self.z_values = self.z_var_model[self.z_var_index].values
-            k = len(self.z_values)
-            self.selected_z_values = range(k)
-            self.colors = colorpalette.ColorPaletteGenerator(k)
-            for i in range(k):
-                item = self.z_values_view.item(i)
-                item.setIcon(colorpalette.ColorPixmap(self.colors[i]))
+        self._update_z_values()
 
         self.error("Data contains no continuous features", shown=not cvars)
         self.setup_plot()
 
     def clear(self):
+        self.cancel()
         self.dataset = None
         self.x_var_model[:] = []
         self.y_var_model[:] = []
@@ -661,22 +1070,27 @@ class OWScatterMap(widget.OWWidget):
         self.z_values = []
         self._root = None
         self._displayed_root = None
-        self._item = None
+        self._clear_plot()
         self._cache = {}
-        self.plot.clear()
         self.clear_messages()
 
-    def _on_z_var_changed(self):
-        if 0 <= self.z_var_index < len(self.z_var_model):
-            self.z_values = self.z_var_model[self.z_var_index].values
+    def _update_z_values(self):
+        zvar = self._current_vars()[2]
+        if zvar is not None and zvar.is_discrete:
+            self.z_values = zvar.values
             k = len(self.z_values)
             self.selected_z_values = range(k)
-
             self.colors = colorpalette.ColorPaletteGenerator(k)
             for i in range(k):
                 item = self.z_values_view.item(i)
                 item.setIcon(colorpalette.ColorPixmap(self.colors[i]))
+        else:
+            self.z_values = []
+            self.selected_z_values = []
 
+    def _on_z_var_changed(self):
+        if 0 <= self.z_var_index < len(self.z_var_model):
+            self._update_z_values()
             self.replot()
 
     def _on_z_values_selection_changed(self):
@@ -710,29 +1124,142 @@ class OWScatterMap(widget.OWWidget):
         axis = self.plot.getAxis("left")
         axis.setLabel(yvar.name)
 
+        self.cancel()
         if (xvar, yvar, zvar) in self._cache:
             root = self._cache[xvar, yvar, zvar]
+        elif self.precompute and self._load_pyramid(xvar, yvar, zvar):
+            root = self._cache[xvar, yvar, zvar]
         else:
             root = self.get_root(data, xvar, yvar, zvar)
             if root is None:
                 return
             self._cache[xvar, yvar, zvar] = root
+            if self.precompute:
+                self.start_pyramid(root)
 
         self._root = root
 
         self.update_map(root)
 
+    def _load_pyramid(self, xvar, yvar, zvar):
+        root = pyramid_load(self.dataset, xvar, yvar, zvar,
+                            self.n_bins, self.pyramid_depth)
+        if root is not None:
+            self._cache[xvar, yvar, zvar] = root
+        return root is not None
+
+    def _on_precompute_changed(self):
+        if self.precompute and self._root is not None:
+            self.start_pyramid(self._root)
+        else:
+            self.cancel()
+
+    def start_pyramid(self, root):
+        """
+        Start precomputing all zoom levels of `root` in a background thread.
+        """
+        self.cancel()
+        data = self.dataset
+        xvar = self.x_var_model[self.x_var_index]
+        yvar = self.y_var_model[self.y_var_index]
+        zvar = None
+        if 0 <= self.z_var_index < len(self.z_var_model):
+            zvar = self.z_var_model[self.z_var_index]
+        nbins, depth = self.n_bins, self.pyramid_depth
+
+        self._task = task = self.Task()
+        task.key = (xvar, yvar, zvar)
+        progress = methodinvoke(self, "setProgressValue", (int, int))
+
+        def callback(i, n):
+            if task.cancelled:
+                raise concurrent.futures.CancelledError()
+            progress(i, n)
+
+        def run():
+            def bin_func(xbins, ybins):
+                return grid_bin(data, xvar, yvar, xbins, ybins, zvar)
+            tree = pyramid_expand(root.to_tree(), nbins, depth, bin_func,
+                                  callback)
+            tree = FlatTree.from_tree(tree)
+            pyramid_store(tree, data, xvar, yvar, zvar, nbins, depth)
+            return tree
+
+        self.progressBarInit()
+        task.future = self._executor.submit(run)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_pyramid_done)
+
+    def cancel(self):
+        """Cancel the current background task (if any)."""
+        self._resharpen_timer.stop()
+        if self._task is not None:
+            self._task.cancel()
+            # (a running task stops at its next check of `cancelled`; its
+            # result is dropped)
+            self._task.watcher.done.disconnect()
+            self._task = None
+            self.progressBarFinished()
+
+    @Slot(int, int)
+    def setProgressValue(self, n, N):
+        assert self.thread() is QThread.currentThread()
+        self.progressBarSet(n / (N + 1) * 100)
+
+    class Task:
+        future = ...  # type: concurrent.futures.Future
+        watcher = ...  # type: FutureWatcher
+        cancelled = False  # type: bool
+        key = None  # type: Tuple[Variable, Variable, Optional[Variable]]
+        region = None  # type: Optional[QRectF]
+        progressive = False  # type: bool
+
+        def cancel(self):
+            # The running computations poll the flag (between the binning
+            # steps) and stop
+            self.cancelled = True
+            # Cancel the future. Note this succeeds only if the execution has
+            # not yet started (see `concurrent.futures.Future.cancel`)
+            self.future.cancel()
+
+    @Slot(concurrent.futures.Future)
+    def on_pyramid_done(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        # Drop the results of superseded tasks
+        if self._task is None or future is not self._task.future:
+            return
+
+        task, self._task = self._task, None
+        self.progressBarFinished()
+
+        try:
+            root = future.result()
+        except Exception:
+            log.exception("Error precomputing the zoom levels")
+            return
+
+        self._cache[task.key] = root
+        self._root = root
+        self.update_map(root)
+
     def get_root(self, data, xvar, yvar, zvar=None):
         """Compute the root density map item"""
         assert self.n_bins > 2
-        x_disc = EqualWidth(n=self.n_bins)(data, xvar)
-        y_disc = EqualWidth(n=self.n_bins)(data, yvar)
+        fixed = None
+        if any(blocks.is_memmap(_column(data, var)) for var in (xvar, yvar)):
+            # Avoid loading the (memory mapped) columns to find the range
+            fixed = {var.name: (blocks.nanmin(_column_blocks(data, var))[0],
+                                blocks.nanmax(_column_blocks(data, var))[0])
+                     for var in (xvar, yvar)}
+        x_disc = EqualWidth(n=self.n_bins)(data, xvar, fixed)
+        y_disc = EqualWidth(n=self.n_bins)(data, yvar, fixed)
 
         def bins(var, orig_var):
             points = list(var.compute_value.points)
             if not len(points):
-                col = data.get_column_view(orig_var)[0]
-                return np.arange(self.n_bins) + np.mean(col[~np.isnan(col)])
+                mean = blocks.nanmean(_column_blocks(data, orig_var))[0]
+                return np.arange(self.n_bins) + mean
             assert points[0] <= points[1]
             width = points[1] - points[0]
             return np.array([points[0] - width] +
@@ -749,41 +1276,136 @@ class OWScatterMap(widget.OWWidget):
             self.Error.no_values(yvar)
             return None
 
+        # Refined sub nodes are binned on half open intervals; move the
+        # outer edges (at the data's min/max) out a bit so the extremes
+        # are kept inside.
+        for bins in (xbins, ybins):
+            eps = (bins[-1] - bins[0]) * 1e-9
+            bins[0], bins[-1] = bins[0] - eps, bins[-1] + eps
+
         # Extend the lower/upper bin edges to infinity.
         # (the grid_bin function has an optimization for this case).
         xbins1 = np.r_[-np.inf, xbins[1:-1], np.inf]
         ybins1 = np.r_[-np.inf, ybins[1:-1], np.inf]
 
         t = grid_bin(data, xvar, yvar, xbins1, ybins1, zvar=zvar)
-        return t._replace(xbins=xbins, ybins=ybins)
+        return FlatTree.from_tree(t._replace(xbins=xbins, ybins=ybins))
 
     def replot(self):
         self.setup_plot()
+        if self.progressive:
+            self.start_progressive()
 
-    def update_map(self, root):
+    def _on_progressive_changed(self):
+        if self.progressive:
+            self.start_progressive()
+        elif self._task is not None and self._task.progressive:
+            self.cancel()
+
+    def start_progressive(self):
+        """
+        Refine the current root with successively larger samples (up to
+        the exact counts) in a background thread.
+
+        The tree structure (including any sharpened nodes) is kept; only
+        the counts are updated (see `tree_rebin`).
+        """
+        if not isinstance(self.original_data, SqlTable) or self._root is None:
+            return
+        nlevels = len(self.sample_times) + len(self.sample_percentages)
+        levels = range(self.sample_level + 1, nlevels)
+        if not levels:
+            return
+
+        self.cancel()
+        self._task = task = self.Task()
+        task.key = xvar, yvar, zvar = self._current_vars()
+        task.progressive = True
+        original, root, sample = self.original_data, self._root, self.sample
+        progress = methodinvoke(self, "setProgressValue", (int, int))
+        partial = methodinvoke(self, "_on_progressive_partial",
+                               (object, object))
+
+        def check():
+            if task.cancelled:
+                raise concurrent.futures.CancelledError()
+
+        def run():
+            tree = root
+            for i, level in enumerate(levels):
+                check()
+                data = sample(original, level)
+
+                def bin_func(xbins, ybins):
+                    return grid_bin(data, xvar, yvar, xbins, ybins, zvar)
+
+                tree = tree_rebin(tree, bin_func, check)
+                partial(task, (tree, data, level))
+                progress(i + 1, len(levels))
+            return tree, data, level
+
+        self.progressBarInit()
+        task.future = self._executor.submit(run)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_progressive_done)
+
+    @Slot(object, object)
+    def _on_progressive_partial(self, task, stage):
+        assert self.thread() is QThread.currentThread()
+        if task is self._task:
+            self._set_progressive_stage(task.key, *stage)
+
+    def _set_progressive_stage(self, key, root, data, level):
+        if root is self._root:
+            return
+        self.dataset = data
+        self.sample_level = level
+        # The cached maps for other variables are now less exact
+        self._cache = {key: root}
+        self._root = root
+        self.update_map(root)
+
+    @Slot(concurrent.futures.Future)
+    def on_progressive_done(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        # Drop the results of superseded tasks
+        if self._task is None or future is not self._task.future:
+            return
+
+        task, self._task = self._task, None
+        self.progressBarFinished()
+
+        try:
+            stage = future.result()
+        except Exception:
+            log.exception("Error refining the map")
+            return
+
+        self._set_progressive_stage(task.key, *stage)
+        if self.precompute:
+            self.start_pyramid(self._root)
+
+    def _clear_plot(self):
+        if self._item is not None:
+            self._item.cancel_prefetch()
         self.plot.clear()
         self._item = None
 
+    def update_map(self, root):
+        self._clear_plot()
+
         self._displayed_root = root
 
         palette = self.colors
-        contingencies = root.contingencies
-
-        def Tree_take(node, indices, axis):
-            """Take elements from the contingency matrices in node."""
-            contig = np.take(node.contingencies, indices, axis)
-            if node.is_leaf:
-                return node._replace(contingencies=contig)
-            else:
-                children_ar = np.full(node.children.size, None, dtype=object)
-                children_ar[:] = [
-                    Tree_take(ch, indices, axis) if ch is not None else None
-                    for ch in node.children.flat
-                ]
-                children = children_ar.reshape(node.children.shape)
-                return node._replace(contingencies=contig, children=children)
-
-        if contingencies.ndim == 3:
+        # (the root node's contingencies)
+        contingencies = root.contingencies[0][0]
+        zvar = self._current_vars()[2]
+        aggregate = zvar is not None and zvar.is_continuous
+
+        if aggregate:
+            palette = None
+        elif contingencies.ndim == 3:
             if not self.selected_z_values:
                 return
 
@@ -791,64 +1413,108 @@ class OWScatterMap(widget.OWWidget):
 
             if self.selected_z_values != list(range(k)):
                 palette = [palette[i] for i in self.selected_z_values]
-                root = Tree_take(root, self.selected_z_values, 2)
+                root = root.take(self.selected_z_values, 2)
 
         self._item = item = DensityPatch(
             root, cell_size=10,
             cell_shape=DensityPatch.Rect,
             color_scale=self.color_scale + 1,
-            palette=palette
+            palette=palette,
+            aggregate=aggregate,
+            executor=self._executor
         )
         self.plot.addItem(item)
 
-    def sharpen(self):
+    def _view_rect(self):
         viewb = self.plot.getViewBox()
         rect = viewb.boundingRect()
         p1 = viewb.mapToView(rect.topLeft())
         p2 = viewb.mapToView(rect.bottomRight())
-        rect = QRectF(p1, p2).normalized()
-
-        self.sharpen_region(rect)
+        return QRectF(p1, p2).normalized()
 
-    def sharpen_root_region(self, region):
-        data = self.dataset
-        xvar = self.x_var_model[self.x_var_index]
-        yvar = self.y_var_model[self.y_var_index]
+    def sharpen(self):
+        self.sharpen_region(self._view_rect())
 
+    def _current_vars(self):
+        xvar = yvar = zvar = None
+        if 0 <= self.x_var_index < len(self.x_var_model):
+            xvar = self.x_var_model[self.x_var_index]
+        if 0 <= self.y_var_index < len(self.y_var_model):
+            yvar = self.y_var_model[self.y_var_index]
         if 0 <= self.z_var_index < len(self.z_var_model):
             zvar = self.z_var_model[self.z_var_index]
-        else:
-            zvar = None
+        return xvar, yvar, zvar
 
-        root = self._root
+    def start_sharpen(self, refine, total, key, region):
+        """
+        Run the sharpening in a background thread.
 
-        if not QRectF(*root.brect).intersects(region):
+        `refine` is a function returning an iterator over successively
+        refined roots. Intermediate roots are streamed to the plot as they
+        are computed; the last one becomes the new root.
+        """
+        self.cancel()
+        self._task = task = self.Task()
+        task.key, task.region = key, region
+        progress = methodinvoke(self, "setProgressValue", (int, int))
+        partial = methodinvoke(self, "_on_sharpen_partial", (object, object))
+
+        def run():
+            root = None
+            update_time = time.time()
+            for i, root in enumerate(refine()):
+                if task.cancelled:
+                    raise concurrent.futures.CancelledError()
+                progress(i + 1, total)
+                if time.time() - update_time > 0.5:
+                    partial(task, root)
+                    update_time = time.time()
+            return root
+
+        self.progressBarInit()
+        task.future = self._executor.submit(run)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self.on_sharpen_done)
+
+    @Slot(object, object)
+    def _on_sharpen_partial(self, task, root):
+        assert self.thread() is QThread.currentThread()
+        # Ignore updates queued by a cancelled (superseded) task
+        if task is self._task and root is not None:
+            self._root = self._cache[task.key] = root
+            self.update_map(root)
+
+    @Slot(concurrent.futures.Future)
+    def on_sharpen_done(self, future):
+        assert self.thread() is QThread.currentThread()
+        assert future.done()
+        # Drop the results of superseded tasks
+        if self._task is None or future is not self._task.future:
             return
 
-        nbins = self.n_bins
+        task, self._task = self._task, None
+        self.progressBarFinished()
 
-        def bin_func(xbins, ybins):
-            return grid_bin(data, xvar, yvar, xbins, ybins, zvar)
+        try:
+            root = future.result()
+        except Exception:
+            log.exception("Error sharpening the map")
+            return
 
-        last_node = root
-        update_time = time.time()
-        changed = False
-
-        with self.progressBar(nbins ** 2) as progress_bar:
-            for i, node in enumerate(
-                    sharpen_region(self._root, region, nbins, bin_func)):
-                tick = time.time() - update_time
-                changed = changed or node is not last_node
-                if changed and ((i % nbins == 0) or tick > 2.0):
-                    self.update_map(node)
-                    last_node = node
-                    changed = False
-                    update_time = time.time()
-                    progress_bar.advance()
+        if root is not None:
+            self._root = self._cache[task.key] = root
+            self.update_map(root)
 
-        self._root = last_node
-        self._cache[xvar, yvar, zvar] = self._root
-        self.update_map(self._root)
+    def _on_resharpen(self):
+        task = self._task
+        if task is None or task.region is None:
+            return
+        rect = self._view_rect()
+        if rect != task.region:
+            # The view has changed; supersede the running sharpen (the
+            # refinements streamed so far are kept in `_root`)
+            self.cancel()
+            self.sharpen_region(rect)
 
     def _sampling_width(self):
         if self._item is None:
@@ -872,14 +1538,7 @@ class OWScatterMap(widget.OWWidget):
         data = self.dataset
         root = self._root
         nbins = self.n_bins
-        xvar = yvar = zvar = None
-
-        if 0 <= self.x_var_index < len(self.x_var_model):
-            xvar = self.x_var_model[self.x_var_index]
-        if 0 <= self.y_var_index < len(self.y_var_model):
-            yvar = self.y_var_model[self.y_var_index]
-        if 0 <= self.z_var_index < len(self.z_var_model):
-            zvar = self.z_var_model[self.z_var_index]
+        xvar, yvar, zvar = self._current_vars()
 
         if data is None or xvar is None or yvar is None or root is None:
             return
@@ -890,69 +1549,79 @@ class OWScatterMap(widget.OWWidget):
         def bin_func(xbins, ybins):
             return grid_bin(data, xvar, yvar, xbins, ybins, zvar)
 
-        def min_depth(node, region):
+        def min_depth(level, index):
+            node = root.node(level, index)
+            children = root.children[level][index]
             if not region.intersects(QRectF(*node.brect)):
                 return np.inf
-            elif node.is_leaf:
+            elif not np.any(children >= 0):
                 return 1
             elif node.is_empty:
                 return 1
             else:
                 xs, xe, ys, ye = bindices(node, region)
-                children = node.children[xs: xe, ys: ye].ravel()
-                contingency = node.contingencies[xs: xe, ys: ye]
-                if contingency.ndim == 3:
-                    contingency = contingency.reshape(-1, contingency.shape[2])
-
-                if any(ch is None and np.any(val)
-                       for ch, val in zip(children, contingency)):
+                children = children[xs: xe, ys: ye]
+                nonempty = Node_mask(node)[xs: xe, ys: ye]
+                if np.any(nonempty & (children < 0)):
                     return 1
                 else:
-                    ch_depth = [min_depth(ch, region) + 1
-                                for ch in filter(is_not_none, children.flat)]
+                    ch_depth = [min_depth(level + 1, ch) + 1
+                                for ch in children[children >= 0]]
                     return min(ch_depth if ch_depth else [1])
 
-        depth = min_depth(self._root, region)
+        depth = min_depth(0, 0)
         bw = self._sampling_width()
-        nodes = self.select_nodes_to_sharpen(self._root, region, bw,
-                                             depth + 1)
-
-        def update_rects(node):
-            scored = score_candidate_rects(node, region)
-            ind1 = set(zip(*Node_nonzero(node)))
-            ind2 = set(zip(*node.children.nonzero())) \
-                   if not node.is_leaf else set()
-            ind = ind1 - ind2
-            return [(score, r) for score, i, j, r in scored if (i, j) in ind]
-
-        scored_rects = reduce(operator.iadd, map(update_rects, nodes), [])
-        scored_rects = sorted(scored_rects, reverse=True,
-                              key=operator.itemgetter(0))
-        root = self._root
-        update_time = time.time()
-
-        with self.progressBar(len(scored_rects)) as progress_bar:
-            for i, (_, rect) in enumerate(scored_rects):
-                root = sharpen_region_recur(
-                    root, rect.intersected(region),
-                    nbins, depth + 1, bin_func)
-                tick = time.time() - update_time
-                if tick > 2.0:
-                    self.update_map(root)
-                    update_time = time.time()
-                progress_bar.advance()
-
-        self._root = root
-
-        self._cache[xvar, yvar, zvar] = self._root
-        self.update_map(self._root)
+        nodes = self.select_nodes_to_sharpen(root, region, bw, depth + 1)
+        if not nodes:
+            return
 
-    def select_nodes_to_sharpen(self, node, region, bw, depth):
+        # Cells with aggregates are refined where their values vary most
+        score_func = moments_scores if zvar is not None and \
+            zvar.is_continuous else None
+        candidates = [candidate_cells(root.node(level, index), region,
+                                      score_func,
+                                      root.children[level][index] >= 0)
+                      for level, index in nodes]
+        node_index = np.concatenate([np.full(len(rows), k, dtype=int)
+                                     for k, (rows, _, _) in
+                                     enumerate(candidates)])
+        rows, cols, scores = (np.concatenate(arrays)
+                              for arrays in zip(*candidates))
+        selected = top_k(scores, self.max_sharpen_cells)
+
+        # Refine the nodes in the order of their best cell's score; each
+        # node's selected cells are binned with one grid_bin call
+        _, first = np.unique(node_index[selected], return_index=True)
+        order = node_index[selected][np.sort(first)]
+
+        def refine():
+            tree = root
+            for k in order:
+                cells = selected[node_index[selected] == k]
+                level, index = nodes[k]
+                refined = bin_node_cells(
+                    root.node(level, index), (rows[cells], cols[cells]),
+                    nbins, bin_func)
+                # (the existing nodes keep their indices)
+                tree = tree.expand(level, [(index, ) + refined])
+                yield tree
+
+        self.start_sharpen(refine, len(order), (xvar, yvar, zvar), region)
+
+    def select_nodes_to_sharpen(self, root, region, bw, depth, level=0,
+                                index=0):
         """
-        :param node:
+        Return a list of `(level, index)` tuples of the nodes of `root`
+        with cells to refine.
+
+        :param FlatTree root:
         :param bw: bandwidth (samplewidth)
         :param depth: maximum node depth to consider
+        :param level: the level of the node
+        :param index: the index of the node in its level
         """
+        node = root.node(level, index)
+        children = root.children[level][index]
 
         if not QRectF(*node.brect).intersects(region):
             return []
@@ -962,35 +1631,32 @@ class OWScatterMap(widget.OWWidget):
             return []
         elif node.is_empty:
             return []
-        elif node.is_leaf:
-            return [node]
+        elif not np.any(children >= 0):
+            return [(level, index)]
         else:
-            xs, xe, ys, ye = bindices(node, region)
-
-            def intersect_indices(rows, cols):
-                mask = (xs <= rows) & (rows < xe) & (ys <= cols) & (cols < ye)
-                return rows[mask], cols[mask]
-
-            indices1 = intersect_indices(*Node_nonzero(node))
-            indices2 = intersect_indices(*node.children.nonzero())
             # If there are any non empty and non expanded cells in the
             # intersection return the node for sharpening, ...
-            if np.any(np.array(indices1) != np.array(indices2)):
-                return [node]
+            if len(candidate_cells(node, region, expanded=children >= 0)[0]):
+                return [(level, index)]
 
-            children = node.children[indices2]
+            xs, xe, ys, ye = bindices(node, region)
+            rows, cols = np.nonzero(children >= 0)
+            mask = (xs <= rows) & (rows < xe) & (ys <= cols) & (cols < ye)
             # ... else run down the children in the intersection
             return reduce(operator.iadd,
                           (self.select_nodes_to_sharpen(
-                               ch, region, bw * node.nbins, depth - 1)
-                           for ch in children.flat),
+                               root, region, bw * node.nbins, depth - 1,
+                               level + 1, children[i, j])
+                           for i, j in zip(rows[mask], cols[mask])),
                           [])
 
     def _on_transform_changed(self, *args):
-        pass
+        if self._task is not None and self._task.region is not None:
+            self._resharpen_timer.start()
 
     def onDeleteWidget(self):
         self.clear()
+        self._executor.shutdown(wait=False)
         super().onDeleteWidget()
 
     def get_widget_name_extension(self):
@@ -1011,171 +1677,447 @@ class OWScatterMap(widget.OWWidget):
         self.report_caption(caption)
 
 
-def grid_bin(data, xvar, yvar, xbins, ybins, zvar=None):
-    x_disc = Discretizer.create_discretized_var(xvar, xbins[1:-1])
-    y_disc = Discretizer.create_discretized_var(yvar, ybins[1:-1])
+def grid_bin(data, xvar, yvar, xbins, ybins, zvar=None, weight_var=None):
+    """
+    Bin `data` on a `xbins` x `ybins` grid.
 
-    x_min, x_max = xbins[0], xbins[-1]
-    y_min, y_max = ybins[0], ybins[-1]
+    A discrete `zvar` splits the counts by its values; for a continuous
+    `zvar` the (N, M, 3) aggregate moments (count, sum and sum of
+    squares, see `moments_stats`) of its values are computed instead.
+    If `weight_var` is given its values are used as instance weights.
 
-    querydomain = [x_disc, y_disc]
-    if zvar is not None:
-        querydomain = querydomain + [zvar]
+    In-memory tables are binned directly over the column arrays
+    (see `grid_bin_array`); for `SqlTable`s the histogram is computed by
+    the database with a single aggregate query (see `grid_bin_sql`).
 
-    querydomain = Orange.data.Domain(querydomain)
+    :rtype: Tree
+    """
+    if isinstance(data, SqlTable):
+        return grid_bin_sql(data, xvar, yvar, xbins, ybins, zvar, weight_var)
+    else:
+        return grid_bin_array(data, xvar, yvar, xbins, ybins, zvar,
+                              weight_var)
 
-    def interval_filter(var, low, high):
-        return Orange.data.filter.Values(
-            [Orange.data.filter.FilterContinuous(
-                 var, max=high, min=low,
-                 oper=Orange.data.filter.FilterContinuous.Between)]
-        )
 
-    def value_filter(var, val):
-        return Orange.data.filter.Values(
-            [Orange.data.filter.FilterDiscrete(var, [val])]
-        )
+def grid_bin_array(data, xvar, yvar, xbins, ybins, zvar=None,
+                   weight_var=None):
+    """
+    Bin an in-memory `data` table on a `xbins` x `ybins` grid.
 
-    def filters_join(filters):
-        return Orange.data.filter.Values(
-            reduce(list.__iadd__, (f.conditions for f in filters), [])
-        )
+    The full (x bins, y bins[, z values]) histogram is computed with a
+    single `np.searchsorted` per axis and one `np.bincount` over the
+    combined cell index.
+
+    Bins are closed on the left (`xbins[i] <= x < xbins[i + 1]`) except
+    for the outer edges which (as in `FilterContinuous.Between`) are
+    inclusive on both ends.
 
-    inf_bounds = np.isinf([x_min, x_max, y_min, y_max])
-    if not all(inf_bounds):
-        # No need to filter the data
-        range_filters = [interval_filter(xvar, x_min, x_max),
-                         interval_filter(yvar, y_min, y_max)]
-        range_filter = filters_join(range_filters)
-        subset = range_filter(data)
+    :rtype: Tree
+    """
+    x, y, weights = (_column(data, var) for var in (xvar, yvar, weight_var))
+    if zvar is not None and zvar.is_continuous:
+        def hist(x, y, values, weights):
+            return histogram2d_moments(x, y, xbins, ybins, values, weights)
+        columns = (x, y, _column(data, zvar), weights)
     else:
-        subset = data
-
-    if zvar and zvar.is_discrete:
-        filters = [value_filter(zvar, val) for val in zvar.values]
-        contingencies = [
-            contingency.get_contingency(
-                filter_(subset.from_table(querydomain, subset)),
-                col_variable=y_disc, row_variable=x_disc
-            )
-            for filter_ in filters
-        ]
-        contingencies = np.dstack(contingencies)
+        z, nz = _z_column(data, zvar)
+
+        def hist(x, y, z, weights):
+            return histogram2d(x, y, xbins, ybins, z, nz, weights=weights)
+        columns = (x, y, z, weights)
+
+    if any(blocks.is_memmap(col) for col in columns):
+        # Accumulate the counts over blocks of rows so only a block of the
+        # (memory mapped) columns is in memory at a time
+        def block(col, rows):
+            if col is None:
+                return None
+            return np.asarray(col[rows], dtype=float)
+        row_bytes = 8 * len(columns)
+        contingencies = sum(
+            hist(*(block(col, rows) for col in columns))
+            for rows in blocks.row_blocks(len(x), row_bytes))
+        if np.isscalar(contingencies):  # (no rows)
+            contingencies = hist(*columns)
     else:
-        contingencies = contingency.get_contingency(
-            subset.from_table(querydomain, subset),
-            col_variable=y_disc, row_variable=x_disc
-        )
-
-    contingencies = np.asarray(contingencies)
+        contingencies = hist(*columns)
     return Tree(xbins, ybins, contingencies, None)
 
 
-def sharpen_node_cell(node, i, j, nbins, gridbin_func):
-    if node.is_leaf:
-        children = np.full((nbins, nbins), None, dtype=object)
+def _column(data, var):
+    """Return the `var` column of `data` as a float array (or None).
+
+    Memory mapped columns are returned as they are (not loaded).
+    """
+    if var is None:
+        return None
+    col = data.get_column_view(var)[0]
+    if blocks.is_memmap(col):
+        return col
+    return np.asarray(col, dtype=float)
+
+
+def _column_blocks(data, var):
+    """Return the `var` column of `data` as a `blocks.ColumnBlocks`."""
+    return blocks.ColumnBlocks(_column(data, var)[:, np.newaxis])
+
+
+def _z_column(data, zvar):
+    """Return the (z column, number of z values) args for `histogram2d`."""
+    if zvar is not None and zvar.is_discrete:
+        return _column(data, zvar), len(zvar.values)
     else:
-        children = np.array(node.children, dtype=None)
+        return None, None
+
+
+def _cell_index(x, y, xbins, ybins, *columns):
+    """
+    Return the flat (x bin, y bin) cell index of the points and the
+    `columns` restricted to the same (binned) points.
+
+    Points with any unknown (NaN) value and points outside of the outer
+    bin edges are dropped. `None` columns are passed through.
+    """
+    def take(mask, *arrays):
+        return [a[mask] if a is not None else None for a in arrays]
+
+    mask = ~(np.isnan(x) | np.isnan(y))
+    for col in columns:
+        if col is not None:
+            mask &= ~np.isnan(col)
+    x, y, *columns = take(mask, x, y, *columns)
+
+    mask = np.ones(x.shape, dtype=bool)
+    if not np.all(np.isinf([xbins[0], xbins[-1]])):
+        mask &= (xbins[0] <= x) & (x <= xbins[-1])
+    if not np.all(np.isinf([ybins[0], ybins[-1]])):
+        mask &= (ybins[0] <= y) & (y <= ybins[-1])
+    if not mask.all():
+        x, y, *columns = take(mask, x, y, *columns)
+
+    # Inner edges only; this puts the (inclusive) outer edges in the
+    # first/last bin
+    xi = np.searchsorted(xbins[1:-1], x, side="right")
+    yi = np.searchsorted(ybins[1:-1], y, side="right")
+    return (xi * (len(ybins) - 1) + yi,) + tuple(columns)
+
+
+def histogram2d(x, y, xbins, ybins, z=None, nz=None, weights=None):
+    """
+    Count the (x, y[, z]) points falling in each `xbins` x `ybins` cell.
+
+    Points with any unknown (NaN) coordinate (or weight) and points
+    outside of the outer bin edges are ignored.
+
+    :param np.ndarray x: x coordinates
+    :param np.ndarray y: y coordinates
+    :param np.ndarray xbins: bin edges on the x axis
+    :param np.ndarray ybins: bin edges on the y axis
+    :param np.ndarray z: discrete (integer valued) z coordinates or None
+    :param int nz: number of distinct z values
+    :param np.ndarray weights: point weights (sums the weights instead of
+        counting the points) or None
+    :return: a (nx, ny) or (nx, ny, nz) float array of counts
+    """
+    index, z, weights = _cell_index(x, y, xbins, ybins, z, weights)
+    shape = (len(xbins) - 1, len(ybins) - 1)
+    if z is not None:
+        index = index * nz + z.astype(int)
+        shape = shape + (nz,)
+    counts = np.bincount(index, weights=weights,
+                         minlength=int(np.prod(shape)))
+    return counts.reshape(shape).astype(float)
+
+
+def histogram2d_moments(x, y, xbins, ybins, values, weights=None):
+    """
+    Aggregate continuous `values` of the (x, y) points in each `xbins` x
+    `ybins` cell.
+
+    The cell index is computed once and the (weighted) count, sum and sum
+    of squares are accumulated with `np.bincount` over it. Points with an
+    unknown value are ignored.
+
+    :param np.ndarray values: the aggregated values
+    :param np.ndarray weights: point weights or None
+    :return: a (nx, ny, 3) float array of moments (see `moments_stats`)
+    """
+    index, values, weights = _cell_index(x, y, xbins, ybins, values, weights)
+    shape = (len(xbins) - 1, len(ybins) - 1)
+    size = shape[0] * shape[1]
+    if weights is None:
+        weights = np.ones_like(values)
+    weighted = weights * values
+    moments = [np.bincount(index, weights=w, minlength=size)
+               for w in (weights, weighted, weighted * values)]
+    return np.stack(moments, axis=-1).reshape(shape + (3,))
+
+
+def moments_stats(moments):
+    """
+    Return the (count, mean, variance) arrays of aggregate `moments`.
+
+    `moments` is a (..., 3) array of the (weighted) count, sum and sum
+    of squares (as returned by `histogram2d_moments`). Moments are
+    additive, so joined cells are aggregated by summing them. The
+    mean and variance of empty cells are NaN.
+    """
+    count, total, total2 = np.moveaxis(moments, -1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+        # (clipped at 0 against rounding errors)
+        var = np.where(count > 0,
+                       np.maximum(total2 / count - mean ** 2, 0), np.nan)
+    return count, mean, var
+
 
-    xbins = np.linspace(node.xbins[i], node.xbins[i + 1], nbins + 1)
-    ybins = np.linspace(node.ybins[j], node.ybins[j + 1], nbins + 1)
+def grid_bin_sql(data, xvar, yvar, xbins, ybins, zvar=None, weight_var=None):
+    """
+    Bin a `SqlTable` on a `xbins` x `ybins` grid in the database.
 
-    if node.contingencies[i, j].any():
-        t = gridbin_func(xbins, ybins)
-        assert t.contingencies.shape[:2] == (nbins, nbins)
-        children[i, j] = t
-        return node._replace(children=children)
+    Emits a single ``GROUP BY width_bucket(x), width_bucket(y)[, z]``
+    query (see `histogram2d_sql`) so only the non empty cell counts (or
+    aggregates) are transferred.
+
+    :rtype: Tree
+    """
+    zfield = valuefield = weightfield = None
+    if zvar is not None and zvar.is_discrete:
+        zfield = zvar.to_sql()
+    elif zvar is not None:
+        valuefield = zvar.to_sql()
+    if weight_var is not None:
+        weightfield = weight_var.to_sql()
+    fields, filters, group_by = histogram2d_sql(
+        xvar.to_sql(), yvar.to_sql(), xbins, ybins, zfield, valuefield,
+        weightfield)
+    query = data._sql_query(fields, filters=filters, group_by=group_by)
+    with data.backend.execute_sql_query(query) as cur:
+        rows = cur.fetchall()
+    return Tree(xbins, ybins,
+                histogram2d_from_rows(rows, len(xbins) - 1, len(ybins) - 1,
+                                      zvar),
+                None)
+
+
+def _bucket_sql(field, bins):
+    """
+    Return an SQL expression of the (0 based) bin index of `field`.
+
+    Only the inner `bins` edges are used; values below/above them fall
+    in the first/last bin (i.e. the same as `histogram2d`).
+    """
+    points = np.asarray(bins[1:-1], dtype=float)
+    if points.size == 0:
+        return "0"
+    elif points.size >= 2 and np.allclose(
+            np.diff(points), points[1] - points[0], rtol=1e-9, atol=0):
+        # (relative only, so edges of any scale must be evenly spaced)
+        # width_bucket returns 0 below the first and n + 1 at/above the
+        # last edge, which is exactly searchsorted(points, side="right")
+        return "width_bucket({}, {!r}, {!r}, {})".format(
+            field, float(points[0]), float(points[-1]), points.size - 1)
     else:
-        return node
+        cases = " ".join("WHEN {} < {!r} THEN {}".format(field, float(p), i)
+                         for i, p in enumerate(points))
+        return "CASE {} ELSE {} END".format(cases, points.size)
 
 
-def sharpen_node_cell_range(node, xrange, yrange, nbins, gridbin_func):
-    if node.is_leaf:
-        children = np.full((nbins, nbins), None, dtype=object)
+def histogram2d_sql(xfield, yfield, xbins, ybins, zfield=None,
+                    valuefield=None, weightfield=None):
+    """
+    Return the (fields, filters, group_by) of a 2D histogram query.
+
+    The selected fields are the x bin index, y bin index, (optionally)
+    the z value and the count of rows in the cell (the sum of weights if
+    `weightfield` is given). With a `valuefield` the (weighted) count,
+    sum and sum of squares of its values are selected instead.
+
+    :param str xfield: SQL expression of the x column
+    :param str yfield: SQL expression of the y column
+    :param np.ndarray xbins: bin edges on the x axis
+    :param np.ndarray ybins: bin edges on the y axis
+    :param str zfield: SQL expression of the discrete z column or None
+    :param str valuefield: SQL expression of the aggregated continuous
+        column or None
+    :param str weightfield: SQL expression of the instance weights or None
+    :rtype: Tuple[List[str], List[str], List[str]]
+    """
+    group_by = [_bucket_sql(xfield, xbins), _bucket_sql(yfield, ybins)]
+    filters = ["{} IS NOT NULL".format(f) for f in (xfield, yfield)]
+    for field, bins in ((xfield, xbins), (yfield, ybins)):
+        if not np.isinf(bins[0]):
+            filters.append("{} >= {!r}".format(field, float(bins[0])))
+        if not np.isinf(bins[-1]):
+            filters.append("{} <= {!r}".format(field, float(bins[-1])))
+    if zfield is not None:
+        group_by.append(zfield)
+    for field in (zfield, valuefield, weightfield):
+        if field is not None:
+            filters.append("{} IS NOT NULL".format(field))
+
+    if weightfield is not None:
+        count = "SUM({})".format(weightfield)
     else:
-        children = np.array(node.children, dtype=None)
-
-    xs, xe = xrange.start, xrange.stop
-    ys, ye = yrange.start, yrange.stop
-
-    xbins = np.linspace(node.xbins[xs], node.xbins[xe], (xe - xs) * nbins + 1)
-    ybins = np.linspace(node.ybins[ys], node.ybins[ye], (ye - ys) * nbins + 1)
-
-    if node.contingencies[xs: xe, ys: ye].any():
-        t = gridbin_func(xbins, ybins)
-        for i, j in itertools.product(range(xs, xe), range(ys, ye)):
-            children[i, j] = Tree(t.xbins[i * nbins: (i + 1) * nbins + 1],
-                                  t.ybins[j * nbins: (j + 1) * nbins + 1],
-                                  t.contingencies[xs: xe, ys: ye])
-            assert children[i, j].shape[:2] == (nbins, nbins)
-        return node._replace(children=children)
+        count = "COUNT(*)"
+    if valuefield is not None:
+        weighted = "({})".format(valuefield)
+        if weightfield is not None:
+            weighted = "({}) * {}".format(weightfield, weighted)
+        aggregates = [count, "SUM({})".format(weighted),
+                      "SUM({} * ({}))".format(weighted, valuefield)]
     else:
-        return node
+        aggregates = [count]
+    fields = group_by + aggregates
+    return fields, filters, group_by
 
 
-def sharpen_region(node, region, nbins, gridbin_func):
-    if not QRectF(*node.brect).intersects(region):
-        raise ValueError()
-#         return node
-
-    xs, xe, ys, ye = bindices(node, region)
-    ndim = node.contingencies.ndim
+def histogram2d_from_rows(rows, nx, ny, zvar=None):
+    """
+    Return a (nx, ny[, len(zvar.values)]) counts array from the result
+    `rows` of a `histogram2d_sql` query.
 
-    if node.children is not None:
-        children = np.array(node.children, dtype=object)
-        assert children.ndim == 2
+    For a continuous `zvar` the rows hold the aggregates and a (nx, ny, 3)
+    moments array is returned.
+    """
+    rows = list(rows)
+    if zvar is not None and zvar.is_discrete:
+        counts = np.zeros((nx, ny, len(zvar.values)))
+        for i, j, z, count in rows:
+            counts[i, j, int(zvar.to_val(z))] += count
+    elif zvar is not None:
+        counts = np.zeros((nx, ny, 3))
+        if rows:
+            rows = np.array(rows, dtype=float)
+            i, j = rows[:, :2].T.astype(int)
+            np.add.at(counts, (i, j), rows[:, 2:])
     else:
-        children = np.full((nbins, nbins), None, dtype=object)
+        counts = np.zeros((nx, ny))
+        if rows:
+            i, j, count = np.array(rows, dtype=float).T
+            np.add.at(counts, (i.astype(int), j.astype(int)), count)
+    return counts
 
-    if ndim == 3:
-        # compute_chisqares expects classes in 1 dim
-        c = node.contingencies
-        chi_lr, chi_up = compute_chi_squares(
-            c[xs: xe, ys: ye, :].swapaxes(1, 2).swapaxes(0, 1)
-        )
 
-        def max_chisq(i, j):
-            def valid(i, j):
-                return 0 <= i < chi_up.shape[0] and \
-                       0 <= j < chi_lr.shape[1]
+def subdivide_bins(bins, nbins):
+    """
+    Split each of the `bins` into `nbins` equal bins.
+
+    The original bin edges are preserved exactly (unlike with a
+    `np.linspace` over the whole range).
+    """
+    steps = np.linspace(0, 1, nbins + 1)[:-1]
+    fine = bins[:-1, np.newaxis] + np.diff(bins)[:, np.newaxis] * steps
+    return np.r_[fine.ravel(), bins[-1]]
+
+
+def bin_node_cells(node, cells, nbins, gridbin_func):
+    """
+    Bin the non empty `cells` of `node` into new leaf sub nodes.
+
+    All cells are binned with a single `gridbin_func` call over their
+    bounding box (at the resolution of the sub nodes).
+
+    :param Tree node: the node to refine
+    :param cells: a `(rows, cols)` tuple of cell index arrays
+    :param int nbins: number of bins (on each axis) of the sub nodes
+    :param gridbin_func: a `(xbins, ybins) -> Tree` binning function
+    :return: a `(rows, cols, leaves)` tuple of the non empty cells and
+        their sub nodes
+    """
+    rows, cols = map(np.asarray, cells)
+    nonempty = Node_mask(node)[rows, cols]
+    rows, cols = rows[nonempty], cols[nonempty]
+    if not rows.size:
+        return rows, cols, []
+
+    xs, xe = rows.min(), rows.max() + 1
+    ys, ye = cols.min(), cols.max() + 1
+    xbins = subdivide_bins(node.xbins[xs: xe + 1], nbins)
+    ybins = subdivide_bins(node.ybins[ys: ye + 1], nbins)
+    # The grid's outer edges are inclusive; open the upper ones so points
+    # on the border are not counted in two neighbouring nodes
+    t = gridbin_func(np.r_[xbins[:-1], np.nextafter(xbins[-1], -np.inf)],
+                     np.r_[ybins[:-1], np.nextafter(ybins[-1], -np.inf)])
+    blocks = blockshaped(t.contingencies, nbins, nbins)
+    leaves = [Tree(xbins[i * nbins: (i + 1) * nbins + 1],
+                   ybins[j * nbins: (j + 1) * nbins + 1],
+                   blocks[i, j], None)
+              for i, j in zip(rows - xs, cols - ys)]
+    return rows, cols, leaves
+
+
+def sharpen_node_cells(node, cells, nbins, gridbin_func):
+    """
+    Return `node` with all non empty `cells` refined into sub nodes
+    (see `bin_node_cells`).
 
-            return max(chi_lr[i, j] if valid(i, j) else 0,
-                       chi_lr[i, j - 1] if valid(i, j - 1) else 0,
-                       chi_up[i, j] if valid(i, j) else 0,
-                       chi_up[i - 1, j] if valid(i - 1, j) else 0)
+    :param Tree node: the node to refine
+    :rtype: Tree
+    """
+    rows, cols, leaves = bin_node_cells(node, cells, nbins, gridbin_func)
+    if not leaves:
+        return node
 
-        heap = [(-max_chisq(i - xs, j - ys), (i, j))
-                for i in range(xs, xe)
-                for j in range(ys, ye)
-                if children[i, j] is None]
+    if node.is_leaf:
+        children = np.full(node.contingencies.shape[:2], None, dtype=object)
     else:
-        heap = list(enumerate((i, j)
-                    for i in range(xs, xe)
-                    for j in range(ys, ye)
-                    if children[i, j] is None))
-
-    heap = sorted(heap)
-    update_node = node
-    while heap:
-        _, (i, j) = heapq.heappop(heap)
-
-        xbins = np.linspace(node.xbins[i], node.xbins[i + 1], nbins + 1)
-        ybins = np.linspace(node.ybins[j], node.ybins[j + 1], nbins + 1)
-
-        if node.contingencies[i, j].any():
-            t = gridbin_func(xbins, ybins)
-            assert t.contingencies.shape[:2] == (nbins, nbins)
-        else:
-            t = None
+        children = np.array(node.children, dtype=object)
+    for i, j, leaf in zip(rows, cols, leaves):
+        children[i, j] = leaf
+    return node._replace(children=children)
 
-        children[i, j] = t
-        if t is None:
-            yield update_node
-        else:
-            update_node = update_node._replace(
-                children=np.array(children, dtype=object)
-            )
-            yield update_node
+
+def tree_rebin(root, gridbin_func, check=None):
+    """
+    Return `root` with the counts of all nodes recomputed by
+    `gridbin_func` (on the same bins).
+
+    The structure of the tree is kept, except for sub nodes of cells that
+    are now empty, which are dropped. `check` (if not None) is called
+    before binning each node (and can raise to abort).
+
+    :param FlatTree root: the root
+    :param gridbin_func: a `(xbins, ybins) -> Tree` binning function
+    :rtype: FlatTree
+    """
+    def half_open(bins):
+        # Sub nodes are binned on half open intervals (see
+        # `bin_node_cells`)
+        return np.r_[bins[:-1], np.nextafter(bins[-1], -np.inf)]
+
+    def open_ends(bins):
+        # The root's outer bins extend to infinity (as in `get_root`)
+        return np.r_[-np.inf, bins[1:-1], np.inf]
+
+    xbins, ybins, contingencies, children = [], [], [], []
+    # The nodes of the level which are kept
+    keep = np.ones(1, dtype=bool)
+    for level in range(root.depth()):
+        edges = open_ends if level == 0 else half_open
+        xbins.append(root.xbins[level][keep])
+        ybins.append(root.ybins[level][keep])
+        ctng = []
+        for x, y in zip(xbins[level], ybins[level]):
+            if check is not None:
+                check()
+            ctng.append(gridbin_func(edges(x), edges(y)).contingencies)
+        ctng = np.array(ctng)
+        contingencies.append(ctng)
+
+        index = root.children[level][keep]
+        nonempty = ctng.any(axis=3) if ctng.ndim == 4 else ctng > 0
+        index = np.where(nonempty, index, -1)
+        if level + 1 < root.depth():
+            # Renumber the remaining sub nodes
+            keep = np.zeros(len(root.contingencies[level + 1]), dtype=bool)
+            keep[index[index >= 0]] = True
+            renumber = np.cumsum(keep) - 1
+            index = np.where(index >= 0, renumber[index], -1)
+        children.append(index)
+        if not np.any(index >= 0):
+            break
+    return FlatTree(xbins, ybins, contingencies, children)
 
 
 def Node_mask(node):
@@ -1189,47 +2131,106 @@ def Node_nonzero(node):
     return np.nonzero(Node_mask(node))
 
 
-def sharpen_region_recur(node, region, nbins, depth, gridbin_func):
-    if depth <= 1:
-        return node
-    elif not QRectF(*node.brect).intersects(region):
-        return node
-    elif node.is_empty:
+def Node_children_mask(node):
+    """Return a boolean mask of the node's cells with a sub node."""
+    if node.is_leaf:
+        return np.zeros(node.contingencies.shape[:2], dtype=bool)
+    return np.array([ch is not None for ch in node.children.flat],
+                    dtype=bool).reshape(node.children.shape)
+
+
+def image_from_colors(colors, mask):
+    """
+    Return a QImage from a (N, M, 3) `colors` array (as returned by
+    `create_image`) with cells outside of `mask` transparent.
+
+    The image is transposed so that `colors[i, j]` is the pixel in
+    the i-th column and j-th row (i.e. it maps to the cell's bin rect).
+    """
+    N, M = colors.shape[:2]
+    rgba = np.empty((M, N, 4), dtype=np.uint8)
+    rgba[..., :3] = np.clip(colors, 0, 255).swapaxes(0, 1)
+    rgba[..., 3] = np.where(mask.T, 255, 0)
+    image = QImage(rgba.data, N, M, N * 4, QImage.Format_RGBA8888)
+    # QImage does not own the buffer
+    return image.copy()
+
+
+def pyramid_expand(node, nbins, depth, gridbin_func, callback=None):
+    """
+    Return `node` with all non empty cells refined down to `depth` levels.
+
+    The result is a complete quadtree pyramid of contingencies; zooming
+    into any part of it does not require any further binning.
+
+    :param Tree node: the root node
+    :param int nbins: number of bins (on each axis) of sub nodes
+    :param int depth: depth of the resulting tree
+    :param gridbin_func: a `(xbins, ybins) -> Tree` binning function
+    :param callback: a `(i, n) -> None` progress callback, called after
+        each top level cell is (recursively) refined
+    :rtype: Tree
+    """
+    if depth <= 1 or node.is_empty:
         return node
-    elif node.is_leaf:
-        xs, xe, ys, ye = bindices(node, region)
-        # indices in need of update
-        indices = Node_nonzero(node)
-        for i, j in zip(*indices):
-            if xs <= i < xe and ys <= j < ye:
-                node = sharpen_node_cell(node, i, j, nbins, gridbin_func)
-
-        # if the exposed region is empty the node.is_leaf property
-        # is preserved
-        if node.is_leaf:
-            return node
-
-        return sharpen_region_recur(node, region, nbins, depth, gridbin_func)
-    else:
-        xs, xe, ys, ye = bindices(node, region)
 
-        # indices is need of update
-        indices1 = Node_nonzero(node)
-        indices2 = node.children.nonzero()
-        indices = sorted(set(list(zip(*indices1))) - set(list(zip(*indices2))))
+    node = sharpen_node_cells(node, Node_nonzero(node), nbins, gridbin_func)
+    children = np.array(node.children, dtype=object)
+    indices = list(zip(*Node_nonzero(node)))
+    for k, (i, j) in enumerate(indices):
+        if children[i, j] is not None:
+            children[i, j] = pyramid_expand(children[i, j], nbins, depth - 1,
+                                            gridbin_func)
+        if callback is not None:
+            callback(k + 1, len(indices))
+    return node._replace(children=children)
 
-        for i, j in indices:
-            if xs <= i < xe and ys <= j < ye:
-                node = sharpen_node_cell(node, i, j, nbins, gridbin_func)
 
-        children = np.array(node.children, dtype=object)
-        children[xs: xe, ys: ye] = [
-            [sharpen_region_recur(ch, region, nbins, depth - 1, gridbin_func)
-             if ch is not None else None
-             for ch in row]
-            for row in np.array(children[xs: xe, ys: ye])
-        ]
-        return node._replace(children=children)
+def _pyramid_path(data, xvar, yvar, zvar, nbins, depth):
+    """
+    Return the on-disk cache path of a precomputed pyramid or None if
+    `data` can not be identified (e.g. for a `SqlTable`).
+    """
+    checksum = data.checksum()
+    if isinstance(checksum, float) and np.isnan(checksum):
+        return None
+    key = repr((checksum, len(data), xvar.name, yvar.name,
+                zvar.name if zvar is not None else None, nbins, depth))
+    filename = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle"
+    return os.path.join(cache_dir(), "scattermap", filename)
+
+
+def pyramid_load(data, xvar, yvar, zvar, nbins, depth):
+    """Return a stored precomputed pyramid (`FlatTree`) for `data` or None."""
+    path = _pyramid_path(data, xvar, yvar, zvar, nbins, depth)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            tree = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        log.warning("Could not load the cached pyramid %s", path)
+        return None
+    if not isinstance(tree, FlatTree):
+        # (stored by an older version)
+        return None
+    return tree
+
+
+def pyramid_store(tree, data, xvar, yvar, zvar, nbins, depth):
+    """Store a precomputed pyramid for `data` in the on-disk cache."""
+    path = _pyramid_path(data, xvar, yvar, zvar, nbins, depth)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so no partial pickle is left
+        # behind if interrupted
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        log.warning("Could not store the pyramid to %s", path)
 
 
 def stack_tile_blocks(blocks):
@@ -1251,10 +2252,14 @@ def bindices(node, rect):
                     node.ybins.size - 2, node.ybins.size - 1])
 
 
-def create_image(contingencies, palette=None, scale=None):
+def create_image(contingencies, palette=None, scale=None, value_range=None):
 #     import scipy.signal
 #     import scipy.ndimage
 
+    if value_range is not None:
+        return create_image_aggregate(contingencies, palette, scale,
+                                      value_range)
+
     if scale is None:
         scale = lambda c: c / (contingencies.max() or 1)
 
@@ -1310,41 +2315,106 @@ def create_image(contingencies, palette=None, scale=None):
     return colors.astype(int)
 
 
-def score_candidate_rects(node, region):
+#: Default (low, high) colors of aggregate means
+MeanPalette = (QColor(43, 131, 186), QColor(215, 25, 28))
+
+
+def create_image_aggregate(moments, palette=None, scale=None,
+                           value_range=(0, 1)):
+    """
+    Return the (N, M, 3) cell colors of (N, M, 3) aggregate `moments`.
+
+    The hue interpolates between the two `palette` colors by the cell's
+    mean (within `value_range`) and the intensity is the (scaled) count.
+    """
+    count, mean, _ = moments_stats(moments)
+    if scale is None:
+        scale = lambda c: c / (count.max() or 1)
+    if palette is None:
+        palette = MeanPalette
+    low, high = (np.array([c.red(), c.green(), c.blue()], dtype=float)
+                 for c in palette[:2])
+
+    vmin, vmax = value_range
+    t = np.nan_to_num((mean - vmin) / ((vmax - vmin) or 1))
+    base = low + (high - low) * np.clip(t, 0, 1)[..., np.newaxis]
+
+    P = scale(count)
+    P = np.where(P > 0, P * 0.95 + 0.05, 0.0)[..., np.newaxis]
+    colors = 255 - (255 - base) * P
+    return colors.astype(int)
+
+
+def moments_scores(moments):
     """
-    Score candidate bin rects in node.
+    Return the (N, M) sums of squared deviations from the cell means of
+    (N, M, 3) aggregate `moments` (the error of representing each cell by
+    its mean).
+    """
+    count, _, var = moments_stats(moments)
+    return np.nan_to_num(count * var)
 
-    Return a list of (score, i, j QRectF) list)
 
+def chi_square_scores(contingencies):
     """
-    xs, xe, ys, ye = bindices(node, region)
+    Return the (N, M) array of chi2 scores of (N, M, k) `contingencies`.
 
-    if node.contingencies.ndim == 3:
-        c = node.contingencies
-        # compute_chisqares expects classes in 1 dim
-        chi_lr, chi_up = compute_chi_squares(
-            c[xs: xe, ys: ye, :].swapaxes(1, 2).swapaxes(0, 1)
-        )
+    The score of a cell is the maximal chi2 (see `compute_chi_squares`)
+    of the cell and any of its horizontal or vertical neighbours.
+    """
+    # compute_chi_squares expects classes in 1 dim
+    chi_lr, chi_up = compute_chi_squares(
+        contingencies.swapaxes(1, 2).swapaxes(0, 1))
+    scores = np.zeros(contingencies.shape[:2])
+    scores[:, :-1] = np.maximum(scores[:, :-1], chi_lr)
+    scores[:, 1:] = np.maximum(scores[:, 1:], chi_lr)
+    scores[:-1] = np.maximum(scores[:-1], chi_up)
+    scores[1:] = np.maximum(scores[1:], chi_up)
+    return scores
+
+
+def candidate_cells(node, region, score_func=None, expanded=None):
+    """
+    Return the cells of `node` in `region` that are candidates for
+    refinement, i.e. are non empty and do not have a sub node.
+
+    The cells are scored by `score_func` (an (N, M, ...) contingencies to
+    (N, M) scores function). By default nodes with class contingencies
+    are scored by `chi_square_scores` and other cells all have the
+    score 1.
 
-        def max_chisq(i, j):
-            def valid(i, j):
-                return 0 <= i < chi_up.shape[0] and \
-                       0 <= j < chi_lr.shape[1]
+    :param expanded: a (N, M) mask of the cells with a sub node
+        (by default those of `node.children`)
+    :return: a `(rows, cols, scores)` tuple of arrays
+    """
+    if expanded is None:
+        expanded = Node_children_mask(node)
+    xs, xe, ys, ye = bindices(node, region)
+    mask = np.zeros(node.contingencies.shape[:2], dtype=bool)
+    mask[xs: xe, ys: ye] = True
+    mask &= Node_mask(node) & ~expanded
+
+    if score_func is None and node.contingencies.ndim == 3:
+        score_func = chi_square_scores
+    scores = np.ones(mask.shape)
+    if score_func is not None:
+        scores[xs: xe, ys: ye] = score_func(
+            node.contingencies[xs: xe, ys: ye])
+    rows, cols = np.nonzero(mask)
+    return rows, cols, scores[rows, cols]
 
-            return max(chi_lr[i, j] if valid(i, j) else 0,
-                       chi_lr[i, j - 1] if valid(i, j - 1) else 0,
-                       chi_up[i, j] if valid(i, j) else 0,
-                       chi_up[i - 1, j] if valid(i - 1, j) else 0)
 
-        return [(max_chisq(i - xs, j - ys), i, j,
-                 QRectF(QPointF(node.xbins[i], node.ybins[j]),
-                        QPointF(node.xbins[i + 1], node.ybins[j + 1])))
-                 for i, j in itertools.product(range(xs, xe), range(ys, ye))]
+def top_k(scores, k=None):
+    """
+    Return the indices of the `k` highest `scores` in descending order
+    (all if `k` is None).
+    """
+    scores = np.asarray(scores)
+    if k is not None and k < scores.size:
+        indices = np.argpartition(-scores, k - 1)[:k]
     else:
-        return [(1, i, j,
-                 QRectF(QPointF(node.xbins[i], node.ybins[j]),
-                        QPointF(node.xbins[i + 1], node.ybins[j + 1])))
-                 for i, j in itertools.product(range(xs, xe), range(ys, ye))]
+        indices = np.arange(scores.size)
+    return indices[np.argsort(-scores[indices], kind="mergesort")]
 
 
 def compute_chi_squares(observes):
@@ -1,18 +1,32 @@
+import concurrent.futures
+import os
+import tempfile
+import threading
+import unittest
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps, partial
 from itertools import chain
 from typing import Callable, List
+from unittest.mock import patch
 
 import numpy as np
+from scipy.sparse import csr_matrix
 from AnyQt.QtCore import QItemSelection, QItemSelectionRange, \
-    QItemSelectionModel, Qt
+    QItemSelectionModel, Qt, QRect
+from AnyQt.QtGui import QImage, QPainter
+from AnyQt.QtWidgets import QStyleOptionViewItem
 
 from Orange.data import Table, Domain, StringVariable, ContinuousVariable, \
     DiscreteVariable, TimeVariable
 from Orange.widgets.tests.base import WidgetTest
 from Orange.widgets.tests.utils import simulate
 from orangecontrib.prototypes.widgets.owfeaturestatistics import \
-    OWFeatureStatistics
+    OWFeatureStatistics, FeatureStatisticsTableModel, _next_block
+from orangecontrib.prototypes.widgets.utils import blocks
+from orangecontrib.prototypes.widgets.utils.blocks import ColumnBlocks
+from orangecontrib.prototypes.widgets.utils.histogram import Histogram, \
+    Histograms, histogram_bins, compute_histograms
 
 VarDataPair = namedtuple('VarDataPair', ['variable', 'data'])
 
@@ -197,6 +211,9 @@ class TestOWFeatureStatisticsTableTypes(WidgetTest):
         simulate.combobox_run_through_all(
             self.widget.cb_color_var, callback=self.force_render_table)
 
+    def wait_for_statistics(self):
+        self.process_events(until=lambda: self.widget._task is None)
+
     @table_dense_sparse
     def test_runs_on_iris(self, prepare_table):
         self.send_signal('Data', prepare_table(Table('iris')))
@@ -243,6 +260,297 @@ class TestOWFeatureStatisticsTableTypes(WidgetTest):
         self.send_signal('Data', prepare_table(data))
         self.run_through_variables()
 
+    def test_statistics(self):
+        data = make_table(
+            [continuous_missing, rgb_missing, time_missing], [rgb_all_missing],
+            [string_missing])
+        self.send_signal('Data', data)
+        # the median and IQR are computed after the other statistics
+        self.assertTrue(np.isnan(
+            self.widget.model.get_statistics_matrix()[:, 5:]).all())
+        self.wait_for_statistics()
+        nan = np.nan
+        np.testing.assert_almost_equal(
+            self.widget.model.get_statistics_matrix(),
+            # center, dispersion, min, max, missing, median, iqr
+            [[1.75, np.sqrt(2.1875) / 1.75, 0, 4, 1, 1.5, 1.75],
+             [1, 1.0397208, 0, 2, 1, nan, nan],
+             [2.25, nan, 0, 4, 1, 2.5, 1.75],
+             [nan, 0, nan, nan, 5, nan, nan]])
+
+    def test_sparse_statistics(self):
+        data = make_table(
+            [continuous_full, continuous_missing, continuous_all_missing,
+             continuous_same, rgb_full, rgb_missing, rgb_all_missing,
+             rgb_same, time_missing], [ints_missing])
+        expected = FeatureStatisticsTableModel.compute_statistics(data)
+        sparse = data.to_sparse()
+        # explicitly stored zeros are counted with the implicit ones
+        x = sparse.X.tocoo()
+        sparse.X = csr_matrix(
+            (np.append(x.data, 0), (np.append(x.row, 0), np.append(x.col, 0))),
+            shape=x.shape)
+        self.assertEqual(sparse.X.nnz, data.to_sparse().X.nnz + 1)
+        np.testing.assert_almost_equal(
+            FeatureStatisticsTableModel.compute_statistics(sparse), expected)
+
+    def test_compute_statistics_blocks(self):
+        data = make_table(
+            [continuous_full, continuous_missing, rgb_full, time_full,
+             ints_missing], [rgb_missing], [continuous_same])
+        model = FeatureStatisticsTableModel
+        expected = model.compute_statistics(data)
+        with patch.object(model, 'COLUMN_BLOCK_SIZE', 2), \
+                ThreadPoolExecutor(max_workers=2) as executor:
+            progress = []
+            actual = model.compute_statistics(
+                data, executor, lambda i, n: progress.append((i, n)))
+        np.testing.assert_equal(actual, expected)
+        # three blocks of attributes, class var and meta
+        self.assertEqual(progress[-1], (5, 5))
+
+    def test_background_statistics(self):
+        data = make_table([continuous_missing, rgb_missing, time_missing])
+        self.send_signal('Data', data)
+        self.wait_for_statistics()
+        expected = self.widget.model.get_statistics_matrix()
+        self.send_signal('Data', None)
+
+        self.widget.ASYNC_MIN_SIZE = 0
+        self.send_signal('Data', Table('iris'))
+        self.assertIsNotNone(self.widget._task)
+        # new data cancels the pending computation
+        self.send_signal('Data', data)
+        self.assertEqual(self.widget.model.rowCount(), 0)
+        self.process_events(until=lambda: self.widget._task is None)
+        np.testing.assert_equal(
+            self.widget.model.get_statistics_matrix(), expected)
+        self.run_through_variables()
+
+    def test_lazy_statistics(self):
+        data = make_table(
+            [continuous_same, continuous_full, rgb_missing, time_missing])
+        self.send_signal('Data', data)
+        self.wait_for_statistics()
+        expected = self.widget.model.get_statistics_matrix()
+        self.send_signal('Data', None)
+
+        self.widget.LAZY_MIN_VARIABLES = 0
+        # hold the computation until the table is sorted
+        started = threading.Event()
+        compute = FeatureStatisticsTableModel.compute_statistics
+
+        def compute_statistics(*args, **kwargs):
+            started.wait(5)
+            return compute(*args, **kwargs)
+
+        with patch.object(FeatureStatisticsTableModel, 'compute_statistics',
+                          compute_statistics):
+            self.send_signal('Data', data)
+            # the variables are shown before their statistics are known
+            self.assertEqual(self.widget.model.rowCount(), 4)
+            self.assertTrue(np.isnan(
+                self.widget.model.get_statistics_matrix()).all())
+            max_column = FeatureStatisticsTableModel.Columns.MAX
+            self.widget.table_view.sortByColumn(max_column, Qt.AscendingOrder)
+            self.widget.on_header_click()
+            self.assertEqual(self.widget._task.statistics, (3,))
+            started.set()
+            self.process_events(until=lambda: self.widget._task is None)
+        np.testing.assert_equal(
+            self.widget.model.get_statistics_matrix(), expected)
+        # sorted again once the statistics of the sort column are known
+        model = FeatureStatisticsTableModel(data)
+        model.sort(max_column, Qt.AscendingOrder)
+        np.testing.assert_equal(self.widget.model._sortColumnData(max_column),
+                                model._sortColumnData(max_column))
+
+    def test_stale_task_done(self):
+        self.widget.LAZY_MIN_VARIABLES = 0
+        self.send_signal('Data', Table('iris'))
+        task = self.widget._task
+        stale = concurrent.futures.Future()
+        stale.set_exception(MemoryError())
+        # a late signal of a replaced task does not finish the current one
+        for slot in (self.widget.on_lazy_statistics_done,
+                     self.widget.on_statistics_done):
+            slot(stale)
+            self.assertIs(self.widget._task, task)
+        self.assertFalse(self.widget.Error.statistics_error.is_shown())
+        self.wait_for_statistics()
+
+    def test_lazy_statistics_error(self):
+        self.widget.LAZY_MIN_VARIABLES = 0
+        with patch.object(FeatureStatisticsTableModel, 'compute_statistics',
+                          side_effect=MemoryError):
+            self.send_signal('Data', Table('iris'))
+            self.process_events(until=lambda: self.widget._task is None)
+        self.assertTrue(self.widget.Error.statistics_error.is_shown())
+
+        # cleared with the new data
+        self.send_signal('Data', Table('iris'))
+        self.process_events(until=lambda: self.widget._task is None)
+        self.assertFalse(self.widget.Error.statistics_error.is_shown())
+        self.assertFalse(np.isnan(
+            self.widget.model.get_statistics_matrix()).all())
+
+    def test_appended_rows(self):
+        data = Table('iris')
+        self.send_signal('Data', data[:100])
+        self.wait_for_statistics()
+        self.widget.table_view.selectRow(2)
+        selected = self.widget.selected_rows
+        model = FeatureStatisticsTableModel
+        with patch.object(model, 'compute_summary',
+                          wraps=model.compute_summary) as compute_summary:
+            self.send_signal('Data', Table.concatenate([data[:100],
+                                                        data[100:]]))
+        # only the new rows are summarized
+        self.assertEqual(len(compute_summary.call_args[0][0]), 50)
+        self.wait_for_statistics()
+        actual = self.widget.model.get_statistics_matrix()
+        self.send_signal('Data', data)
+        self.wait_for_statistics()
+        expected = self.widget.model.get_statistics_matrix()
+        np.testing.assert_almost_equal(actual, expected)
+        self.assertEqual(self.widget.selected_rows, selected)
+
+    def test_next_block(self):
+        todo = np.ones((5, 10), dtype=bool)
+        # the visible variables first ...
+        rows, indices = _next_block(todo, np.array([7, 3]), (3,), 4)
+        self.assertEqual(rows, [0, 1, 2, 3, 4])
+        np.testing.assert_equal(indices, [3, 7])
+        todo[:, [3, 7]] = False
+        # ... then the sort statistics ...
+        rows, indices = _next_block(todo, np.array([7, 3]), (3,), 4)
+        self.assertEqual(rows, [3])
+        np.testing.assert_equal(indices, [0, 1, 2, 4, 5, 6, 8, 9])
+        todo[3] = False
+        # ... and the rest (of the statistics still to compute)
+        rows, indices = _next_block(todo, np.array([7, 3]), (3,), 4)
+        self.assertEqual(rows, [0, 1, 2, 4])
+        np.testing.assert_equal(indices, [0, 1, 2, 4])
+
+        todo = np.zeros((5, 10), dtype=bool)
+        todo[3:, [2, 5]] = True
+        rows, indices = _next_block(todo, np.array([5, 7]), (), 4)
+        self.assertEqual(rows, [3, 4])
+        np.testing.assert_equal(indices, [5])
+
+    def test_sorting(self):
+        data = make_table([continuous_same, rgb_missing, continuous_full,
+                           continuous_all_missing, rgb_full,
+                           continuous_missing])
+        model = FeatureStatisticsTableModel(data)
+        max_column = FeatureStatisticsTableModel.Columns.MAX
+        # discrete variables by name, NaNs last and ties in the current order
+        model.sort(max_column, Qt.AscendingOrder)
+        np.testing.assert_equal(model.mapToSourceRows(Ellipsis),
+                                [4, 1, 0, 2, 5, 3])
+        model.sort(max_column, Qt.DescendingOrder)
+        np.testing.assert_equal(model.mapToSourceRows(Ellipsis),
+                                [1, 4, 2, 5, 0, 3])
+
+        # the sort keys are computed once ...
+        with patch.object(model, '_FeatureStatisticsTableModel'
+                                 '__column_sort_keys') as sort_keys:
+            model.sort(max_column, Qt.AscendingOrder)
+            model.sort(max_column, Qt.DescendingOrder)
+            sort_keys.assert_not_called()
+        # ... until the statistics change
+        values = np.full((len(model.STATISTICS), 1), 5.)
+        model.set_statistics([3], [0], values)
+        model.sort(max_column, Qt.DescendingOrder)
+        np.testing.assert_equal(model.mapToSourceRows(Ellipsis),
+                                [1, 4, 0, 2, 5, 3])
+
+    def test_memmap(self):
+        data = make_table(
+            [continuous_full, continuous_missing, continuous_all_missing,
+             rgb_full, rgb_missing, rgb_all_missing, ints_full, time_full],
+            [rgb_bins_missing])
+        self.send_signal('Data', data)
+        self.wait_for_statistics()
+        expected = self.widget.model.get_statistics_matrix()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            X = np.memmap(os.path.join(tmp, 'X'), dtype=float, mode='w+',
+                          shape=data.X.shape)
+            X[:] = data.X
+            mapped = Table.from_numpy(data.domain, X, data.Y)
+            # Use small blocks so the statistics are merged over many
+            with patch.object(ColumnBlocks.__init__, '__defaults__',
+                              (None, 16)):
+                self.send_signal('Data', mapped)
+                self.wait_for_statistics()
+            actual = self.widget.model.get_statistics_matrix()
+            np.testing.assert_almost_equal(actual[:, :5], expected[:, :5])
+            # (the quantiles are approximated by merging the sketches of
+            # single rows)
+            np.testing.assert_equal(np.isnan(actual[:, 5:]),
+                                    np.isnan(expected[:, 5:]))
+            self.run_through_variables()
+            self.send_signal('Data', None)
+            del mapped, X
+
+    def test_memmap_cancel(self):
+        data = make_table([continuous_full, continuous_missing, rgb_full])
+        with tempfile.TemporaryDirectory() as tmp:
+            X = np.memmap(os.path.join(tmp, 'X'), dtype=float, mode='w+',
+                          shape=data.X.shape)
+            X[:] = data.X
+            mapped = Table.from_numpy(data.domain, X, data.Y)
+            # Single rows are read as separate blocks
+            with patch.object(ColumnBlocks.__init__, '__defaults__',
+                              (None, 16)):
+                matrices = FeatureStatisticsTableModel.statistics_matrices(
+                    mapped)
+            summary = FeatureStatisticsTableModel.compute_summary(matrices)
+            np.testing.assert_equal(summary[1].count, [5, 4, 5])
+
+            calls = []
+
+            def callback(i, n):
+                calls.append((i, n))
+                if i == 2:
+                    raise concurrent.futures.CancelledError()
+
+            with self.assertRaises(concurrent.futures.CancelledError):
+                FeatureStatisticsTableModel.compute_summary(
+                    matrices, callback=callback)
+            # the computation is interrupted between the blocks of rows
+            self.assertEqual(calls, [(0, 5), (1, 5), (2, 5)])
+            with self.assertRaises(concurrent.futures.CancelledError):
+                FeatureStatisticsTableModel.compute_statistics(
+                    matrices, callback=callback, statistics=[0])
+            del matrices, mapped, X
+
+    def test_cancel_does_not_wait(self):
+        started, release = threading.Event(), threading.Event()
+        summarize = blocks.summarize
+
+        def slow_summarize(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return summarize(*args, **kwargs)
+
+        self.widget.ASYNC_MIN_SIZE = 0
+        with patch.object(blocks, 'summarize', slow_summarize):
+            self.send_signal('Data', Table('iris'))
+            self.assertTrue(started.wait(5))
+            stale = self.widget._task.future
+            # new data does not wait for the running computation ...
+            self.send_signal('Data', Table('zoo'))
+            self.assertFalse(stale.done())
+            release.set()
+            self.process_events(until=lambda: self.widget._task is None)
+        # ... whose result is dropped
+        concurrent.futures.wait([stale], 5)
+        self.process_events()
+        self.assertEqual(self.widget.model.rowCount(),
+                         len(Table('zoo').domain.variables))
+
 
 def select_rows(rows: List[int], widget: OWFeatureStatistics):
     """Since the widget sorts the rows, selecting rows isn't trivial."""
@@ -345,6 +653,31 @@ class TestFeatureStatisticsOutputs(WidgetTest):
         self.assertIsNone(self.get_output(self.widget.Outputs.reduced_data))
         self.assertIsNone(self.get_output(self.widget.Outputs.statistics))
 
+    def test_sends_statistics_to_output(self):
+        self.select_rows([0, 2, 4])
+        self.widget.unconditional_commit()
+
+        output = self.get_output(self.widget.Outputs.statistics)
+        model = self.widget.model
+        np.testing.assert_equal(output.X,
+                                model.get_statistics_matrix()[[0, 2, 4]])
+        self.assertEqual(
+            [attr.name for attr in output.domain.attributes],
+            ['Center', 'Dispersion', 'Min.', 'Max.', 'Missing', 'Median',
+             'IQR'])
+        self.assertEqual(
+            [(str(row['Feature']), str(row['Type'])) for row in output],
+            [('continuous_full', 'numeric'), ('rgb_full', 'categorical'),
+             ('ints_full', 'categorical')])
+
+        # the table of all the statistics is kept until the data changes
+        table = model.get_statistics_table()
+        self.assertEqual(len(table), 6)
+        self.widget.unconditional_commit()
+        self.assertIs(model.get_statistics_table(), table)
+        self.send_signal('Data', self.data)
+        self.assertIsNot(model.get_statistics_table(), table)
+
 
 class TestFeatureStatisticsUI(WidgetTest):
     def setUp(self):
@@ -371,3 +704,237 @@ class TestFeatureStatisticsUI(WidgetTest):
         self.send_signal(self.widget.Inputs.data, self.data1)
         self.assertEqual(len(self.widget.selected_rows), 2)
 
+
+
+class TestSummaries(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.x = rs.standard_normal((500, 4)) * [1, 10, 100, 1000] + 1e6
+        self.x[:, 0] = rs.randint(3, size=500)
+        self.x[rs.rand(*self.x.shape) < 0.1] = np.nan
+        self.x[:, 3] = np.nan
+
+    def test_merge(self):
+        expected = blocks.summarize(self.x, discrete=[0], sketch=True)
+        merged = blocks.summarize(self.x[:7], discrete=[0], sketch=True)
+        for start in range(7, 500, 61):
+            merged = blocks.merge_summaries(merged, blocks.summarize(
+                self.x[start:start + 61], discrete=[0], sketch=True))
+        for field in expected._fields[:7]:
+            np.testing.assert_allclose(getattr(merged, field),
+                                       getattr(expected, field))
+        quartiles = blocks.sketch_quantiles(merged.sketch, [0.25, 0.5, 0.75])
+        np.testing.assert_allclose(
+            quartiles[:, 1:3],
+            np.nanquantile(self.x[:, 1:3], [0.25, 0.5, 0.75], axis=0),
+            atol=2)
+        self.assertTrue(np.isnan(quartiles[:, 3]).all())
+
+    def test_block_sketch(self):
+        # the points of a single block's sketch are the quantiles of all of
+        # its values at the sketch levels
+        rs = np.random.RandomState(1)
+        x = rs.standard_normal((5000, 3)) ** 3
+        x[rs.rand(*x.shape) < 0.3 * np.arange(3)] = np.nan
+        sketch = blocks.summarize(x, sketch=True).sketch
+        np.testing.assert_equal(sketch.count, (~np.isnan(x)).sum(axis=0))
+        levels = (np.arange(blocks.SKETCH_SIZE) + 0.5) / blocks.SKETCH_SIZE
+        np.testing.assert_allclose(sketch.points,
+                                   np.nanquantile(x, levels, axis=0).T)
+
+    def test_median_and_iqr_from_one_sketch(self):
+        data = make_table([continuous_full, continuous_missing, time_full])
+        sketches = []
+
+        def quantile_sketch(x):
+            sketches.append(x.shape[1])
+            return sketch_func(x)
+
+        sketch_func = blocks.quantile_sketch
+        with patch.object(blocks, "quantile_sketch", quantile_sketch):
+            stats = FeatureStatisticsTableModel.compute_statistics(
+                data, statistics=[5, 6])
+        self.assertEqual(sketches, [3])
+        x = data.X
+        q1, median, q3 = np.nanquantile(x, [0.25, 0.5, 0.75], axis=0)
+        np.testing.assert_allclose(stats[5], median)
+        np.testing.assert_allclose(stats[6], q3 - q1)
+        self.assertTrue(np.isnan(stats[:5]).all())
+
+    def test_sparse_sketch(self):
+        x = np.nan_to_num(self.x[:, 1:3] - 1e6)
+        x[np.abs(x) < 50] = 0
+        sketch = blocks.summarize(csr_matrix(x), sketch=True).sketch
+        np.testing.assert_allclose(
+            blocks.sketch_quantiles(sketch, [0.1, 0.5, 0.9]),
+            blocks.sketch_quantiles(blocks.summarize(x, sketch=True).sketch,
+                                    [0.1, 0.5, 0.9]))
+
+    def test_append_data(self):
+        data = make_table(
+            [continuous_full, continuous_missing, rgb_missing, time_missing],
+            [ints_missing])
+        appended = Table.concatenate([data, data[::-1], data[:2]])
+        model = FeatureStatisticsTableModel(data)
+        self.assertTrue(model.extends(appended))
+        self.assertFalse(model.extends(data[1:]))
+        self.assertFalse(model.extends(Table.concatenate([data[::-1], data])))
+        model.append_data(appended)
+        expected = FeatureStatisticsTableModel(appended).get_statistics_matrix()
+        actual = model.get_statistics_matrix()
+        np.testing.assert_almost_equal(actual, expected)
+
+    def test_deferred_quantiles(self):
+        data = make_table([continuous_missing, rgb_missing, time_missing])
+        model = FeatureStatisticsTableModel(data)
+        # the summary does not sketch the quantiles ...
+        self.assertIsNone(model._summary.sketch)
+        self.assertTrue(np.isnan(model.get_statistics_matrix()[:, 5:]).all())
+        # ... so the median and IQR of the numeric variables are not known
+        self.assertFalse(model.is_computed())
+        np.testing.assert_equal(model._computed[5:], [[0, 1, 0], [0, 1, 0]])
+        model.set_statistics([5, 6], np.array([0, 2]),
+                             FeatureStatisticsTableModel.compute_statistics(
+                                 data, indices=[0, 2], statistics=[5, 6]))
+        self.assertTrue(model.is_computed())
+        np.testing.assert_almost_equal(model.get_statistics_matrix()[:, 5:],
+                                       [[1.5, 1.75], [np.nan, np.nan], [2.5, 1.75]])
+
+    def test_sketch_columns(self):
+        summary = blocks.summarize(self.x, discrete=[0], sketch=True,
+                                   sketch_columns=[1, 2])
+        expected = blocks.summarize(self.x[:, 1:3], sketch=True).sketch
+        np.testing.assert_equal(summary.sketch.count,
+                                np.hstack(([0], expected.count, [0])))
+        np.testing.assert_allclose(summary.sketch.points[1:3],
+                                   expected.points)
+        self.assertTrue(np.isnan(summary.sketch.points[[0, 3]]).all())
+        sparse = blocks.summarize(csr_matrix(np.nan_to_num(self.x)),
+                                  sketch=True, sketch_columns=[1, 2])
+        np.testing.assert_equal(sparse.sketch.count[[0, 3]], 0)
+        self.assertTrue(np.isnan(sparse.sketch.points[[0, 3]]).all())
+        self.assertFalse(np.isnan(sparse.sketch.points[1:3]).any())
+
+
+class TestHistograms(WidgetTest):
+    def assert_same_histograms(self, data, color_attribute=None):
+        variables = data.domain.attributes
+        bins = histogram_bins(data.X, variables)
+        y = None
+        if color_attribute is not None:
+            y = data.get_column_view(color_attribute)[0].astype(float)
+        histograms = compute_histograms(
+            ColumnBlocks(data.X, block_bytes=64), bins, y,
+            color_attribute and data.domain[color_attribute])
+        for i, var in enumerate(variables):
+            expected = Histogram(data, var, color_attribute=color_attribute)
+            edges, distributions, _ = histograms[i]
+            if expected.distributions is None:
+                self.assertEqual(distributions.sum(), 0)
+                continue
+            np.testing.assert_equal(distributions, expected.distributions)
+            if var.is_continuous and len(expected.edges) == len(edges):
+                np.testing.assert_almost_equal(edges, expected.edges)
+
+    def test_matches_histogram(self):
+        iris = Table('iris')
+        self.assert_same_histograms(iris)
+        self.assert_same_histograms(iris, 'iris')
+
+        data = make_table(
+            [continuous_full, continuous_missing, continuous_all_missing,
+             continuous_same, rgb_full, rgb_missing, rgb_all_missing,
+             ints_bins_missing, time_missing], [rgb_bins_missing])
+        self.assert_same_histograms(data)
+        self.assert_same_histograms(data, 'rgb_bins_missing')
+
+    def test_sparse(self):
+        data = make_table(
+            [continuous_full, continuous_same, rgb_full, ints_bins_missing,
+             time_missing],
+            [rgb_missing], [continuous_missing])
+        sparse = data.to_sparse()
+        for color in (None, 'rgb_missing', 'continuous_missing'):
+            for var in data.domain.attributes:
+                expected = Histogram(data, var, color_attribute=color)
+                actual = Histogram(sparse, var, color_attribute=color)
+                self.assertEqual(actual.n_bins, expected.n_bins)
+                np.testing.assert_equal(actual.edges, expected.edges)
+                np.testing.assert_equal(actual.distributions,
+                                        expected.distributions)
+                np.testing.assert_equal(actual.means, expected.means)
+
+    def test_continuous_target(self):
+        data = make_table([continuous_full, rgb_full], [continuous_missing])
+        bins = histogram_bins(data.X, data.domain.attributes)
+        y = data.get_column_view('continuous_missing')[0]
+        histograms = compute_histograms(
+            data.X, bins, y, data.domain['continuous_missing'])
+        _, counts, means = histograms[1]
+        # rgb_full: [0, 1, 1, 1, 2], continuous_missing: [0, 1, 2, nan, 4]
+        np.testing.assert_equal(counts.ravel(), [1, 3, 1])
+        np.testing.assert_almost_equal(means, np.array([0, 1.5, 4]) / 4)
+
+    def test_concatenate(self):
+        data = make_table([continuous_full, rgb_full], [ints_missing])
+        parts = [(data.X, data.domain.attributes),
+                 (data._Y, data.domain.class_vars)]
+        histograms = Histograms.concatenate([
+            compute_histograms(x, histogram_bins(x, variables))
+            for x, variables in parts])
+        self.assertEqual(len(histograms), 3)
+        np.testing.assert_equal(histograms[2][1].ravel(), [1, 2, 1])
+        np.testing.assert_equal(histograms[2][0], [0, 1, 2, 3])
+
+
+class TestDistributionDelegate(WidgetTest):
+    def setUp(self):
+        self.widget = self.create_widget(OWFeatureStatistics)
+        self.send_signal('Data', Table('iris'))
+        self.model = self.widget.model
+        self.column = self.model.Columns.DISTRIBUTION
+        self.delegate = self.widget.table_view.itemDelegateForColumn(
+            self.column)
+
+    def paint(self, row, width=120, height=50):
+        image = QImage(width, height, QImage.Format_ARGB32)
+        image.fill(Qt.white)
+        option = QStyleOptionViewItem()
+        option.rect = QRect(0, 0, width, height)
+        index = self.model.index(row, self.column)
+        painter = QPainter(image)
+        try:
+            self.delegate.paint(painter, option, index)
+        finally:
+            painter.end()
+        return image
+
+    def cached(self):
+        return self.delegate._DistributionDelegate__cache
+
+    def test_paint(self):
+        image = self.paint(0)
+        colors = {image.pixel(x, y) for x in range(image.width())
+                  for y in range(image.height())}
+        self.assertGreater(len(colors), 1)
+
+    def test_cache(self):
+        self.paint(0)
+        self.paint(0)
+        self.assertEqual(len(self.cached()), 1)
+        self.paint(1)
+        self.paint(1, width=80)
+        self.assertEqual(len(self.cached()), 3)
+
+        # changing the target variable invalidates the pixmaps
+        self.model.set_target_var(None)
+        self.assertEqual(len(self.cached()), 0)
+
+        # the least recently used pixmaps are evicted
+        self.delegate.CACHE_BYTES = 2 * 120 * 50 * 4
+        for row in (0, 1, 2, 1):
+            self.paint(row)
+        self.assertEqual(len(self.cached()), 2)
+        # (the pixmaps are cached for the rows of the unsorted model)
+        self.assertEqual([key[0] for key in self.cached()],
+                         list(self.model.mapToSourceRows([2, 1])))
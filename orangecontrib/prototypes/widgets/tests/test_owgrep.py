@@ -3,7 +3,9 @@
 # Tests test protected methods
 # pylint: disable=protected-access
 import os
+import re
 import unittest
+from tempfile import NamedTemporaryFile
 from unittest.mock import Mock, patch
 
 import numpy as np
@@ -342,6 +344,111 @@ class TestOWGrep(WidgetTest):
         self._grep_and_check(["def", "def"])
         self.assertFalse(widget.Warning.no_lines.is_shown())
 
+    def test_grep_lines_empty_file(self):
+        widget = self.widget
+        widget.pattern = "def"
+        with NamedTemporaryFile(suffix=".txt", delete=False) as f:
+            widget.current_file = f.name
+        try:
+            self._grep_and_check([])
+            self.assertTrue(widget.Warning.no_lines.is_shown())
+        finally:
+            os.remove(f.name)
+
+    def test_grep_blocks(self):
+        def blocks(pattern, skip_lines=0, block_length=1, chunks=None):
+            return list(owgrep.grep_blocks(
+                chunks or [text], re.compile(pattern, re.MULTILINE),
+                skip_lines, block_length))
+
+        text = "ab\ncd\nab\nef\ngh"
+        self.assertEqual(blocks("ab"), ["ab", "ab"])
+        self.assertEqual(blocks("^c"), ["cd"])
+        self.assertEqual(blocks("d$"), ["cd"])
+        self.assertEqual(blocks("ab", 1), ["cd", "ef"])
+        # lines within blocks are not searched
+        self.assertEqual(blocks("ab", 0, 3), ["ab\ncd\nab"])
+        self.assertEqual(blocks("ab|gh", 1, 2), ["cd\nab"])
+        self.assertEqual(blocks("ef", 0, 5), ["ef\ngh"])
+        self.assertEqual(blocks("gh", 1), [])
+        # matches across lines count only if the line matches by itself
+        self.assertEqual(blocks("b\\s+c"), [])
+        self.assertEqual(blocks("d\\s?"), ["cd"])
+        self.assertEqual(blocks("x"), [])
+        self.assertEqual(blocks("^"), ["ab", "cd", "ab", "ef", "gh"])
+
+        # blocks continue into the next chunks
+        chunks = ["ab\ncd\n", "ab\n", "ef\ngh"]
+        for args in [("ab", ), ("^", ), ("ab", 1), ("ab", 0, 3),
+                     ("ab|gh", 1, 2), ("ef", 0, 5), ("cd", 2, 2), ("^$", )]:
+            self.assertEqual(blocks(*args, chunks=chunks), blocks(*args))
+
+    def test_read_chunks(self):
+        with NamedTemporaryFile(delete=False) as f:
+            f.write("ab\r\ncd\r\n\u00e9f\ngh".encode("utf-8"))
+        try:
+            with open(f.name, "rb") as f:
+                chunks = list(owgrep.read_chunks(f, "utf-8", chunk_size=3))
+        finally:
+            os.remove(f.name)
+        self.assertEqual(chunks, ["ab\n", "cd\n", "\u00e9f\n", "gh"])
+
+    def _grep_text(self, text, expected):
+        with NamedTemporaryFile(suffix=".txt", delete=False) as f:
+            f.write(text.encode("utf-8"))
+        self.widget.current_file = f.name
+        try:
+            with patch.object(owgrep.locale, "getpreferredencoding",
+                              return_value="utf-8"):
+                self._grep_and_check(expected)
+        finally:
+            os.remove(f.name)
+
+    def test_grep_lines_crlf(self):
+        widget = self.widget
+        widget.regular_expression = True
+        widget.pattern = "foo$"
+        self._grep_text("foo\r\nbar\r\nbar foo\r\nfoo bar", ["foo", "bar foo"])
+        widget.pattern = "^bar"
+        widget.block_length = 2
+        self._grep_text("foo\r\nbar\r\nbaz\r\n", ["bar", "baz"])
+
+    def test_grep_lines_non_ascii(self):
+        widget = self.widget
+        text = "caf\u00e9 au lait\nth\u00e9\n\u00c9T\u00c9\ncafe\n"
+        widget.regular_expression = True
+        # characters rather than bytes are matched
+        widget.pattern = "^\\w{3}$"
+        self._grep_text(text, ["th\u00e9", "\u00c9T\u00c9"])
+        widget.pattern = "caf.$"
+        self._grep_text(text, ["cafe"])
+        widget.pattern = "caf[\u00e9e] "
+        self._grep_text(text, ["caf\u00e9 au lait"])
+
+        widget.regular_expression = False
+        widget.case_sensitive = False
+        widget.pattern = "\u00e9t\u00e9"
+        self._grep_text(text, ["\u00c9T\u00c9"])
+        widget.case_sensitive = True
+        self._grep_text(text, [])
+        # patterns with characters outside of the file's encoding
+        # simply do not match
+        widget.pattern = "\u4e2d"
+        self._grep_text(text, [])
+        self.assertFalse(widget.Error.invalid_pattern.is_shown())
+
+    def test_grep_lines_invalid_pattern(self):
+        widget = self.widget
+        widget.current_file = self.test_file
+        widget.regular_expression = True
+        widget.pattern = "long("
+        self._grep_and_check([])
+        self.assertTrue(widget.Error.invalid_pattern.is_shown())
+
+        widget.pattern = "long"
+        self._grep_and_check(["a longer line", "another long line"])
+        self.assertFalse(widget.Error.invalid_pattern.is_shown())
+
     def test_set_out_view(self):
         widget = self.widget
         widget.selected_lines = list("abcde")
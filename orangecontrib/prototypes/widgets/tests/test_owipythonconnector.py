@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pandas as pd
+from pickleshare import PickleShareDB
+
+from Orange.widgets.tests.base import WidgetTest
+from orangecontrib.prototypes.widgets import owipythonconnector
+from orangecontrib.prototypes.widgets.owipythonconnector import \
+    OWIPythonConnector, STORE
+
+
+class TestOWIPythonConnector(WidgetTest):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = PickleShareDB(self.tmp)
+        root = os.path.join(self.tmp, STORE._NAMESPACE)
+        os.makedirs(root)
+        patches = [patch.object(STORE, '_db', self.db),
+                   patch.object(STORE, 'root', root)]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.store('frame', pd.DataFrame({'a': [1., 2., 3.]}))
+        self.store('array', np.arange(6.).reshape(3, 2))
+        self.widget = self.create_widget(OWIPythonConnector)
+        self.process_events(until=lambda: self.widget.combo.count() == 2)
+
+    def tearDown(self):
+        self.widget.onDeleteWidget()
+        super().tearDown()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def store(self, key, obj):
+        self.db[STORE._NAMESPACE + key] = obj
+
+    def select(self, key):
+        self.widget.selected = next(
+            self.widget.combo.itemText(i)
+            for i in range(self.widget.combo.count())
+            if self.widget.combo.itemText(i).split()[0] == key)
+        self.widget.output()
+
+    def wait_for_task(self):
+        self.process_events(until=lambda: self.widget._task is None)
+
+    def test_combo(self):
+        self.assertEqual(
+            [self.widget.combo.itemText(i) for i in range(2)],
+            ['array  (numpy.ndarray)', 'frame  (pandas.core.frame.DataFrame)'])
+
+    def test_background_load(self):
+        threads = []
+
+        def load(key):
+            threads.append(threading.current_thread())
+            return load.wrapped(key)
+
+        load.wrapped = owipythonconnector._load
+        with patch.object(owipythonconnector, '_load', load):
+            self.select('frame')
+            self.wait_for_task()
+        self.assertIsNot(threads[0], threading.main_thread())
+        output = self.get_output(self.widget.Outputs.data)
+        np.testing.assert_equal(output.X, [[1], [2], [3]])
+        self.assertIsInstance(
+            self.get_output(self.widget.Outputs.object), pd.DataFrame)
+
+    def test_superseded_load(self):
+        started, release = threading.Event(), threading.Event()
+        load = owipythonconnector._load
+
+        def slow_load(key):
+            if key == 'frame':
+                started.set()
+                release.wait(5)
+            return load(key)
+
+        with patch.object(owipythonconnector, '_load', slow_load):
+            self.select('frame')
+            self.assertTrue(started.wait(5))
+            stale = self.widget._task.future
+            # the new selection does not wait for the running load ...
+            self.select('array')
+            self.assertFalse(stale.done())
+            self.wait_for_task()
+            np.testing.assert_equal(
+                self.get_output(self.widget.Outputs.data).X,
+                np.arange(6.).reshape(3, 2))
+            # ... whose result is dropped
+            release.set()
+            stale.result(5)
+        self.process_events()
+        np.testing.assert_equal(
+            self.get_output(self.widget.Outputs.data).X,
+            np.arange(6.).reshape(3, 2))
+
+    def test_load_error(self):
+        with patch.object(owipythonconnector, '_load',
+                          side_effect=ValueError('truncated')):
+            self.select('frame')
+            self.wait_for_task()
+        self.assertTrue(self.widget.Error.load_error.is_shown())
+        self.assertIsNone(self.get_output(self.widget.Outputs.data))
+
+        self.select('frame')
+        self.wait_for_task()
+        self.assertFalse(self.widget.Error.load_error.is_shown())
+        self.assertIsNotNone(self.get_output(self.widget.Outputs.data))
+
+    def test_debounce(self):
+        self.select('frame')
+        self.wait_for_task()
+        widget = self.widget
+        widget.output = Mock()
+        widget._reload_timer.setInterval(10)
+        path = os.path.join(STORE.root, 'frame')
+        # a burst of notifications for the selected object ...
+        for _ in range(5):
+            widget.on_file_changed(path)
+        self.assertFalse(widget.output.called)
+        # ... (and none for others) is reloaded once
+        widget.on_file_changed(os.path.join(STORE.root, 'array'))
+        self.process_events(until=lambda: widget.output.called)
+        self.process_events(until=lambda: not widget._reload_timer.isActive())
+        widget.output.assert_called_once_with()
+
+    def test_reload_waits_for_stable_file(self):
+        self.select('frame')
+        self.wait_for_task()
+        widget = self.widget
+        widget.output = Mock()
+        path = os.path.join(STORE.root, 'frame')
+        widget.on_file_changed(path)
+        # the file is still being written when the timer fires
+        with open(path, 'ab') as f:
+            f.write(b'\0')
+        widget._on_reload_timeout()
+        self.assertFalse(widget.output.called)
+        self.assertTrue(widget._reload_timer.isActive())
+        # it's loaded once its size and mtime stay the same
+        widget._on_reload_timeout()
+        widget.output.assert_called_once_with()
@@ -0,0 +1,876 @@
+import concurrent.futures
+import math
+import sqlite3
+import tempfile
+import threading
+from functools import reduce
+from unittest.mock import patch
+
+import numpy as np
+
+from AnyQt.QtCore import Qt
+from AnyQt.QtGui import QImage, QPainter, QColor
+
+from Orange.data import Table, Domain, ContinuousVariable
+from Orange.data import filter as data_filter
+from Orange.preprocess.discretize import Discretizer
+from Orange.statistics import contingency
+from Orange.widgets.tests.base import WidgetTest
+from Orange.widgets.utils.concurrent import ThreadExecutor
+
+from orangecontrib.prototypes.widgets.owscattermap import (
+    OWScatterMap, grid_bin_array, histogram2d, histogram2d_sql,
+    histogram2d_from_rows, grid_bin, pyramid_expand, pyramid_load,
+    pyramid_store, Tree, Patch_create, image_from_colors,
+    PatchCache, Patch_nbytes, DensityPatch, FlatTree, chi_square_scores,
+    compute_chi_squares, top_k, bin_node_cells, sharpen_node_cells,
+    tree_rebin, histogram2d_moments, moments_stats, create_image,
+    picture_intersect, lod_patch
+)
+from orangecontrib.prototypes.widgets.utils import blocks
+
+
+def width_bucket(value, low, high, count):
+    # SQLite stand-in for the standard SQL function
+    if value < low:
+        return 0
+    elif value >= high:
+        return count + 1
+    return int(math.floor(count * (value - low) / (high - low))) + 1
+
+
+def histogram2d_query(table_name, xfield, yfield, xbins, ybins, zfield=None,
+                      valuefield=None, weightfield=None):
+    """
+    Return a complete 2D histogram SQL query over `table_name`.
+    """
+    fields, filters, group_by = histogram2d_sql(
+        xfield, yfield, xbins, ybins, zfield, valuefield, weightfield)
+    return "SELECT {} FROM {} WHERE {} GROUP BY {}".format(
+        ", ".join(fields), table_name, " AND ".join(filters),
+        ", ".join(group_by))
+
+
+def grid_bin_contingency(data, xvar, yvar, xbins, ybins, zvar=None):
+    """
+    Bin `data` on a `xbins` x `ybins` grid using filters and contingencies
+    (the reference for the vectorized `grid_bin_array`).
+    """
+    x_disc = Discretizer.create_discretized_var(xvar, xbins[1:-1])
+    y_disc = Discretizer.create_discretized_var(yvar, ybins[1:-1])
+
+    x_min, x_max = xbins[0], xbins[-1]
+    y_min, y_max = ybins[0], ybins[-1]
+
+    querydomain = [x_disc, y_disc]
+    if zvar is not None:
+        querydomain = querydomain + [zvar]
+
+    querydomain = Domain(querydomain)
+
+    def interval_filter(var, low, high):
+        return data_filter.Values(
+            [data_filter.FilterContinuous(
+                 var, max=high, min=low,
+                 oper=data_filter.FilterContinuous.Between)]
+        )
+
+    def value_filter(var, val):
+        return data_filter.Values(
+            [data_filter.FilterDiscrete(var, [val])]
+        )
+
+    def filters_join(filters):
+        return data_filter.Values(
+            reduce(list.__iadd__, (f.conditions for f in filters), [])
+        )
+
+    inf_bounds = np.isinf([x_min, x_max, y_min, y_max])
+    if not all(inf_bounds):
+        # No need to filter the data
+        range_filters = [interval_filter(xvar, x_min, x_max),
+                         interval_filter(yvar, y_min, y_max)]
+        range_filter = filters_join(range_filters)
+        subset = range_filter(data)
+    else:
+        subset = data
+
+    if zvar and zvar.is_discrete:
+        filters = [value_filter(zvar, val) for val in zvar.values]
+        contingencies = [
+            contingency.get_contingency(
+                filter_(subset.from_table(querydomain, subset)),
+                col_variable=y_disc, row_variable=x_disc
+            )
+            for filter_ in filters
+        ]
+        contingencies = np.dstack(contingencies)
+    else:
+        contingencies = contingency.get_contingency(
+            subset.from_table(querydomain, subset),
+            col_variable=y_disc, row_variable=x_disc
+        )
+
+    contingencies = np.asarray(contingencies)
+    return Tree(xbins, ybins, contingencies, None)
+
+
+class TestGridBin(WidgetTest):
+    def setUp(self):
+        self.iris = Table("iris")
+        domain = self.iris.domain
+        self.xvar, self.yvar = domain[0], domain[1]
+        self.zvar = domain.class_var
+
+    def assert_same_bins(self, xbins, ybins, zvar=None):
+        args = (self.iris, self.xvar, self.yvar, xbins, ybins, zvar)
+        fast, slow = grid_bin_array(*args), grid_bin_contingency(*args)
+        np.testing.assert_equal(fast.contingencies, slow.contingencies)
+
+    def test_grid_bin_matches_contingency(self):
+        xbins = np.r_[-np.inf, np.linspace(4.5, 7.5, 7), np.inf]
+        ybins = np.r_[-np.inf, np.linspace(2.2, 4.2, 7), np.inf]
+        self.assert_same_bins(xbins, ybins)
+        self.assert_same_bins(xbins, ybins, self.zvar)
+
+        # finite outer edges filter the data (inclusive on both ends)
+        xbins = np.linspace(5, 6, 5)
+        ybins = np.linspace(2.5, 3.5, 5)
+        self.assert_same_bins(xbins, ybins)
+        self.assert_same_bins(xbins, ybins, self.zvar)
+
+    def test_memmap(self):
+        with tempfile.NamedTemporaryFile() as f:
+            X = np.memmap(f, dtype=float, mode="w+",
+                          shape=self.iris.X.shape)
+            X[:] = self.iris.X
+            data = Table.from_numpy(self.iris.domain, X, self.iris.Y)
+            self.assertTrue(blocks.is_memmap(data.X))
+            xbins = np.linspace(4, 8, 9)
+            ybins = np.linspace(2, 4.5, 6)
+            row_blocks = blocks.row_blocks
+            with patch.object(blocks, "row_blocks",
+                              lambda n, row_bytes: row_blocks(n, row_bytes,
+                                                              16 * row_bytes)):
+                for zvar in (None, self.zvar, self.iris.domain[2]):
+                    expected = grid_bin_array(self.iris, self.xvar, self.yvar,
+                                              xbins, ybins, zvar)
+                    actual = grid_bin_array(data, self.xvar, self.yvar,
+                                            xbins, ybins, zvar)
+                    np.testing.assert_almost_equal(actual.contingencies,
+                                                   expected.contingencies)
+            del data, X
+
+    def test_histogram2d_unknowns(self):
+        x = np.array([0.5, 1.5, np.nan, 0.5, 3])
+        y = np.array([0.5, 0.5, 0.5, np.nan, 0.5])
+        z = np.array([0, 1, 0, 0, np.nan])
+        bins = np.array([0, 1, 2])
+        np.testing.assert_equal(histogram2d(x, y, bins, bins),
+                                [[1, 0], [1, 0]])
+        np.testing.assert_equal(histogram2d(x, y, bins, bins, z, 2),
+                                [[[1, 0], [0, 0]], [[0, 1], [0, 0]]])
+        w = np.array([2, 0.5, 1, 1, 1])
+        np.testing.assert_equal(histogram2d(x, y, bins, bins, weights=w),
+                                [[2, 0], [0.5, 0]])
+
+    def test_moments(self):
+        xbins = np.r_[-np.inf, np.linspace(4.5, 7.5, 7), np.inf]
+        ybins = np.linspace(2.2, 4.2, 5)
+        vvar, wvar = self.iris.domain[2], self.iris.domain[3]
+        tree = grid_bin(self.iris, self.xvar, self.yvar, xbins, ybins,
+                        vvar, wvar)
+        self.assertEqual(tree.contingencies.shape, (8, 4, 3))
+
+        x, y, v, w = self.iris.X.T
+        xi = np.searchsorted(xbins[1:-1], x, side="right")
+        yi = np.searchsorted(ybins[1:-1], y, side="right")
+        inside = (ybins[0] <= y) & (y <= ybins[-1])
+        for i, j in np.ndindex(8, 4):
+            m = inside & (xi == i) & (yi == j)
+            np.testing.assert_almost_equal(
+                tree.contingencies[i, j],
+                [w[m].sum(), (w * v)[m].sum(), (w * v * v)[m].sum()])
+
+        count, mean, var = moments_stats(tree.contingencies)
+        i, j = np.unravel_index(np.argmax(count), count.shape)
+        m = inside & (xi == i) & (yi == j)
+        self.assertAlmostEqual(mean[i, j], np.average(v[m], weights=w[m]))
+        self.assertAlmostEqual(
+            var[i, j], np.average((v[m] - mean[i, j]) ** 2, weights=w[m]))
+        self.assertTrue(np.isnan(mean[count == 0]).all())
+
+        # moments are additive
+        halves = [histogram2d_moments(x[k::2], y[k::2], xbins, ybins, v[k::2])
+                  for k in (0, 1)]
+        np.testing.assert_almost_equal(
+            halves[0] + halves[1], histogram2d_moments(x, y, xbins, ybins, v))
+
+    def test_create_image_aggregate(self):
+        moments = np.zeros((2, 2, 3))
+        moments[0, 0] = [1, 0, 0]
+        moments[1, 1] = [1, 1, 1]
+        colors = create_image(moments, value_range=(0, 1))
+        low, high = create_image(moments[[0, 1], [0, 1]][np.newaxis],
+                                 value_range=(0, 1))[0]
+        np.testing.assert_equal(colors[0, 0], low)
+        np.testing.assert_equal(colors[1, 1], high)
+        np.testing.assert_equal(colors[0, 1], [255, 255, 255])
+        self.assertFalse(np.array_equal(low, high))
+
+
+class TestGridBinSql(WidgetTest):
+    def setUp(self):
+        self.iris = iris = Table("iris")
+        self.xvar, self.yvar = iris.domain[0], iris.domain[1]
+        self.zvar = iris.domain.class_var
+
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.create_function("width_bucket", 4, width_bucket)
+        self.conn.execute(
+            "CREATE TABLE iris (x REAL, y REAL, v REAL, w REAL, z TEXT)")
+        self.conn.executemany(
+            "INSERT INTO iris VALUES (?, ?, ?, ?, ?)",
+            [(float(x), float(y), float(v), float(w), str(z))
+             for (x, y, v, w), z in zip(
+                 iris.X, iris.Y.astype(int).choose(self.zvar.values))])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def assert_same_bins(self, xbins, ybins, zvar=None):
+        query = histogram2d_query("iris", "x", "y", xbins, ybins,
+                                  "z" if zvar is not None else None)
+        rows = self.conn.execute(query).fetchall()
+        counts = histogram2d_from_rows(
+            rows, len(xbins) - 1, len(ybins) - 1, zvar)
+        expected = grid_bin_array(
+            self.iris, self.xvar, self.yvar, xbins, ybins, zvar)
+        np.testing.assert_equal(counts, expected.contingencies)
+
+    def test_histogram_query(self):
+        # (width_bucket's rounding may differ on the edges themselves, so
+        # keep them off the data's 0.1 grid)
+        xbins = np.r_[-np.inf, np.linspace(4.65, 7.45, 8), np.inf]
+        ybins = np.r_[-np.inf, np.linspace(2.15, 4.15, 6), np.inf]
+        self.assert_same_bins(xbins, ybins)
+        self.assert_same_bins(xbins, ybins, self.zvar)
+
+        xbins = np.linspace(5.05, 6.05, 5)
+        ybins = np.linspace(2.55, 3.55, 3)
+        self.assert_same_bins(xbins, ybins)
+        self.assert_same_bins(xbins, ybins, self.zvar)
+
+    def test_histogram_query_nonuniform(self):
+        xbins = np.array([-np.inf, 5.05, 5.55, 6.85, np.inf])
+        ybins = np.array([2.05, 3.05, 4.45])
+        self.assert_same_bins(xbins, ybins, self.zvar)
+
+    def test_histogram_query_small_edges(self):
+        # non-uniform edges on a small scale must not be taken as uniform
+        edges = np.array([-np.inf, 0, 1e-9, 3e-9, np.inf])
+        self.assertNotIn("width_bucket",
+                         histogram2d_sql("x", "y", edges, edges)[2][0])
+        uniform = np.array([-np.inf, 0, 1e-9, 2e-9, np.inf])
+        self.assertIn("width_bucket",
+                      histogram2d_sql("x", "y", uniform, uniform)[2][0])
+
+        x = np.array([0.5, 1.5, 2, 2.5, 3.5, -1]) * 1e-9
+        self.conn.execute("CREATE TABLE small (x REAL, y REAL)")
+        self.conn.executemany("INSERT INTO small VALUES (?, ?)",
+                              [(float(v), float(v)) for v in x])
+        rows = self.conn.execute(
+            histogram2d_query("small", "x", "y", edges, edges)).fetchall()
+        np.testing.assert_equal(histogram2d_from_rows(rows, 4, 4),
+                                histogram2d(x, x, edges, edges))
+
+    def test_aggregate_query(self):
+        xbins = np.r_[-np.inf, np.linspace(4.65, 7.45, 8), np.inf]
+        ybins = np.linspace(2.15, 4.15, 6)
+        vvar, wvar = self.iris.domain[2], self.iris.domain[3]
+        for weights, weight_var in ((None, None), ("w", wvar)):
+            query = histogram2d_query("iris", "x", "y", xbins, ybins,
+                                      valuefield="v", weightfield=weights)
+            rows = self.conn.execute(query).fetchall()
+            moments = histogram2d_from_rows(
+                rows, len(xbins) - 1, len(ybins) - 1, vvar)
+            expected = grid_bin_array(self.iris, self.xvar, self.yvar,
+                                      xbins, ybins, vvar, weight_var)
+            np.testing.assert_almost_equal(moments, expected.contingencies)
+
+
+class TestPyramid(WidgetTest):
+    def setUp(self):
+        self.iris = iris = Table("iris")
+        self.xvar, self.yvar = iris.domain[0], iris.domain[1]
+        self.zvar = iris.domain.class_var
+
+    def bin_func(self, xbins, ybins):
+        return grid_bin(self.iris, self.xvar, self.yvar, xbins, ybins,
+                        self.zvar)
+
+    def test_expand(self):
+        root = self.bin_func(np.linspace(4, 8, 5), np.linspace(2, 4.5, 5))
+        progress = []
+        tree = pyramid_expand(root, 4, 3, self.bin_func,
+                              lambda i, n: progress.append((i, n)))
+        self.assertEqual(tree.depth(), 3)
+        self.assertEqual(progress[-1][0], progress[-1][1])
+
+        def check(node):
+            if node.is_leaf:
+                return
+            for (i, j), child in np.ndenumerate(node.children):
+                if child is None:
+                    self.assertFalse(node.contingencies[i, j].any())
+                else:
+                    np.testing.assert_equal(child.contingencies.sum((0, 1)),
+                                            node.contingencies[i, j])
+                    check(child)
+        check(tree)
+
+    def test_store_load(self):
+        root = self.bin_func(np.linspace(4, 8, 5), np.linspace(2, 4.5, 5))
+        tree = pyramid_expand(root, 4, 2, self.bin_func)
+        flat = FlatTree.from_tree(tree)
+        args = self.iris, self.xvar, self.yvar, self.zvar, 4, 2
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("orangecontrib.prototypes.widgets.owscattermap."
+                      "cache_dir", return_value=tmp):
+            self.assertIsNone(pyramid_load(*args))
+            pyramid_store(flat, *args)
+            loaded = pyramid_load(*args)
+            self.assertIsNotNone(loaded)
+            self.assertEqual(loaded.depth(), 2)
+            self.assertEqual(loaded.max(), flat.max())
+            # different variables, different key
+            self.assertIsNone(pyramid_load(
+                self.iris, self.yvar, self.xvar, self.zvar, 4, 2))
+            # pyramids stored as `Tree`s are not loaded
+            pyramid_store(tree, *args)
+            self.assertIsNone(pyramid_load(*args))
+
+
+class TestSharpen(WidgetTest):
+    def setUp(self):
+        self.iris = iris = Table("iris")
+        self.xvar, self.yvar = iris.domain[0], iris.domain[1]
+        self.zvar = iris.domain.class_var
+
+    def bin_func(self, xbins, ybins):
+        return grid_bin(self.iris, self.xvar, self.yvar, xbins, ybins,
+                        self.zvar)
+
+    def test_chi_square_scores(self):
+        cont = np.random.RandomState(0).randint(0, 5, (4, 5, 3))
+        chi_lr, chi_up = compute_chi_squares(
+            cont.swapaxes(1, 2).swapaxes(0, 1))
+        expected = np.zeros((4, 5))
+        for i, j in np.ndindex(4, 5):
+            neighbours = [chi_lr[i, j - 1] if j > 0 else 0,
+                          chi_lr[i, j] if j < 4 else 0,
+                          chi_up[i - 1, j] if i > 0 else 0,
+                          chi_up[i, j] if i < 3 else 0]
+            expected[i, j] = max(neighbours)
+        np.testing.assert_almost_equal(chi_square_scores(cont), expected)
+
+    def test_top_k(self):
+        scores = np.array([3., 1., 4., 1., 5., 9., 2., 6.])
+        np.testing.assert_equal(top_k(scores, 3), [5, 7, 4])
+        np.testing.assert_equal(top_k(scores), np.argsort(-scores,
+                                                          kind="mergesort"))
+        self.assertEqual(len(top_k(scores[:0], 3)), 0)
+
+    def test_sharpen_node_cells(self):
+        root = self.bin_func(np.linspace(4, 8, 5), np.linspace(2, 4.5, 5))
+        rows, cols = np.nonzero(root.contingencies.any(axis=2))
+        node = sharpen_node_cells(root, (rows[:3], cols[:3]), 4,
+                                  self.bin_func)
+        for i, j in zip(rows[:3], cols[:3]):
+            child = node.children[i, j]
+            np.testing.assert_equal(child.contingencies.sum((0, 1)),
+                                    root.contingencies[i, j])
+        self.assertEqual(sum(ch is not None for ch in node.children.flat), 3)
+
+        # empty cells are not refined
+        empty = np.nonzero(~root.contingencies.any(axis=2))
+        rows, cols, leaves = bin_node_cells(root, empty, 4, self.bin_func)
+        self.assertEqual((len(rows), len(cols), len(leaves)), (0, 0, 0))
+
+    def test_tree_rebin(self):
+        sample = self.iris[::3]
+
+        def sample_bin_func(xbins, ybins):
+            return grid_bin(sample, self.xvar, self.yvar, xbins, ybins,
+                            self.zvar)
+
+        root = sample_bin_func(np.linspace(4, 8, 5), np.linspace(2, 4.5, 5))
+        tree = pyramid_expand(root, 4, 3, sample_bin_func)
+        flat = tree_rebin(FlatTree.from_tree(tree), self.bin_func)
+        tree = flat.to_tree()
+        self.assertEqual(tree.contingencies.sum(), len(self.iris))
+        np.testing.assert_equal(tree.xbins, root.xbins)
+
+        def check(node):
+            for (i, j), child in np.ndenumerate(node.children):
+                if child is not None:
+                    np.testing.assert_equal(child.contingencies.sum((0, 1)),
+                                            node.contingencies[i, j])
+                    if not child.is_leaf:
+                        check(child)
+        check(tree)
+
+        # the sub nodes of cells that are now empty are dropped
+        flat = tree_rebin(flat, lambda xbins, ybins: grid_bin(
+            self.iris[:0], self.xvar, self.yvar, xbins, ybins, self.zvar))
+        self.assertEqual(flat.depth(), 1)
+        self.assertFalse(np.any(flat.contingencies[0]))
+
+
+class TestFlatTree(WidgetTest):
+    def setUp(self):
+        iris = Table("iris")
+        domain = iris.domain
+        xvar, yvar, zvar = domain[0], domain[1], domain.class_var
+
+        def bin_func(xbins, ybins):
+            return grid_bin(iris, xvar, yvar, xbins, ybins, zvar)
+
+        root = bin_func(np.linspace(4, 8, 5), np.linspace(2, 4.5, 5))
+        self.tree = pyramid_expand(root, 4, 3, bin_func)
+        self.flat = FlatTree.from_tree(self.tree)
+
+    def assert_same_tree(self, tree1, tree2):
+        np.testing.assert_equal(tree1.xbins, tree2.xbins)
+        np.testing.assert_equal(tree1.ybins, tree2.ybins)
+        np.testing.assert_equal(tree1.contingencies, tree2.contingencies)
+        self.assertEqual(tree1.is_leaf, tree2.is_leaf)
+        if not tree1.is_leaf:
+            for ch1, ch2 in zip(tree1.children.flat, tree2.children.flat):
+                self.assertEqual(ch1 is None, ch2 is None)
+                if ch1 is not None:
+                    self.assert_same_tree(ch1, ch2)
+
+    def test_round_trip(self):
+        self.assertEqual(self.flat.depth(), 3)
+        self.assertEqual(self.flat.brect, self.tree.brect)
+        self.assert_same_tree(self.flat.to_tree(), self.tree)
+
+    def displayed(self, flat):
+        return np.concatenate([ctng[index < 0] for ctng, index in
+                               zip(flat.contingencies, flat.children)])
+
+    def test_resample(self):
+        total = self.tree.contingencies.sum(axis=(0, 1))
+        for p, depth in [(-4, 3), (-3, 3), (-2, 2), (-1, 2), (0, 1), (1, 1),
+                         (2, 1)]:
+            rs_flat = self.flat.resample(2 ** p)
+            self.assertEqual(rs_flat.depth(), depth)
+            self.assertEqual(rs_flat.brect, self.flat.brect)
+            displayed = self.displayed(rs_flat)
+            np.testing.assert_equal(displayed.sum(axis=0), total)
+            self.assertEqual(rs_flat.max(), displayed.max())
+        self.assertEqual(
+            self.flat.resample(2).contingencies[0].shape, (1, 2, 2, 3))
+
+    def test_expand(self):
+        node = self.tree._replace(children=None)
+        rows, cols = np.nonzero(node.contingencies.any(axis=2))
+        rows, cols = rows[:2], cols[:2]
+        leaves = [self.tree.children[i, j]._replace(children=None)
+                  for i, j in zip(rows, cols)]
+        expanded = FlatTree.from_tree(node).expand(
+            0, [(0, rows, cols, leaves)])
+        children = np.full((4, 4), None, dtype=object)
+        for i, j, leaf in zip(rows, cols, leaves):
+            children[i, j] = leaf
+        self.assert_same_tree(expanded.to_tree(),
+                              node._replace(children=children))
+
+        # the existing nodes keep their indices
+        more = expanded.expand(1, [(1, [0], [1], leaves[:1])])
+        self.assertEqual(more.depth(), 3)
+        np.testing.assert_equal(more.contingencies[1],
+                                expanded.contingencies[1])
+        self.assertEqual(more.children[1][1, 0, 1], 0)
+        self.assertIs(expanded.expand(0, []), expanded)
+
+    def test_take(self):
+        taken = self.flat.take([2, 0]).to_tree()
+        np.testing.assert_equal(taken.contingencies,
+                                self.tree.contingencies[:, :, [2, 0]])
+        child = next(ch for ch in taken.children.flat if ch is not None)
+        self.assertEqual(child.contingencies.shape, (4, 4, 2))
+
+
+class TestRaster(WidgetTest):
+    def render(self, patch, size=80):
+        image = QImage(size, size, QImage.Format_ARGB32)
+        image.fill(QColor(0, 0, 0, 0))
+        painter = QPainter(image)
+        painter.setPen(Qt.NoPen)
+        rect = patch.rect
+        painter.scale(size / rect.width(), size / rect.height())
+        painter.translate(-rect.x(), -rect.y())
+        patch.picture().play(painter)
+        painter.end()
+        return image
+
+    def test_image_from_colors(self):
+        colors = np.arange(2 * 3 * 3).reshape((2, 3, 3))
+        mask = np.array([[True, False, True], [True, True, False]])
+        image = image_from_colors(colors, mask)
+        self.assertEqual((image.width(), image.height()), (2, 3))
+        for (i, j), visible in np.ndenumerate(mask):
+            color = QColor.fromRgba(image.pixel(i, j))
+            self.assertEqual(color.alpha(), 255 if visible else 0)
+            if visible:
+                self.assertEqual(color.getRgb()[:3], tuple(colors[i, j]))
+
+    def test_raster_matches_vector(self):
+        ctng = np.zeros((4, 4, 2))
+        ctng[0, 1, 0] = 3
+        ctng[2, 3, 1] = 1
+        ctng[3, 0] = [1, 2]
+        child = Tree(np.linspace(0, 1, 5), np.linspace(0, 1, 5),
+                     np.ones((4, 4, 2)), None)
+        children = np.full((4, 4), None, dtype=object)
+        children[0, 0] = child
+        ctng[0, 0, 0] = 32
+        node = Tree(np.linspace(0, 4, 5), np.linspace(0, 4, 5),
+                    ctng, children)
+
+        node = FlatTree.from_tree(node)
+        raster = self.render(Patch_create(node, raster=True))
+        vector = self.render(Patch_create(node, raster=False))
+        self.assertEqual(QColor.fromRgba(raster.pixel(2, 2)).alpha(), 255)
+        self.assertEqual(QColor.fromRgba(raster.pixel(30, 10)).alpha(), 0)
+        # compare colors in the centers of the smallest cells
+        for i in range(16):
+            for j in range(16):
+                x, y = 2 + 5 * i, 2 + 5 * j
+                self.assertEqual(raster.pixel(x, y), vector.pixel(x, y))
+
+
+class TestPatchCache(WidgetTest):
+    def setUp(self):
+        self.iris = iris = Table("iris")
+        self.node = grid_bin(iris, iris.domain[0], iris.domain[1],
+                             np.linspace(4, 8, 17), np.linspace(2, 4.5, 17),
+                             iris.domain.class_var)
+        self.root = FlatTree.from_tree(self.node)
+
+    def patch(self):
+        patch = Patch_create(self.root, raster=True)
+        patch.picture()
+        return patch
+
+    def test_lru(self):
+        size = Patch_nbytes(self.patch())
+        self.assertGreater(size, 0)
+        cache = PatchCache(int(2.5 * size))
+        for key in "abc":
+            cache.put(key, self.patch())
+        self.assertNotIn("a", cache)
+        self.assertIn("b", cache)
+        cache.get("b")
+        cache.put("d", self.patch())
+        self.assertNotIn("c", cache)
+        self.assertIn("b", cache)
+        self.assertLessEqual(cache.nbytes(), cache.budget)
+
+        # the last patch is kept even if it is over the budget
+        cache.budget = 0
+        cache.trim()
+        self.assertEqual(len(cache), 1)
+        self.assertIn("d", cache)
+
+    def test_lazy_size(self):
+        cache = PatchCache(2 ** 30)
+        patch = Patch_create(self.root, raster=True)
+        cache.put("a", patch)
+        self.assertEqual(cache.nbytes(), 0)
+        grown = []
+        picture_intersect(patch, patch.rect, grown)
+        self.assertEqual(len(grown), 1)
+        cache.grow("a", sum(grown))
+        self.assertEqual(cache.nbytes(), Patch_nbytes(patch))
+        # evaluated pictures are not counted again
+        grown = []
+        picture_intersect(patch, patch.rect, grown)
+        self.assertEqual(grown, [])
+
+    def test_paint_size(self):
+        item = DensityPatch(self.root)
+        image = QImage(100, 100, QImage.Format_ARGB32)
+
+        class Option:
+            exposedRect = item.rect()
+
+        def paint():
+            painter = QPainter(image)
+            painter.scale(100 / 4, 100 / 2.5)
+            painter.translate(-4, -2)
+            item.paint(painter, Option, None)
+            painter.end()
+
+        paint()
+        (key, cached), = item._cache._patches.items()
+        self.assertEqual(item._cache.nbytes(), Patch_nbytes(cached))
+        # repainting the cached patch does not walk it again
+        with patch("orangecontrib.prototypes.widgets.owscattermap."
+                   "Patch_nbytes") as nbytes:
+            paint()
+        nbytes.assert_not_called()
+        self.assertIn(key, item._cache)
+        item.cancel_prefetch()
+
+    def test_prefetch(self):
+        children = np.full((16, 16), None, dtype=object)
+        domain = self.iris.domain
+        children[8, 8] = grid_bin(
+            self.iris, domain[0], domain[1],
+            np.linspace(6, 6.25, 17), np.linspace(3.25, 3.40625, 17),
+            domain.class_var)
+        item = DensityPatch(FlatTree.from_tree(
+            self.node._replace(children=children)))
+        image = QImage(100, 100, QImage.Format_ARGB32)
+        painter = QPainter(image)
+        painter.scale(100 / 4, 100 / 2.5)
+        painter.translate(-4, -2)
+
+        class Option:
+            exposedRect = item.rect()
+
+        item.paint(painter, Option, None)
+        painter.end()
+        self.assertEqual(len(item._cache), 1)
+        self.process_events(until=lambda: not item._prefetching)
+        self.assertEqual(len(item._cache), 3)
+
+    def test_prefetch_budget(self):
+        children = np.full((16, 16), None, dtype=object)
+        domain = self.iris.domain
+        children[8, 8] = grid_bin(
+            self.iris, domain[0], domain[1],
+            np.linspace(6, 6.25, 17), np.linspace(3.25, 3.40625, 17),
+            domain.class_var)
+        root = FlatTree.from_tree(self.node._replace(children=children))
+        image = QImage(100, 100, QImage.Format_ARGB32)
+
+        def paint(item):
+            class Option:
+                exposedRect = item.rect()
+
+            painter = QPainter(image)
+            painter.scale(100 / 4, 100 / 2.5)
+            painter.translate(-4, -2)
+            item.paint(painter, Option, None)
+            painter.end()
+
+        item = DensityPatch(root, cache_budget=0)
+        paint(item)
+        (key, _), = item._cache._patches.items()
+        size = item._cache.nbytes(key)
+        self.assertGreater(size, 0)
+        self.assertEqual(item._prefetching, {})
+
+        # (the adjacent levels do not fit into a budget of about one patch)
+        item = DensityPatch(root, cache_budget=int(size * 1.5))
+        for _ in range(3):
+            paint(item)
+            self.assertEqual(item._prefetching, {})
+        self.assertEqual(list(item._cache._patches), [key])
+
+        # one of them fits
+        item = DensityPatch(root, cache_budget=int(size * 2.5))
+        paint(item)
+        self.assertEqual(len(item._prefetching), 1)
+        self.process_events(until=lambda: not item._prefetching)
+        # (and is dropped if it turns out larger than the rest of the budget)
+        self.assertIn(key, item._cache)
+        self.assertLessEqual(item._cache.nbytes(), item.cache_budget())
+
+    def test_cancel_prefetch(self):
+        executor = ThreadExecutor()
+        self.addCleanup(executor.shutdown)
+        item = DensityPatch(self.root, executor=executor)
+        self.assertIs(item._executor, executor)
+        started, release = threading.Event(), threading.Event()
+
+        def create(*args):
+            # block the prefetches, not the painted patch
+            if threading.current_thread() is not threading.main_thread():
+                started.set()
+                release.wait(5)
+            return lod_patch(*args)
+
+        image = QImage(100, 100, QImage.Format_ARGB32)
+        painter = QPainter(image)
+
+        class Option:
+            exposedRect = item.rect()
+
+        with patch("orangecontrib.prototypes.widgets.owscattermap."
+                   "lod_patch", create):
+            painter.scale(100 / 4, 100 / 2.5)
+            painter.translate(-4, -2)
+            item.paint(painter, Option, None)
+            painter.end()
+            self.assertTrue(item._prefetching)
+            futures = [w.future() for _, w in item._prefetching.values()]
+            self.assertTrue(started.wait(5))
+            # the prefetches of the replaced root are dropped
+            item.set_root(self.root)
+            self.assertEqual(item._prefetching, {})
+            release.set()
+            concurrent.futures.wait(futures, 5)
+        self.process_events()
+        self.assertEqual(len(item._cache), 0)
+
+
+class TestOWScatterMap(WidgetTest):
+    def setUp(self):
+        self.widget = self.create_widget(OWScatterMap)
+
+    def test_input(self):
+        iris = Table("iris")
+        self.widget.set_data(iris)
+        root = self.widget._root
+        self.assertIsNotNone(root)
+        self.assertEqual(root.contingencies[0].shape,
+                         (1, self.widget.n_bins, self.widget.n_bins, 3))
+        self.assertEqual(root.contingencies[0].sum(), len(iris))
+        self.widget.set_data(None)
+        self.assertIsNone(self.widget._root)
+
+    def test_no_discrete(self):
+        domain = Domain([ContinuousVariable("a"), ContinuousVariable("b")])
+        data = Table.from_numpy(domain, np.random.RandomState(0).rand(50, 2))
+        self.widget.set_data(data)
+        self.assertEqual(self.widget._root.contingencies[0].shape,
+                         (1, self.widget.n_bins, self.widget.n_bins))
+        self.assertEqual(self.widget._root.contingencies[0].sum(), 50)
+
+    def test_continuous_z(self):
+        iris = Table("iris")
+        self.widget.set_data(iris)
+        self.widget.z_var_index = self.widget.z_var_model.indexOf(
+            iris.domain[2])
+        self.widget._on_z_var_changed()
+        self.assertEqual(self.widget.z_values, [])
+        root = self.widget._root
+        self.assertEqual(root.contingencies[0].shape,
+                         (1, self.widget.n_bins, self.widget.n_bins, 3))
+        self.assertEqual(root.contingencies[0][..., 0].sum(), len(iris))
+        self.assertTrue(self.widget._item._aggregate)
+        self.widget.grab()
+
+        self.widget.sharpen()
+        self.process_events(until=lambda: self.widget._task is None)
+        self.assertGreater(self.widget._root.depth(), 1)
+
+    def test_precompute(self):
+        iris = Table("iris")
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("orangecontrib.prototypes.widgets.owscattermap."
+                      "cache_dir", return_value=tmp):
+            self.widget.precompute = True
+            self.widget.set_data(iris)
+            self.assertIsNotNone(self.widget._task)
+            self.process_events(until=lambda: self.widget._task is None)
+            self.assertEqual(self.widget._root.depth(),
+                             self.widget.pyramid_depth)
+
+            # the pyramid is loaded from disk
+            widget = self.create_widget(OWScatterMap,
+                                        stored_settings={"precompute": True})
+            widget.set_data(iris)
+            self.assertIsNone(widget._task)
+            self.assertEqual(widget._root.depth(), widget.pyramid_depth)
+
+    def test_progressive(self):
+        class FakeSqlTable(Table):
+            pass
+
+        iris = Table("iris")
+        indices = np.random.RandomState(0).permutation(len(iris))
+        sizes = [20, 40, 60, 80, 100, 120, 150]
+
+        def sample(_, level):
+            return Table.from_table_rows(iris, indices[:sizes[level]])
+
+        with patch("orangecontrib.prototypes.widgets.owscattermap."
+                   "SqlTable", FakeSqlTable), \
+                patch.object(OWScatterMap, "sample", staticmethod(sample)):
+            self.widget.set_data(FakeSqlTable.from_table(iris.domain, iris))
+            self.assertEqual(len(self.widget.dataset), 20)
+            # the map stays at the sampled level unless the user opts in
+            self.assertFalse(self.widget.progressive)
+            self.assertIsNone(self.widget._task)
+
+            self.widget.controls.progressive.click()
+            self.assertTrue(self.widget.progressive)
+            self.assertIsNotNone(self.widget._task)
+            self.process_events(until=lambda: self.widget._task is None)
+
+        self.assertEqual(self.widget.sample_level, len(sizes) - 1)
+        self.assertEqual(len(self.widget.dataset), len(iris))
+        self.assertEqual(self.widget._root.contingencies[0].sum(), len(iris))
+
+    def test_sharpen(self):
+        iris = Table("iris")
+        self.widget.set_data(iris)
+        self.assertEqual(self.widget._root.depth(), 1)
+        # lay out the plot, so the view is zoomed in enough to sharpen
+        self.widget.grab()
+        self.assertLess(self.widget._sampling_width(), 1)
+        self.widget.sharpen()
+        self.assertIsNotNone(self.widget._task)
+        self.assertIsNotNone(self.widget._task.region)
+        self.process_events(until=lambda: self.widget._task is None)
+        root = self.widget._root
+        self.assertGreater(root.depth(), 1)
+        self.assertEqual(root.contingencies[0].sum(), len(iris))
+
+        # nothing left to refine at this zoom level
+        self.widget.sharpen()
+        self.assertIsNone(self.widget._task)
+
+        # a new request supersedes the running one
+        self.widget.set_data(iris)
+        self.widget.sharpen()
+        task = self.widget._task
+        self.widget.sharpen()
+        self.assertTrue(task.cancelled)
+        self.process_events(until=lambda: self.widget._task is None)
+
+    def test_cancel_does_not_wait(self):
+        iris = Table("iris")
+        self.widget.set_data(iris)
+        self.widget.grab()
+        root = self.widget._root
+        started, release = threading.Event(), threading.Event()
+
+        def slow_grid_bin(*args, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                started.set()
+                release.wait(5)
+            return grid_bin(*args, **kwargs)
+
+        with patch("orangecontrib.prototypes.widgets.owscattermap."
+                   "grid_bin", slow_grid_bin):
+            self.widget.sharpen()
+            task = self.widget._task
+            self.assertTrue(started.wait(5))
+            # the running sharpen is cancelled without waiting for it ...
+            self.widget.cancel()
+            self.assertTrue(task.cancelled)
+            self.assertFalse(task.future.done())
+            self.assertIsNone(self.widget._task)
+            # ... and its result is dropped
+            release.set()
+            concurrent.futures.wait([task.future], 5)
+        self.process_events()
+        self.assertTrue(task.future.done())
+        self.assertIs(self.widget._root, root)
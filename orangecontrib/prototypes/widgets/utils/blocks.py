@@ -0,0 +1,610 @@
+"""Column statistics over (memory mapped) matrices processed in row blocks.
+
+Tables backed by `np.memmap` arrays may not fit into memory. Any fancy
+indexing (e.g. selecting a subset of columns) or a temporary of the same
+shape would load the whole matrix, so the statistics are instead
+accumulated over blocks of rows, each of which is read (and converted)
+separately.
+
+The reductions accept either a `ColumnBlocks` or a regular (dense or
+sparse) matrix, in which case they fall back to `Orange.statistics.util`.
+
+Sparse matrices are summarized directly from their CSC column data, with
+the implicit zeros counted rather than stored.
+
+The summaries (`Summary`) are mergeable: the summaries of two sets of rows
+of the same columns are combined with `merge_summaries`, so statistics of
+appended rows or of partitions computed in parallel need not be computed
+again from all the data.
+"""
+import mmap
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.stats as ss
+
+import Orange.statistics.util as ut
+
+#: Default (approximate) size in bytes of a block of rows
+BLOCK_BYTES = 32 * 2 ** 20
+#: The number of quantiles kept by the quantile sketches
+SKETCH_SIZE = 64
+
+
+def is_memmap(array):
+    """Return True if `array` is (a view of) a memory mapped file."""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def row_blocks(n_rows, row_bytes, block_bytes=BLOCK_BYTES):
+    """Return slices of consecutive rows with at most `block_bytes` each.
+
+    Parameters
+    ----------
+    n_rows : int
+    row_bytes : int
+        The size of a single row in bytes.
+    block_bytes : int
+
+    Returns
+    -------
+    List[slice]
+
+    """
+    step = max(1, block_bytes // max(row_bytes, 1))
+    return [slice(start, min(start + step, n_rows))
+            for start in range(0, n_rows, step)]
+
+
+class ColumnBlocks:
+    """A lazy selection of `columns` of a matrix, read in row blocks.
+
+    Parameters
+    ----------
+    x : Union[np.ndarray, sp.spmatrix]
+        A (memory mapped) 2d array or a sparse matrix.
+    columns : Optional[List[int]]
+        Column indices; all columns if None.
+    block_bytes : int
+        The (approximate) size of the blocks.
+
+    """
+    #: The blocks are converted to floats
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, x, columns=None, block_bytes=BLOCK_BYTES):
+        if sp.issparse(x):
+            x = x.tocsr()  # (for slicing rows)
+        self.x = x
+        if columns is None:
+            columns = np.arange(x.shape[1])
+        self.columns = np.asarray(columns, dtype=int)
+        self.block_bytes = block_bytes
+
+    @property
+    def shape(self):
+        return self.x.shape[0], len(self.columns)
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def __getitem__(self, key):
+        """Select a subset of columns (``blocks[:, indices]``) or a range of
+        rows (``blocks[start:stop, :]``, a view of the matrix)."""
+        rows, columns = key
+        assert isinstance(rows, slice) and rows.step in (None, 1), \
+            "Only ranges of rows can be selected"
+        x = self.x if rows == slice(None) else self.x[rows]
+        return ColumnBlocks(x, self.columns[columns], self.block_bytes)
+
+    def __iter__(self):
+        """Iterate over the (n_block_rows, n_columns) float blocks."""
+        for _, block in self.with_rows():
+            yield block
+
+    def with_rows(self):
+        """Iterate over pairs of row slices and the corresponding blocks.
+
+        Blocks of sparse matrices are converted to dense arrays.
+        """
+        row_bytes = self.x.shape[1] * self.x.dtype.itemsize
+        whole = len(self.columns) == self.x.shape[1] and \
+            np.array_equal(self.columns, np.arange(self.x.shape[1]))
+        for rows in row_blocks(self.x.shape[0], row_bytes, self.block_bytes):
+            block = self.x[rows]
+            if not whole:
+                block = block[:, self.columns]
+            if sp.issparse(block):
+                block = block.toarray()
+            yield rows, np.asarray(block, dtype=np.float64)
+
+
+def _reduce(x, func, combine, initial):
+    result = np.full(x.shape[1], initial, dtype=float)
+    for block in x:
+        result = combine(result, func(block))
+    return result
+
+
+def nanmin(x):
+    """Column-wise minimum ignoring NaNs."""
+    if not isinstance(x, ColumnBlocks):
+        return ut.nanmin(x, axis=0)
+    # fmin ignores NaNs (and does not warn on all-NaN columns)
+    return _reduce(x, lambda b: np.fmin.reduce(b, axis=0), np.fmin, np.nan)
+
+
+def nanmax(x):
+    """Column-wise maximum ignoring NaNs."""
+    if not isinstance(x, ColumnBlocks):
+        return ut.nanmax(x, axis=0)
+    return _reduce(x, lambda b: np.fmax.reduce(b, axis=0), np.fmax, np.nan)
+
+
+def countnans(x):
+    """Column-wise number of NaNs."""
+    if not isinstance(x, ColumnBlocks):
+        return ut.countnans(x, axis=0)
+    return _reduce(x, lambda b: np.isnan(b).sum(axis=0), np.add, 0)
+
+
+def _shifted_sums(block, missing, shift):
+    """Return the column-wise sums of the known values of `block` and of
+    their squares, both shifted by `shift`."""
+    dev = block - shift
+    np.copyto(dev, 0, where=missing)
+    return dev.sum(axis=0), np.einsum("ij,ij->j", dev, dev)
+
+
+def _first_shift(block, missing):
+    """Return column-wise shifts close to the means of the known values.
+
+    Summing squared deviations from a value close to the mean avoids the
+    cancellation of the plain sums of squares, so the variance can be
+    computed in a single pass over the data.
+    """
+    known = len(block) - missing.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shift = np.where(missing, 0, block).sum(axis=0) / known
+    return np.where(known > 0, shift, 0)
+
+
+def _moments_from_sums(count, shift, s1, s2):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, s1 / count, 0)
+    m2 = np.maximum(s2 - mean * s1, 0)
+    return count, shift + mean, m2
+
+
+def moments(x):
+    """Return the column-wise (count, mean, sum of squared deviations)."""
+    count = s1 = s2 = np.zeros(x.shape[1])
+    shift = None
+    for block in x:
+        missing = np.isnan(block)
+        if shift is None:
+            shift = _first_shift(block, missing)
+        count = count + (len(block) - missing.sum(axis=0))
+        b1, b2 = _shifted_sums(block, missing, shift)
+        s1, s2 = s1 + b1, s2 + b2
+    return _moments_from_sums(count, 0 if shift is None else shift, s1, s2)
+
+
+def nanmean(x):
+    """Column-wise mean ignoring NaNs."""
+    if not isinstance(x, ColumnBlocks):
+        return ut.nanmean(x, axis=0)
+    count, mean, _ = moments(x)
+    return np.where(count > 0, mean, np.nan)
+
+
+def nanvar(x):
+    """Column-wise (population) variance ignoring NaNs."""
+    if not isinstance(x, ColumnBlocks):
+        return ut.nanvar(x, axis=0)
+    count, _, m2 = moments(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, m2 / count, np.nan)
+
+
+def _widen(counts, width):
+    """Pad the value `counts` with zeros to (at least) `width` values."""
+    if counts.shape[1] >= width:
+        return counts
+    grown = np.zeros((counts.shape[0], width))
+    grown[:, :counts.shape[1]] = counts
+    return grown
+
+
+def _add_counts(counts, block, n_values=None):
+    """Add the value counts of `block` to `counts`, widening it if needed."""
+    if n_values is None:
+        top = np.fmax.reduce(block, axis=None) if block.size else np.nan
+        width = 0 if np.isnan(top) else int(top) + 1
+    else:
+        width = n_values
+    counts = _widen(counts, width)
+    width = counts.shape[1]
+    mask = ~np.isnan(block)
+    col = np.broadcast_to(np.arange(block.shape[1]), block.shape)[mask]
+    index = col * width + block[mask].astype(int)
+    counts += np.bincount(index, minlength=counts.size).reshape(counts.shape)
+    return counts
+
+
+def value_counts(x, n_values=None):
+    """Return a (n_columns, n_values) array of the counts of the discrete
+    (non-negative integer) values in each column. NaNs are not counted."""
+    counts = np.zeros((x.shape[1], n_values or 0))
+    for block in x:
+        counts = _add_counts(counts, block, n_values)
+    return counts
+
+
+def counts_mode(counts):
+    """Return the most frequent value (the smallest on ties) of each row of
+    value `counts`; NaN for rows without any values."""
+    if not counts.size:
+        return np.full(len(counts), np.nan)
+    return np.where(counts.any(axis=1), np.argmax(counts, axis=1), np.nan)
+
+
+def counts_entropy(counts):
+    """Return the entropy of each row of value `counts`."""
+    # (drop the zero counts, as `ut.bincount` does not report the values
+    # above the largest present one)
+    p = [pk[pk > 0] for pk in counts]
+    p = [pk / np.sum(pk) for pk in p]
+    return np.fromiter((ss.entropy(pk) for pk in p), dtype=np.float64,
+                       count=len(p))
+
+
+def mode(x):
+    """Column-wise mode of discrete values (the smallest on ties)."""
+    if not isinstance(x, ColumnBlocks):
+        return ss.mode(x)[0]
+    return counts_mode(value_counts(x))
+
+
+def categorical_entropy(x):
+    """Column-wise entropy of discrete values."""
+    if not isinstance(x, ColumnBlocks):
+        p = [ut.bincount(row)[0] for row in x.T]
+        p = [pk / np.sum(pk) for pk in p]
+        return np.fromiter((ss.entropy(pk) for pk in p), dtype=np.float64)
+    return counts_entropy(value_counts(x))
+
+
+#: An approximate, mergeable summary of the distributions of the columns:
+#: the number of known values and a (n_columns, SKETCH_SIZE) array of the
+#: values at evenly spaced quantiles, each standing for an equal share of
+#: the known values
+QuantileSketch = namedtuple("QuantileSketch", ["count", "points"])
+
+
+def _sketch_levels(size):
+    """The quantile levels of the points of a sketch."""
+    return (np.arange(size) + 0.5) / size
+
+
+def _ranked_quantiles(count, levels, value_at):
+    """Return the (n_columns, len(levels)) linearly interpolated quantiles
+    of columns with `count` known values; `value_at(columns, ranks)` returns
+    the values of the given ranks of the sorted known values."""
+    pos = levels[None, :] * np.maximum(count - 1, 0)[:, None]
+    low, high = np.floor(pos).astype(int), np.ceil(pos).astype(int)
+    columns = np.broadcast_to(np.arange(len(count))[:, None], pos.shape)
+    lower, upper = value_at(columns, low), value_at(columns, high)
+    with np.errstate(invalid="ignore"):
+        points = lower + (upper - lower) * (pos - low)
+    return np.where(count[:, None] > 0, points, np.nan)
+
+
+def _block_sketch(block, missing, size=SKETCH_SIZE):
+    """The quantile sketch of the columns of a dense block.
+
+    The points are the values at the sketch levels (interpolated between
+    the neighbouring ranks), found by partitioning (rather than sorting)
+    all the values of each column; columns with the same number of known
+    values are partitioned together.
+    """
+    count = (len(block) - missing.sum(axis=0)).astype(float)
+    levels = _sketch_levels(size)
+    points = np.full((block.shape[1], size), np.nan)
+    # (each column's values are contiguous in the transposed copy)
+    values = np.ascontiguousarray(block.T)
+    for known in np.unique(count[count > 0]):
+        group = np.flatnonzero(count == known)
+        pos = levels * (known - 1)
+        kth = np.unique(np.hstack((np.floor(pos), np.ceil(pos))).astype(int))
+        # (NaNs are partitioned last)
+        part = np.partition(values[group], kth, axis=1)
+        points[group] = _ranked_quantiles(
+            count[group], levels, lambda columns, ranks: part[columns, ranks])
+    return QuantileSketch(count, points)
+
+
+def _sketch_of_columns(block, missing, columns=None):
+    """The quantile sketch of (only) the given `columns` of a dense block;
+    the other columns have no known values in the sketch."""
+    if columns is None:
+        return _block_sketch(block, missing)
+    sketch = _block_sketch(block[:, columns], missing[:, columns])
+    count = np.zeros(block.shape[1])
+    points = np.full((block.shape[1], sketch.points.shape[1]), np.nan)
+    count[columns], points[columns] = sketch.count, sketch.points
+    return QuantileSketch(count, points)
+
+
+def quantile_sketch(x):
+    """Return the `QuantileSketch` of the columns of `x` (a single pass over
+    the blocks of dense matrices)."""
+    if sp.issparse(x):
+        return _summarize_sparse(x, sketch=True).sketch
+    if not isinstance(x, ColumnBlocks):
+        x = ColumnBlocks(x)
+    sketch = None
+    for block in x:
+        block_sketch = _block_sketch(block, np.isnan(block))
+        sketch = block_sketch if sketch is None else \
+            merge_sketches(sketch, block_sketch)
+    if sketch is None:
+        sketch = QuantileSketch(np.zeros(x.shape[1]),
+                                np.full((x.shape[1], SKETCH_SIZE), np.nan))
+    return sketch
+
+
+def merge_sketches(a, b):
+    """Merge the quantile sketches of two sets of rows of the same columns.
+
+    The points of both sketches, weighted by the shares of the values they
+    stand for, are sorted and the merged points are interpolated at the
+    quantile levels of the (weighted) empirical distribution.
+    """
+    size = a.points.shape[1]
+    count = a.count + b.count
+    points = np.hstack((a.points, b.points))
+    weights = np.hstack((np.repeat(a.count[:, None] / size, size, axis=1),
+                         np.repeat(b.count[:, None] / size, size, axis=1)))
+    unknown = np.isnan(points)
+    weights[unknown] = 0
+    points[unknown] = np.inf
+    order = np.argsort(points, axis=1, kind="mergesort")
+    points = np.take_along_axis(points, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+    total = weights.sum(axis=1)[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cdf = (np.cumsum(weights, axis=1) - weights / 2) / total
+    # (the points without weight are placed after all the levels)
+    cdf = np.where(weights > 0, cdf, 2)
+
+    # Find the points around each level for all columns at once, with
+    # the cdfs of the rows offset so that they increase over the array
+    n_columns, width = points.shape
+    rows = np.arange(n_columns)[:, None]
+    levels = _sketch_levels(size)
+    above = np.searchsorted((cdf + 3 * rows).ravel(),
+                            (levels + 3 * rows).ravel(), side="right")
+    above = above.reshape(n_columns, size) - rows * width
+    last = np.maximum((weights > 0).sum(axis=1)[:, None] - 1, 0)
+    upper = np.minimum(above, last)
+    lower = np.minimum(np.maximum(above - 1, 0), last)
+    c_low = np.take_along_axis(cdf, lower, axis=1)
+    c_high = np.take_along_axis(cdf, upper, axis=1)
+    p_low = np.take_along_axis(points, lower, axis=1)
+    p_high = np.take_along_axis(points, upper, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.clip(np.where(c_high > c_low,
+                             (levels - c_low) / (c_high - c_low), 0), 0, 1)
+        merged = p_low + (p_high - p_low) * t
+    return QuantileSketch(count,
+                          np.where(total > 0, merged, np.nan))
+
+
+def sketch_quantiles(sketch, q):
+    """Return the approximate `q`-quantiles (in [0, 1]) of the columns.
+
+    The quantiles are interpolated between the points of the sketch; an
+    array of `q` gives a (len(q), n_columns) array.
+    """
+    size = sketch.points.shape[1]
+    pos = np.clip(np.asarray(q, dtype=float) * size - 0.5, 0, size - 1)
+    low, high = np.floor(pos).astype(int), np.ceil(pos).astype(int)
+    lower, upper = sketch.points[:, low], sketch.points[:, high]
+    return (lower + (upper - lower) * (pos - low)).T
+
+
+#: Column statistics accumulated by `summarize`; the quantile `sketch` is
+#: None unless requested
+Summary = namedtuple(
+    "Summary", ["count", "nans", "min", "max", "mean", "m2", "counts",
+                "sketch"], defaults=(None,))
+
+
+def merge_summaries(a, b):
+    """Merge the summaries of two sets of rows of the same columns.
+
+    The means and sums of squared deviations are combined with the
+    pairwise update of Chan et al. (the parallel form of Welford's
+    algorithm), so they stay accurate over many merges.
+    """
+    count = a.count + b.count
+    delta = b.mean - a.mean
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(count > 0, b.count / count, 0)
+    width = max(a.counts.shape[1], b.counts.shape[1])
+    sketch = None
+    if a.sketch is not None and b.sketch is not None:
+        sketch = merge_sketches(a.sketch, b.sketch)
+    return Summary(
+        count, a.nans + b.nans,
+        np.fmin(a.min, b.min), np.fmax(a.max, b.max),
+        a.mean + delta * share,
+        a.m2 + b.m2 + delta ** 2 * a.count * share,
+        _widen(a.counts, width) + _widen(b.counts, width),
+        sketch)
+
+
+def concatenate_summaries(summaries):
+    """Concatenate the (non-empty list of) summaries of blocks of columns."""
+    width = max(s.counts.shape[1] for s in summaries)
+    fields = [np.hstack(values) for values in zip(*(s[:6] for s in summaries))]
+    counts = np.vstack([_widen(s.counts, width) for s in summaries])
+    sketch = None
+    if all(s.sketch is not None for s in summaries):
+        sketch = QuantileSketch(
+            np.hstack([s.sketch.count for s in summaries]),
+            np.vstack([s.sketch.points for s in summaries]))
+    return Summary(*fields, counts, sketch)
+
+
+def summarize(x, discrete=(), sketch=False, sketch_columns=None):
+    """Compute the column statistics of `x` in a single pass over its blocks.
+
+    Parameters
+    ----------
+    x : Union[ColumnBlocks, np.ndarray, sp.spmatrix]
+        A matrix; arrays are read in blocks of rows as well, and sparse
+        matrices are summarized without densifying them.
+    discrete : List[int]
+        Indices of (discrete) columns whose values are counted.
+    sketch : bool
+        Also compute the quantile sketches of the columns.
+    sketch_columns : Optional[List[int]]
+        Indices of the columns to sketch (all if None); the others have no
+        known values in the sketch.
+
+    Returns
+    -------
+    Summary
+        Column-wise number of known values, number of NaNs, minimum,
+        maximum, mean, sum of squared deviations from the mean, a
+        (len(discrete), n_values) array of value counts and the quantile
+        sketch (if requested).
+
+    """
+    if sp.issparse(x):
+        return _summarize_sparse(x, discrete, sketch, sketch_columns)
+    if not isinstance(x, ColumnBlocks):
+        x = ColumnBlocks(x)
+    discrete = np.asarray(discrete, dtype=int)
+    if sketch_columns is not None:
+        sketch_columns = np.asarray(sketch_columns, dtype=int)
+    n_columns = x.shape[1]
+    nans = s1 = s2 = np.zeros(n_columns)
+    low = high = np.full(n_columns, np.nan)
+    shift = None
+    counts = np.zeros((len(discrete), 0))
+    quantiles = None
+    for block in x:
+        missing = np.isnan(block)
+        nans = nans + missing.sum(axis=0)
+        # fmin/fmax ignore NaNs (and do not warn on all-NaN columns)
+        low = np.fmin(low, np.fmin.reduce(block, axis=0))
+        high = np.fmax(high, np.fmax.reduce(block, axis=0))
+        if shift is None:
+            shift = _first_shift(block, missing)
+        b1, b2 = _shifted_sums(block, missing, shift)
+        s1, s2 = s1 + b1, s2 + b2
+        if len(discrete):
+            counts = _add_counts(counts, block[:, discrete])
+        if sketch:
+            block_sketch = _sketch_of_columns(block, missing, sketch_columns)
+            quantiles = block_sketch if quantiles is None else \
+                merge_sketches(quantiles, block_sketch)
+    count, mean, m2 = _moments_from_sums(
+        x.shape[0] - nans, 0 if shift is None else shift, s1, s2)
+    if sketch and quantiles is None:
+        quantiles = QuantileSketch(np.zeros(n_columns),
+                                   np.full((n_columns, SKETCH_SIZE), np.nan))
+    return Summary(count, nans, low, high, mean, m2, counts, quantiles)
+
+
+def _summarize_sparse(x, discrete=(), sketch=False, sketch_columns=None):
+    """`summarize` a sparse matrix from its CSC column data.
+
+    The stored values are reduced per column (`np.bincount` with weights
+    and `ufunc.reduceat`) and the implicit zeros are accounted for by their
+    number in each column.
+    """
+    x = sp.csc_matrix(x)
+    if not x.has_canonical_format:
+        x = x.copy()
+        x.sum_duplicates()
+    n_rows, n_columns = x.shape
+    data = np.asarray(x.data, dtype=np.float64)
+    stored = np.diff(x.indptr)
+    zeros = n_rows - stored
+    columns = np.repeat(np.arange(n_columns), stored)
+
+    missing = np.isnan(data)
+    nans = np.bincount(columns[missing], minlength=n_columns).astype(float)
+    count = n_rows - nans
+    known = np.where(missing, 0, data)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(columns, known, minlength=n_columns) / count
+    mean = np.where(count > 0, mean, 0)
+    # (the squared deviations of the implicit zeros are mean ** 2)
+    dev = np.where(missing, 0, data - mean[columns])
+    m2 = np.bincount(columns, dev * dev, minlength=n_columns) + \
+        zeros * mean ** 2
+
+    low = high = np.full(n_columns, np.nan)
+    nonempty = stored > 0
+    if data.size:
+        # (the empty columns end where the next non-empty column starts)
+        starts = x.indptr[:-1][nonempty]
+        low, high = low.copy(), high.copy()
+        low[nonempty] = np.fmin.reduceat(data, starts)
+        high[nonempty] = np.fmax.reduceat(data, starts)
+    low = np.where(zeros > 0, np.fmin(low, 0), low)
+    high = np.where(zeros > 0, np.fmax(high, 0), high)
+
+    discrete = np.asarray(discrete, dtype=int)
+    counts = np.zeros((len(discrete), 0))
+    if len(discrete):
+        position = np.full(n_columns, -1)
+        position[discrete] = np.arange(len(discrete))
+        mask = ~missing & (position[columns] >= 0)
+        column, value = position[columns[mask]], data[mask].astype(int)
+        width = max(value.max() + 1 if value.size else 0,
+                    int(zeros[discrete].any()))
+        counts = np.bincount(column * width + value,
+                             minlength=len(discrete) * width)
+        counts = counts.reshape(len(discrete), width).astype(float)
+        if width:
+            counts[:, 0] += zeros[discrete]
+
+    quantiles = None
+    if sketch:
+        sketched = np.ones(n_columns, dtype=bool)
+        if sketch_columns is not None:
+            sketched[:] = False
+            sketched[np.asarray(sketch_columns, dtype=int)] = True
+        # The implicit zeros are ranked between the negative and the
+        # non-negative stored values of each column
+        in_sketch = ~missing & sketched[columns]
+        known_columns, known = columns[in_sketch], data[in_sketch]
+        values = known[np.lexsort((known, known_columns))]
+        if not values.size:
+            values = np.zeros(1)
+        n_known = np.bincount(known_columns, minlength=n_columns)
+        starts = np.cumsum(n_known) - n_known
+        negative = np.bincount(known_columns[known < 0], minlength=n_columns)
+
+        def value_at(column, rank):
+            neg, implicit = negative[column], zeros[column]
+            stored = np.where(rank < neg, rank, rank - implicit)
+            value = np.take(values, starts[column] + stored, mode="clip")
+            return np.where((rank >= neg) & (rank < neg + implicit), 0, value)
+
+        sketch_count = np.where(sketched, count, 0)
+        quantiles = QuantileSketch(sketch_count, _ranked_quantiles(
+            sketch_count, _sketch_levels(SKETCH_SIZE), value_at))
+    return Summary(count, nans, low, high, mean, m2, counts, quantiles)
@@ -1,3 +1,5 @@
+from collections import namedtuple
+
 import numpy as np
 from AnyQt.QtCore import Qt, QRectF, QSizeF, QPointF, QLineF
 from AnyQt.QtGui import QColor, QBrush, QPen
@@ -10,8 +12,8 @@ from AnyQt.QtWidgets import (
 from scipy import sparse as sp
 
 import Orange.statistics.util as ut
-from Orange.data.util import one_hot
 from Orange.widgets.utils.colorpalette import ContinuousPaletteGenerator
+from orangecontrib.prototypes.widgets.utils.blocks import ColumnBlocks
 
 
 class BarItem(QGraphicsWidget):
@@ -76,10 +78,11 @@ class ProportionalBarItem(QGraphicsLinearLayout):
         self._draw_bars()
 
     def _draw_bars(self):
-        heights, dist_sum = self.distribution, self.distribution.sum()
+        dist_sum = self.distribution.sum()
         # If the number of instances within a column is not 0, divide by that
         # sum to get the proportional height, otherwise set the height to 0
-        heights *= (dist_sum ** -1 if dist_sum != 0 else 0) * self.height
+        heights = self.distribution * \
+            (dist_sum ** -1 if dist_sum != 0 else 0) * self.height
 
         for idx, height in enumerate(heights):
             color = self.colors[idx] if self.colors else QColor('#ccc')
@@ -117,12 +120,17 @@ class Histogram(QGraphicsWidget):
         class_index : int
             The index of the target variable in ``'data'``.
         n_bins : int
+        counts : Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]
+            Precomputed (edges, distributions, means) of the histogram, e.g.
+            an item of ``'Histograms'``; ``'data'`` is then only used for
+            its domain.
 
     """
 
     def __init__(self, data, variable, parent=None, height=200,
                  width=300, side_padding=5, top_padding=20, bar_spacing=4,
-                 border=0, border_color=None, color_attribute=None, n_bins=10):
+                 border=0, border_color=None, color_attribute=None, n_bins=10,
+                 counts=None):
         super().__init__(parent)
         self.height, self.width = height, width
         self.padding = side_padding
@@ -131,34 +139,19 @@ class Histogram(QGraphicsWidget):
         self.data = data
         self.attribute = data.domain[variable]
 
-        self.x = data.get_column_view(self.attribute)[0].astype(np.float64)
-        self.x_nans = np.isnan(self.x)
-        self.x = self.x[~self.x_nans]
-
-        if self.attribute.is_discrete:
-            self.n_bins = len(self.attribute.values)
-        elif self.attribute.is_continuous:
-            # If the attribute is continuous but contains fewer values than the
-            # bins, it is better to assign each their own bin. We will require
-            # at least 2 bins so that the histogram still visually makes sense
-            # except if there is only a single value, then we use 3 bins for
-            # symmetry
-            num_unique = ut.nanunique(self.x).shape[0]
-            if num_unique == 1:
-                self.n_bins = 3
-            else:
-                self.n_bins = min(max(2, num_unique), n_bins)
-
         # Handle target variable index
         self.color_attribute = color_attribute
         if self.color_attribute is not None:
             self.target_var = data.domain[color_attribute]
-            self.y = data.get_column_view(color_attribute)[0]
-            self.y = self.y[~self.x_nans]
-            if not np.issubdtype(self.y.dtype, np.number):
-                self.y = self.y.astype(np.float64)
         else:
-            self.target_var, self.y = None, None
+            self.target_var = None
+
+        if counts is not None:
+            self.edges, self.distributions, self.means = counts
+            self.n_bins = len(self.distributions)
+        else:
+            self._init_data(n_bins)
+
 
         # Borders
         self.border_color = border_color if border_color is not None else '#000'
@@ -206,10 +199,51 @@ class Histogram(QGraphicsWidget):
         )
         self.__layout.setSpacing(bar_spacing)
 
+        self._draw_histogram()
+
+    def _init_data(self, n_bins):
+        """Compute the histogram from the data."""
+        x, rows = column_values(self.data, self.attribute)
+        known = ~np.isnan(x)
+        self.x = x[known]
+        # The rows of a sparse column which are not stored are zeros
+        self.n_zeros = 0 if rows is None else len(self.data) - len(x)
+
+        if self.attribute.is_discrete:
+            self.n_bins = len(self.attribute.values)
+        elif self.attribute.is_continuous:
+            # If the attribute is continuous but contains fewer values than the
+            # bins, it is better to assign each their own bin. We will require
+            # at least 2 bins so that the histogram still visually makes sense
+            # except if there is only a single value, then we use 3 bins for
+            # symmetry
+            num_unique = ut.nanunique(self._known_values()).shape[0]
+            if num_unique == 1:
+                self.n_bins = 3
+            else:
+                self.n_bins = min(max(2, num_unique), n_bins)
+
+        self.y = self.y_zeros = None
+        if self.target_var is not None:
+            y = dense_column(self.data, self.color_attribute)
+            if rows is None:
+                self.y = y[known]
+            else:
+                self.y = y[rows[known]]
+                zeros = np.ones(len(y), dtype=bool)
+                zeros[rows] = False
+                self.y_zeros = y[zeros]
+
         # If the data contains any non-NaN values, we can draw a histogram
-        if self.x.size > 0:
-            self.edges, self.distributions = self._histogram()
-            self._draw_histogram()
+        self.edges = self.distributions = self.means = None
+        if self.x.size + self.n_zeros > 0:
+            self.edges, self.distributions, self.means = self._histogram()
+
+    def _known_values(self):
+        """The distinct known values (including the zero of sparse data)."""
+        if self.n_zeros:
+            return np.hstack((self.x, [0.]))
+        return self.x
 
     def _get_histogram_edges(self):
         """Get the edges in the histogram based on the attribute type.
@@ -229,7 +263,8 @@ class Histogram(QGraphicsWidget):
         if self.attribute.is_discrete:
             return np.array([self.attribute.to_val(v) for v in self.attribute.values])
         else:
-            edges = np.linspace(ut.nanmin(self.x), ut.nanmax(self.x), self.n_bins)
+            values = self._known_values()
+            edges = np.linspace(np.min(values), np.max(values), self.n_bins)
             edge_diff = edges[1] - edges[0]
             edges = np.hstack((edges, [edges[-1] + edge_diff]))
 
@@ -240,7 +275,7 @@ class Histogram(QGraphicsWidget):
 
             return edges
 
-    def _get_bin_distributions(self, bin_indices):
+    def _get_bin_distributions(self, bin_indices, zero_bin):
         """Compute the distribution of instances within bins.
 
         Parameters
@@ -248,6 +283,8 @@ class Histogram(QGraphicsWidget):
         bin_indices : np.ndarray
             An array with same shape as `x` but containing the bin index of the
             instance.
+        zero_bin : int
+            The bin index of the zeros which are not stored in sparse data.
 
         Returns
         -------
@@ -257,70 +294,61 @@ class Histogram(QGraphicsWidget):
 
         """
         if self.target_var and self.target_var.is_discrete:
-            y = self.y
-            # TODO This probably also isn't the best handling of sparse data...
-            if sp.issparse(y):
-                y = np.squeeze(np.array(y.todense()))
-
-            # Since y can contain missing values, we need to filter them out as
-            # well as their corresponding `x` values
-            y_nan_mask = np.isnan(y)
-            y, bin_indices = y[~y_nan_mask], bin_indices[~y_nan_mask]
-
-            y = one_hot(y)
-            # In the event that y does not take up all the values and the
-            # largest discrete value does not appear at all, one hot encoding
-            # will produce too few columns. This causes problems, so we need to
-            # pad y with zeros to properly compute the distribution
-            if y.shape[1] != len(self.target_var.values):
-                n_missing_columns = len(self.target_var.values) - y.shape[1]
-                y = np.hstack((y, np.zeros((y.shape[0], n_missing_columns))))
-
-            bins = np.arange(self.n_bins)[:, np.newaxis]
-            mask = bin_indices == bins
-            distributions = np.zeros((self.n_bins, y.shape[1]))
-            for bin_idx in range(self.n_bins):
-                distributions[bin_idx] = y[mask[bin_idx]].sum(axis=0)
+            n_classes = len(self.target_var.values)
+            distributions = bin_counts(
+                bin_indices, self.n_bins, self.y, n_classes)
+            if self.n_zeros:
+                distributions[zero_bin] += bin_counts(
+                    np.zeros(self.n_zeros, dtype=np.intp), 1, self.y_zeros,
+                    n_classes)[0]
         else:
-            distributions, _ = ut.bincount(bin_indices.astype(np.int64))
-            # To keep things consistent across different variable types, we
-            # want to return a 2d array where the first dim represent different
-            # bins, and the second the distributions.
-            distributions = distributions[:, np.newaxis]
-
+            distributions = bin_counts(bin_indices, self.n_bins)
+            distributions[zero_bin] += self.n_zeros
         return distributions
 
+    def _get_bin_means(self, bin_indices, zero_bin):
+        """Compute the mean (continuous) target value in bins, divided by the
+        largest target value."""
+        sums, counts = bin_sums(bin_indices, self.n_bins, self.y)
+        y_max = ut.nanmax(self.y) if self.y.size else np.nan
+        if self.n_zeros:
+            zero_sums, zero_counts = bin_sums(
+                np.zeros(self.n_zeros, dtype=np.intp), 1, self.y_zeros)
+            sums[zero_bin] += zero_sums[0]
+            counts[zero_bin] += zero_counts[0]
+            y_max = np.fmax(y_max, ut.nanmax(self.y_zeros))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts / y_max
+
     def _histogram(self):
-        assert self.x.size > 0, 'Cannot calculate histogram on empty array'
+        assert self.x.size + self.n_zeros > 0, \
+            'Cannot calculate histogram on empty array'
         edges = self._get_histogram_edges()
 
         if self.attribute.is_discrete:
-            bin_indices = self.x
-            # TODO It probably isn't a very good idea to convert a sparse row
-            # to a dense array... Converts sparse to 1d numpy array
-            if sp.issparse(bin_indices):
-                bin_indices = np.squeeze(np.asarray(
-                    bin_indices.todense(), dtype=np.int64
-                ))
+            bin_indices = self.x.astype(np.intp)
+            zero_bin = 0
         elif self.attribute.is_continuous:
-            bin_indices = ut.digitize(self.x, bins=edges[1:-1]).flatten()
+            bin_indices = np.digitize(self.x, bins=edges[1:-1])
+            zero_bin = np.digitize(0, bins=edges[1:-1])
 
-        distributions = self._get_bin_distributions(bin_indices)
+        distributions = self._get_bin_distributions(bin_indices, zero_bin)
+        means = None
+        if self.target_var and self.target_var.is_continuous:
+            means = self._get_bin_means(bin_indices, zero_bin)
 
-        return edges, distributions
+        return edges, distributions, means
 
     def _draw_histogram(self):
         # In case the data for the variable were all NaNs, then the
         # distributions will be empty, and we don't need to display any bars
-        if self.x.size == 0:
+        if self.distributions is None or not self.distributions.sum():
             return
 
-        # In case we have a target var, but the values are all NaNs, then there
-        # is no sense in displaying anything
-        if self.target_var:
-            y_nn = self.y[~np.isnan(self.y)]
-            if y_nn.size == 0:
-                return
+        # In case we have a (continuous) target var, but the values are all
+        # NaNs, then there is no sense in displaying anything
+        if self.means is not None and np.all(np.isnan(self.means)):
+            return
 
         if self.distributions.ndim > 1:
             largest_bin_count = self.distributions.sum(axis=1).max()
@@ -348,28 +376,7 @@ class Histogram(QGraphicsWidget):
 
     def _get_colors(self):
         """Compute colors for different kinds of histograms."""
-        if self.target_var and self.target_var.is_discrete:
-            colors = [[QColor(*color) for color in self.target_var.colors]] * self.n_bins
-
-        elif self.target_var and self.target_var.is_continuous:
-            palette = ContinuousPaletteGenerator(*self.target_var.colors)
-
-            bins = np.arange(self.n_bins)[:, np.newaxis]
-            edges = self.edges if self.attribute.is_discrete else self.edges[1:-1]
-            # Need to digitize on `right` here so the samples will be assigned
-            # to the correct bin for coloring
-            bin_indices = ut.digitize(self.x, bins=edges, right=True)
-            mask = bin_indices == bins
-
-            colors = []
-            for bin_idx in range(self.n_bins):
-                mean = ut.nanmean(self.y[mask[bin_idx]], axis=0) / self.y.max()
-                colors.append([palette[mean]])
-
-        else:
-            colors = [[QColor('#ccc')]] * self.n_bins
-
-        return colors
+        return histogram_colors(self.n_bins, self.target_var, self.means)
 
     def boundingRect(self):
         return QRectF(0, 0, self.width, self.height)
@@ -381,6 +388,378 @@ class Histogram(QGraphicsWidget):
         return QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 
 
+def histogram_colors(n_bins, target_var=None, means=None):
+    """Return the colors of the parts of the bars of a histogram.
+
+    Parameters
+    ----------
+    n_bins : int
+    target_var : Optional[Variable]
+    means : Optional[np.ndarray]
+        The mean target value in each bin (divided by the largest target
+        value) for a continuous `target_var`.
+
+    Returns
+    -------
+    List[List[QColor]]
+        The colors of the target values (or of the whole bar) in each bin.
+
+    """
+    if target_var and target_var.is_discrete:
+        return [[QColor(*color) for color in target_var.colors]] * n_bins
+
+    elif target_var and target_var.is_continuous:
+        palette = ContinuousPaletteGenerator(*target_var.colors)
+        return [[palette[mean]] for mean in means]
+
+    return [[QColor('#ccc')]] * n_bins
+
+
+#: The counts and colors of a histogram's bars, see `paint_histogram`
+HistogramItem = namedtuple("HistogramItem", ["distributions", "colors"])
+
+
+def paint_histogram(painter, rect, distributions, colors, width=300,
+                    height=200, side_padding=5, top_padding=20,
+                    bar_spacing=4, border=2, border_color='#ccc'):
+    """Paint the bars of a histogram directly with a `painter`.
+
+    Paints the same picture as ``'Histogram'`` (with a bottom border) of the
+    given `width` and `height`, scaled into `rect`, but without creating any
+    graphics items.
+
+    Parameters
+    ----------
+    painter : QPainter
+    rect : QRectF
+    distributions : np.ndarray
+        The (n_bins, n_target_values) counts in bins.
+    colors : List[List[QColor]]
+        The colors of the target values in each bin (see
+        ``'histogram_colors'``).
+
+    """
+    painter.save()
+    painter.translate(rect.topLeft())
+    painter.scale(rect.width() / width, rect.height() / height)
+
+    if border:
+        pen = QPen(QColor(border_color))
+        pen.setCosmetic(True)
+        pen.setWidth(border)
+        painter.setPen(pen)
+        painter.drawLine(QLineF(0, height, width, height))
+
+    n_bins = len(distributions)
+    totals = distributions.sum(axis=1)
+    largest = totals.max() if n_bins else 0
+    if largest > 0:
+        plot_height = height - top_padding - border / 2
+        bar_width = (width - 2 * side_padding - (n_bins - 1) * bar_spacing) \
+            / n_bins
+        bottom = height - border / 2
+        for i, (distribution, total) in enumerate(zip(distributions, totals)):
+            top = bottom - total / largest * plot_height
+            left = side_padding + i * (bar_width + bar_spacing)
+            # The target values are stacked from the top down
+            for count, color in zip(distribution, colors[i]):
+                bar_height = count / largest * plot_height
+                painter.fillRect(QRectF(left, top, bar_width, bar_height),
+                                 color)
+                top += bar_height
+    painter.restore()
+
+
+def column_values(data, variable):
+    """Return the values of `variable` in `data` and their row indices.
+
+    Only the stored values of sparse columns are returned (the others are
+    zeros), without converting the column to a dense array.
+
+    Returns
+    -------
+    Tuple[np.ndarray, Optional[np.ndarray]]
+        The (float) values and their rows; rows is None for dense columns
+        (that is, all rows).
+
+    """
+    index = data.domain.index(variable)
+    if 0 <= index < data.X.shape[1]:
+        matrix, column = data.X, index
+    elif index >= 0:
+        matrix, column = data._Y, index - data.X.shape[1]
+    else:
+        matrix, column = data.metas, -1 - index
+    if not sp.issparse(matrix):
+        return data.get_column_view(variable)[0].astype(np.float64), None
+    column = sp.csc_matrix(matrix[:, column])
+    column.sort_indices()
+    return column.data.astype(np.float64), column.indices
+
+
+def dense_column(data, variable):
+    """Return the values of `variable` in `data` as a dense float array."""
+    values, rows = column_values(data, variable)
+    if rows is None:
+        return values
+    column = np.zeros(len(data))
+    column[rows] = values
+    return column
+
+
+def bin_counts(bin_indices, n_bins, y=None, n_classes=None):
+    """Count the values in bins, split by discrete target values.
+
+    Parameters
+    ----------
+    bin_indices : np.ndarray
+        The (integer) bin indices of the values.
+    n_bins : int
+    y : Optional[np.ndarray]
+        The target values; the values with unknown targets are skipped.
+    n_classes : Optional[int]
+        The number of target values.
+
+    Returns
+    -------
+    np.ndarray
+        A (n_bins, n_classes) array of counts, or (n_bins, 1) without `y`.
+
+    """
+    bin_indices = np.asarray(bin_indices, dtype=np.intp)
+    if y is None:
+        counts = np.bincount(bin_indices, minlength=n_bins)
+        return counts[:n_bins, np.newaxis].astype(np.float64)
+    known = ~np.isnan(y)
+    # A single bincount of the combined (bin, target value) indices
+    index = bin_indices[known] * n_classes + y[known].astype(np.intp)
+    counts = np.bincount(index, minlength=n_bins * n_classes)
+    return counts[:n_bins * n_classes].reshape(n_bins, n_classes) \
+        .astype(np.float64)
+
+
+def bin_sums(bin_indices, n_bins, y):
+    """Return the sums and the numbers of the known values `y` in bins."""
+    bin_indices = np.asarray(bin_indices, dtype=np.intp)
+    known = ~np.isnan(y)
+    return (np.bincount(bin_indices[known], weights=y[known],
+                        minlength=n_bins)[:n_bins],
+            np.bincount(bin_indices[known], minlength=n_bins)[:n_bins])
+
+
+class HistogramBins(namedtuple("HistogramBins",
+                               ["n_bins", "low", "step", "last"])):
+    """The bins of the histograms of many variables.
+
+    The edges of the `n_bins` bins of a histogram are ``low + i * step``
+    except for the last inner edge (the edge at ``n_bins - 1``), which is
+    `last`. The last bin also contains all the larger values.
+    """
+    @property
+    def offsets(self):
+        """The indices of the first bins in the concatenated bins."""
+        return np.r_[0, np.cumsum(self.n_bins)]
+
+    def edges(self, i):
+        """Return the ``n_bins + 1`` edges of the i-th histogram."""
+        n, low, step = self.n_bins[i], self.low[i], self.step[i]
+        edges = low + np.arange(n + 1) * step
+        if n:
+            edges[n - 1], edges[n] = self.last[i], self.last[i] + step
+        return edges
+
+    def digitize(self, x):
+        """Return the bin indices of the (n_rows, n_variables) values `x`.
+
+        Unknown values stay NaN.
+        """
+        top = np.maximum(self.n_bins - 1., 0)
+        with np.errstate(invalid="ignore"):
+            k = x - self.low
+            k /= self.step
+            np.floor(k, out=k)
+            np.maximum(k, 0, out=k)
+            np.minimum(k, top, out=k)
+            # The edges are computed as in `np.linspace`, so correct the
+            # indices which are off by one due to rounding (the masks are
+            # viewed as integers, which is much faster than bool arithmetic)
+            below = x < self._edge(k, top)
+            np.subtract(k, below.view(np.int8), out=k, casting="unsafe")
+            above = (k < top) & (x >= self._edge(k + 1, top))
+            np.add(k, above.view(np.int8), out=k, casting="unsafe")
+        return k
+
+    def _edge(self, k, top):
+        edge = k * self.step
+        edge += self.low
+        np.copyto(edge, np.broadcast_to(self.last, edge.shape),
+                  where=k == top)
+        return edge
+
+
+def histogram_bins(x, variables, n_bins=10):
+    """Compute the bins of the histograms of `variables`.
+
+    Discrete variables have a bin for each value. Continuous variables
+    have `n_bins` equal width bins over their range, or a bin for each
+    value if there are fewer distinct values (but at least 2 bins, and 3
+    for a single value, so it sits in the middle). Variables without known
+    values have no bins.
+
+    Parameters
+    ----------
+    x : Union[ColumnBlocks, np.ndarray, sp.spmatrix]
+        The (n_rows, len(variables)) values.
+    variables : List[Variable]
+    n_bins : int
+
+    Returns
+    -------
+    HistogramBins
+
+    """
+    if not isinstance(x, ColumnBlocks):
+        x = ColumnBlocks(x)
+    n_columns = len(variables)
+    discrete = np.array([var.is_discrete for var in variables], dtype=bool)
+    n = np.array([len(var.values) if var.is_discrete else 0
+                  for var in variables], dtype=int)
+    low, step = np.zeros(n_columns), np.ones(n_columns)
+    last = n - 1.
+
+    cont = np.flatnonzero(~discrete)
+    if len(cont):
+        minimum, maximum, n_unique = _count_distinct(x[:, cont], n_bins)
+        n_cont = np.where(n_unique == 1, 3, np.clip(n_unique, 2, n_bins))
+        n_cont[n_unique == 0] = 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            step_cont = (maximum - minimum) / (n_cont - 1)
+        single = n_unique == 1
+        n[cont] = n_cont
+        low[cont] = np.where(single, minimum - 1.5, minimum)
+        step[cont] = np.where(single | (n_unique == 0), 1, step_cont)
+        last[cont] = np.where(single, minimum + .5, maximum)
+    return HistogramBins(n, low, step, last)
+
+
+def _count_distinct(x, cap):
+    """Return the column-wise minima, maxima and the numbers of distinct
+    known values, counting at most `cap` of them."""
+    n_columns = x.shape[1]
+    minimum = maximum = np.full(n_columns, np.nan)
+    seen = np.full((cap, n_columns), np.nan)
+    n_distinct = np.zeros(n_columns, dtype=int)
+    for block in x:
+        minimum = np.fmin(minimum, np.fmin.reduce(block, axis=0))
+        maximum = np.fmax(maximum, np.fmax.reduce(block, axis=0))
+        # Columns with `cap` distinct values are done
+        active = np.flatnonzero(n_distinct < cap)
+        if not active.size:
+            continue
+        values = np.vstack((seen[:, active], block[:, active]))
+        values.sort(axis=0)  # NaNs are last
+        values[1:][values[1:] == values[:-1]] = np.nan
+        values.sort(axis=0)
+        seen[:, active] = values[:cap]
+        n_distinct[active] = np.count_nonzero(~np.isnan(values[:cap]), axis=0)
+    return minimum, maximum, n_distinct
+
+
+class Histograms:
+    """The histograms of many variables in flat (concatenated) arrays.
+
+    Parameters
+    ----------
+    bins : HistogramBins
+    counts : np.ndarray
+        A (bins.n_bins.sum(), n_target_values) array of the counts in bins
+        of all histograms; the second dimension is 1 unless the target is
+        discrete.
+    means : Optional[np.ndarray]
+        The mean (continuous) target value in each bin, divided by the
+        largest target value.
+
+    """
+    def __init__(self, bins, counts, means=None):
+        self.bins = bins
+        self.counts = counts
+        self.means = means
+        self.offsets = bins.offsets
+
+    def __len__(self):
+        return len(self.bins.n_bins)
+
+    def __getitem__(self, i):
+        """Return the (edges, distributions, means) of the i-th histogram."""
+        bins = slice(self.offsets[i], self.offsets[i + 1])
+        means = None if self.means is None else self.means[bins]
+        return self.bins.edges(i), self.counts[bins], means
+
+
+    @classmethod
+    def concatenate(cls, histograms):
+        """Concatenate the histograms of (different) variables."""
+        bins = HistogramBins(*map(np.concatenate,
+                                  zip(*(h.bins for h in histograms))))
+        means = None
+        if histograms[0].means is not None:
+            means = np.concatenate([h.means for h in histograms])
+        return cls(bins, np.vstack([h.counts for h in histograms]), means)
+
+
+def compute_histograms(x, bins, y=None, target_var=None):
+    """Count the values of all columns of `x` in `bins` in a single pass.
+
+    Parameters
+    ----------
+    x : Union[ColumnBlocks, np.ndarray, sp.spmatrix]
+        The (n_rows, n_variables) values.
+    bins : HistogramBins
+        The bins of the columns (see `histogram_bins`).
+    y : Optional[np.ndarray]
+        The values of the target (color) variable; the counts are split by
+        the values of a discrete target.
+    target_var : Optional[Variable]
+
+    Returns
+    -------
+    Histograms
+
+    """
+    if not isinstance(x, ColumnBlocks):
+        x = ColumnBlocks(x)
+    offsets = bins.offsets
+    n_total = offsets[-1]
+    by_class = target_var is not None and target_var.is_discrete
+    n_classes = len(target_var.values) if by_class else 1
+    counts = np.zeros(n_total * n_classes)
+    if y is not None and not by_class:
+        sums, n_known = np.zeros(n_total), np.zeros(n_total)
+
+    for rows, block in x.with_rows():
+        k = bins.digitize(block)
+        known = ~np.isnan(k)
+        # The indices of the bins in the concatenated bins
+        index = (k + offsets[:-1])[known].astype(np.intp)
+        if y is None:
+            counts += bin_counts(index, n_total).ravel()
+            continue
+        y_ = np.broadcast_to(y[rows, np.newaxis], k.shape)[known]
+        if by_class:
+            counts += bin_counts(index, n_total, y_, n_classes).ravel()
+        else:
+            counts += bin_counts(index, n_total).ravel()
+            block_sums, block_counts = bin_sums(index, n_total, y_)
+            sums += block_sums
+            n_known += block_counts
+
+    means = None
+    if y is not None and not by_class:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / n_known / ut.nanmax(y)
+    return Histograms(bins, counts.reshape(n_total, n_classes), means)
+
+
 if __name__ == '__main__':
     import sys
     from Orange.data.table import Table